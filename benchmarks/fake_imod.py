@@ -0,0 +1,113 @@
+"""A stand-in IMOD installation for running the wrapper without IMOD.
+
+`fake_imod()` puts `imod` and `batchruntomo` executables on the PATH and sets
+IMOD_DIR. The fake batchruntomo prints the command files of each step like
+the real one, sleeps for FAKE_BATCHRUNTOMO_DELAY seconds per step and writes
+plausible .xf, .tlt and align.log files.
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+FAKE_IMOD_VERSION = '4.11.24'
+DELAY_ENVIRONMENT_VARIABLE = 'FAKE_BATCHRUNTOMO_DELAY'
+
+BATCHRUNTOMO = '''#!{python}
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+COMFILES = {{
+    0: 'copytomocoms', 1: 'eraser', 2: 'xcorr', 3: 'prenewst',
+    4: 'xcorr_pt', 5: 'track', 6: 'align',
+}}
+
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+directory = Path(args['-CurrentLocation'])
+basename = args['-RootName']
+starting_step = int(args.get('-StartingStep', 0))
+ending_step = int(args.get('-EndingStep', 6))
+delay = float(os.environ.get('{delay_variable}', 0))
+directive = {{}}
+for line in Path(args['-DirectiveFile']).read_text().splitlines():
+    if '=' in line:
+        key, value = line.split('=', 1)
+        directive[key.strip()] = value.strip()
+rotation = float(directive.get('setupset.copyarg.rotation', 0))
+tilt_angles = [
+    float(angle) for angle in (directory / f'{{basename}}.rawtlt').read_text().split()
+]
+
+for step in range(starting_step, ending_step + 1):
+    print(f'Running {{COMFILES[step]}}.com', flush=True)
+    time.sleep(delay)
+    if step == 0:
+        (directory / f'{{basename}}.edf').write_text('Setup.DataSource=CCD\\n')
+        (directory / 'xcorr.com').write_text('$tiltxcorr -StandardInput\\n')
+    elif step == 2:
+        (directory / f'{{basename}}.prexg').write_text(''.join(
+            f'1 0 0 1 {{i % 5 - 2:.3f}} {{i % 3 - 1:.3f}}\\n' for i in range(len(tilt_angles))
+        ))
+    elif step == 6:
+        theta = math.radians(-rotation)
+        c, s = math.cos(theta), math.sin(theta)
+        (directory / f'{{basename}}.xf').write_text(''.join(
+            f'{{c:.7f}} {{-s:.7f}} {{s:.7f}} {{c:.7f}} {{i % 7 - 3:.3f}} {{i % 5 - 2:.3f}}\\n'
+            for i in range(len(tilt_angles))
+        ))
+        (directory / f'{{basename}}.tlt').write_text(
+            ''.join(f'{{angle:.2f}}\\n' for angle in tilt_angles)
+        )
+        (directory / 'align.log').write_text(
+            f' RotationAngle = {{rotation}}\\n'
+            ' AngleOffset = 0.00\\n'
+            ' Residual error mean and sd:     0.360   0.457 nm\\n'
+        )
+print('Finished', flush=True)
+'''
+
+
+def install_fake_imod(imod_directory: Path) -> Path:
+    """Write a fake IMOD installation, returns the directory to add to the PATH."""
+    bin_directory = imod_directory / 'bin'
+    bin_directory.mkdir(parents=True, exist_ok=True)
+    (imod_directory / 'VERSION').write_text(f'{FAKE_IMOD_VERSION}\n')
+    executables = {
+        'batchruntomo': BATCHRUNTOMO.format(
+            python=sys.executable, delay_variable=DELAY_ENVIRONMENT_VARIABLE
+        ),
+        'imod': '#!/bin/sh\nexit 0\n',
+    }
+    for name, script in executables.items():
+        file = bin_directory / name
+        file.write_text(script)
+        file.chmod(0o755)
+    return bin_directory
+
+
+@contextmanager
+def fake_imod(delay: float = 0) -> Iterator[Path]:
+    """Use a fake IMOD installation within a block, yields IMOD_DIR."""
+    previous = {
+        name: os.environ.get(name)
+        for name in ('PATH', 'IMOD_DIR', DELAY_ENVIRONMENT_VARIABLE)
+    }
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        imod_directory = Path(temporary_directory)
+        bin_directory = install_fake_imod(imod_directory)
+        os.environ['PATH'] = f'{bin_directory}{os.pathsep}{os.environ.get("PATH", "")}'
+        os.environ['IMOD_DIR'] = str(imod_directory)
+        os.environ[DELAY_ENVIRONMENT_VARIABLE] = str(delay)
+        try:
+            yield imod_directory
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
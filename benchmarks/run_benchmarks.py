@@ -0,0 +1,241 @@
+"""Benchmarks for the wrapper's own overhead, IMOD is replaced by a fake.
+
+    python benchmarks/run_benchmarks.py --sizes 512 --sizes 1024 --workers 1 --workers 4
+"""
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+import typer
+
+from fake_imod import fake_imod
+from synthetic import generate_tilt_series, write_tilt_series
+from yet_another_imod_wrapper import align_many
+from yet_another_imod_wrapper.fiducials import generate_fiducial_based_alignment_directive
+from yet_another_imod_wrapper.patch_tracking import (
+    generate_patch_tracking_alignment_directive,
+)
+from yet_another_imod_wrapper.utils.etomo import (
+    get_residual_error,
+    get_input_tilt_axis_rotation_angle,
+    prepare_etomo_directory,
+)
+from yet_another_imod_wrapper.utils.io import read_tlt, read_xf
+from yet_another_imod_wrapper.utils.projection import (
+    get_projection_matrices,
+    project_points,
+)
+from yet_another_imod_wrapper.utils.xf import XF, XFBatch
+
+cli = typer.Typer(add_completion=False)
+TILT_ANGLES = np.linspace(-60, 60, 41)
+
+
+def best_time(func: Callable[[], object], repeat: int = 3) -> float:
+    """Best wall time of `repeat` calls in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark_staging(sizes: List[int], n_images: int, directory: Path) -> pd.DataFrame:
+    """Throughput of prepare_etomo_directory for array and file inputs."""
+    rows = []
+    for size in sizes:
+        float_series = generate_tilt_series(n_images, (size, size), np.float32)
+        integer_series = float_series.astype(np.uint16)
+        float_file = write_tilt_series(directory / f'float_{size}.mrc', float_series)
+        integer_file = write_tilt_series(directory / f'uint16_{size}.mrc', integer_series)
+        cases = {
+            'array float32': float_series,
+            'file float32 (linked)': float_file,
+            'file uint16 (converted)': integer_file,
+        }
+        for case, tilt_series in cases.items():
+            def stage(tilt_series=tilt_series, size=size):
+                # a fresh directory each repeat so nothing staged before is reused
+                staging_directory = tempfile.mkdtemp(prefix=f'staging_{size}_', dir=directory)
+                prepare_etomo_directory(
+                    directory=Path(staging_directory),
+                    tilt_series=tilt_series,
+                    tilt_angles=TILT_ANGLES[:n_images],
+                    basename='TS',
+                )
+            seconds = best_time(stage)
+            megabytes = float_series.nbytes / 1024 ** 2
+            rows.append({
+                'size': size, 'case': case, 'seconds': seconds,
+                'MB/s': megabytes / seconds,
+            })
+    return pd.DataFrame(rows)
+
+
+def benchmark_directive_generation(repeat: int = 1000) -> pd.DataFrame:
+    """Time per call to generate batchruntomo directives."""
+    generators = {
+        'fiducials': lambda: generate_fiducial_based_alignment_directive(
+            tilt_series_file='TS.mrc', pixel_size=1.35, fiducial_size=10,
+            rotation_angle=85,
+        ),
+        'patch_tracking': lambda: generate_patch_tracking_alignment_directive(
+            tilt_series_file='TS.mrc', pixel_size=1.35, rotation_angle=85,
+            patch_size_xy=(500, 500), patch_overlap_percentage=33,
+        ),
+    }
+    rows = []
+    for name, generate in generators.items():
+        seconds = best_time(lambda generate=generate: [generate() for _ in range(repeat)])
+        rows.append({'directive': name, 'microseconds per call': 1e6 * seconds / repeat})
+    return pd.DataFrame(rows)
+
+
+def benchmark_output_parsing(directory: Path, repeat: int = 1000) -> pd.DataFrame:
+    """Time per call to parse alignment outputs written by the fake batchruntomo."""
+    etomo_directory = directory / 'parsing'
+    align_many([_make_job(directory, 'parsing', n_images=41, size=64)], max_workers=1)
+    xf_file = etomo_directory / 'parsing.xf'
+    parsers = {
+        'read_xf': lambda: read_xf(xf_file),
+        'read_tlt': lambda: read_tlt(etomo_directory / 'parsing.tlt'),
+        'get_residual_error': lambda: get_residual_error(etomo_directory / 'align.log'),
+        'get_input_tilt_axis_rotation_angle': lambda: get_input_tilt_axis_rotation_angle(
+            etomo_directory / 'align.log'
+        ),
+        'XF.in_plane_rotations': lambda: XF.from_file(xf_file, 85).in_plane_rotations,
+    }
+    rows = []
+    for name, parse in parsers.items():
+        seconds = best_time(lambda parse=parse: [parse() for _ in range(repeat)])
+        rows.append({'parser': name, 'microseconds per call': 1e6 * seconds / repeat})
+    return pd.DataFrame(rows)
+
+
+def benchmark_xf_batch(n_series: int, n_images: int) -> pd.DataFrame:
+    """Rotations and shifts of many tilt-series, one XF each or one XFBatch."""
+    rng = np.random.default_rng(0)
+    angles = np.deg2rad(85 + rng.normal(scale=0.5, size=(n_series, n_images)))
+    xf_arrays = [
+        np.stack([
+            np.cos(theta), -np.sin(theta), np.sin(theta), np.cos(theta),
+            *rng.normal(scale=10, size=(2, n_images)),
+        ], axis=-1)
+        for theta in angles
+    ]
+
+    def per_series():
+        for xf_data in xf_arrays:
+            xf = XF(xf_data, 85)
+            _ = xf.in_plane_rotations, xf.image_shifts
+
+    def batched():
+        batch = XFBatch.from_arrays(xf_arrays, np.full(n_series, 85))
+        _ = batch.in_plane_rotations, batch.image_shifts
+
+    return pd.DataFrame([
+        {'container': name, 'tilt-series': n_series, 'milliseconds': 1e3 * best_time(func)}
+        for name, func in (('XF', per_series), ('XFBatch', batched))
+    ])
+
+
+def benchmark_projection(n_points: int, n_images: int) -> pd.DataFrame:
+    """Projection of 3D coordinates into every tilt-image."""
+    rng = np.random.default_rng(0)
+    xf_data = np.tile([1.0, 0, 0, 1, 0, 0], (n_images, 1))
+    xf_data[:, 4:] = rng.normal(scale=10, size=(n_images, 2))
+    matrices = get_projection_matrices(
+        xf_data,
+        TILT_ANGLES[:n_images],
+        image_shape=(4096, 4096),
+        volume_shape=(1000, 4096, 4096),
+    )
+    points = rng.uniform(0, 4000, size=(n_points, 3))
+    rows = []
+    for dtype in (np.float64, np.float32):
+        seconds = best_time(
+            lambda dtype=dtype: project_points(points, matrices, dtype=dtype)
+        )
+        rows.append({
+            'dtype': np.dtype(dtype).name,
+            'points': n_points,
+            'million projections/s': n_points * n_images / seconds / 1e6,
+        })
+    return pd.DataFrame(rows)
+
+
+def benchmark_batch_scaling(
+        workers: List[int], jobs_per_worker: int, size: int, n_images: int,
+        delay: float, directory: Path
+) -> pd.DataFrame:
+    """Throughput of align_many as the number of workers grows."""
+    rows = []
+    for n_workers in workers:
+        jobs = [
+            _make_job(directory / f'workers_{n_workers}', f'TS_{i:03d}', n_images, size)
+            for i in range(n_workers * jobs_per_worker)
+        ]
+        start = time.perf_counter()
+        results = align_many(jobs, max_workers=n_workers)
+        seconds = time.perf_counter() - start
+        ideal = jobs_per_worker * 7 * delay
+        rows.append({
+            'workers': n_workers,
+            'jobs': len(jobs),
+            'failures': sum(not hasattr(result, 'xf_file') for result in results),
+            'seconds': seconds,
+            'jobs/s': len(jobs) / seconds,
+            'overhead per job (s)': (seconds - ideal) / jobs_per_worker,
+        })
+    return pd.DataFrame(rows)
+
+
+def _make_job(directory: Path, basename: str, n_images: int, size: int) -> dict:
+    return {
+        'tilt_series': generate_tilt_series(n_images, (size, size), n_beads=5),
+        'tilt_angles': TILT_ANGLES[:n_images],
+        'pixel_size': 10,
+        'nominal_rotation_angle': 85,
+        'patch_size': 2000,
+        'patch_overlap_percentage': 33,
+        'basename': basename,
+        'output_directory': directory / basename,
+    }
+
+
+@cli.command()
+def main(
+    sizes: List[int] = typer.Option([512, 1024, 2048], help='image sidelengths.'),
+    n_images: int = typer.Option(41, help='images per tilt-series.'),
+    workers: List[int] = typer.Option([1, 2, 4, 8], help='worker counts for scaling.'),
+    jobs_per_worker: int = typer.Option(2, help='tilt-series per worker for scaling.'),
+    delay: float = typer.Option(0.05, help='seconds the fake batchruntomo spends per step.'),
+    n_series: int = typer.Option(1000, help='tilt-series for batched xf operations.'),
+    n_points: int = typer.Option(100000, help='3D coordinates to project.'),
+    output: Optional[Path] = typer.Option(None, help='directory for csv results.'),
+):
+    with fake_imod(delay=delay), tempfile.TemporaryDirectory() as temporary_directory:
+        directory = Path(temporary_directory)
+        results = {
+            'staging': benchmark_staging(sizes, n_images, directory),
+            'directive_generation': benchmark_directive_generation(),
+            'output_parsing': benchmark_output_parsing(directory),
+            'xf_batch': benchmark_xf_batch(n_series, n_images),
+            'projection': benchmark_projection(n_points, n_images),
+            'batch_scaling': benchmark_batch_scaling(
+                workers, jobs_per_worker, min(sizes), n_images, delay, directory
+            ),
+        }
+    for name, result in results.items():
+        typer.echo(f'\n{name}\n{result.to_string(index=False)}')
+        if output is not None:
+            output.mkdir(parents=True, exist_ok=True)
+            result.to_csv(output / f'{name}.csv', index=False)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,43 @@
+"""Synthetic tilt-series for benchmarking."""
+from pathlib import Path
+from typing import Tuple
+
+import mrcfile
+import numpy as np
+
+
+def generate_tilt_series(
+        n_images: int = 41,
+        image_shape: Tuple[int, int] = (512, 512),
+        dtype: np.dtype = np.float32,
+        n_beads: int = 50,
+        seed: int = 0,
+) -> np.ndarray:
+    """Generate an (n, y, x) tilt-series of noisy images containing gold beads.
+
+    Beads are placed in a slab and projected along y with the specimen tilted
+    about the y-axis, so that they move across the images with tilt angle.
+    """
+    rng = np.random.default_rng(seed)
+    ny, nx = image_shape
+    tilt_angles = np.deg2rad(np.linspace(-60, 60, n_images))
+    positions = rng.uniform(-0.4, 0.4, size=(n_beads, 3)) * [nx, ny, 0.1 * nx]
+    y, x = np.mgrid[:ny, :nx]
+    tilt_series = np.empty((n_images, ny, nx), dtype=dtype)
+    for idx, angle in enumerate(tilt_angles):
+        projected_x = positions[:, 0] * np.cos(angle) + positions[:, 2] * np.sin(angle)
+        image = rng.normal(loc=100, scale=10, size=image_shape)
+        for bead_x, bead_y in zip(projected_x + nx / 2, positions[:, 1] + ny / 2):
+            window = (slice(max(0, int(bead_y) - 6), int(bead_y) + 7),
+                      slice(max(0, int(bead_x) - 6), int(bead_x) + 7))
+            distance_sq = (x[window] - bead_x) ** 2 + (y[window] - bead_y) ** 2
+            image[window] -= 50 * np.exp(-distance_sq / 8)
+        if not np.issubdtype(dtype, np.floating):
+            image = np.clip(image, 0, np.iinfo(dtype).max)
+        tilt_series[idx] = image
+    return tilt_series
+
+
+def write_tilt_series(file: Path, tilt_series: np.ndarray) -> Path:
+    mrcfile.write(file, tilt_series, overwrite=True)
+    return file
@@ -1,3 +1,15 @@
-from .fiducials import align_tilt_series_using_fiducials
-from .patch_tracking import align_tilt_series_using_patch_tracking
+from .fiducials import (
+    align_tilt_series_using_fiducials,
+    align_tilt_series_using_fiducials_async,
+)
+from .patch_tracking import (
+    align_tilt_series_using_patch_tracking,
+    align_tilt_series_using_patch_tracking_async,
+)
+from .batch import align_many
+from .job_queue import JobQueue, run_worker
+from .preview import preview_alignment
+from .race import race_alignment_methods, race_alignment_methods_async
+from .sweep import sweep_patch_tracking_parameters
+from .watch import TiltSeriesWatcher, watch_directory
 from . import utils
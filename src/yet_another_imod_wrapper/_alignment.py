@@ -0,0 +1,407 @@
+"""Alignment workflow shared by the fiducial and patch-tracking entry points."""
+import asyncio
+import contextlib
+import functools
+import os
+from pathlib import Path
+from typing import (
+    Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+)
+
+import numpy as np
+
+from .constants import TARGET_PIXEL_SIZE_FOR_ALIGNMENT
+from .utils.cache import AlignmentCache
+from .utils.binning import find_optimal_power_of_2_binning_factor
+from .utils import events
+from .utils.etomo import (
+    BATCHRUNTOMO_ENDING_STEP,
+    SCRATCH_KEEP_FILES,
+    EtomoOutput,
+    find_batchruntomo_starting_step,
+    prepare_etomo_directory,
+    run_batchruntomo,
+    run_batchruntomo_async,
+    scratch_etomo_directory,
+)
+from .utils.backends import ExecutionBackend
+from .utils.monitor import BatchruntomoMonitor
+from .utils.installation import check_imod_installation
+from .utils.prescreen import find_bad_tilt_images
+from .utils.retry import RetryPolicy
+from .utils.scheduler import ResourceAllocation
+
+DirectiveFactory = Callable[..., Dict[str, Any]]
+
+
+def align_tilt_series(
+        tilt_series: Union[np.ndarray, os.PathLike],
+        tilt_angles: Sequence[float],
+        pixel_size: float,
+        basename: str,
+        output_directory: Path,
+        generate_directive: DirectiveFactory,
+        skip_if_completed: bool = False,
+        fingerprint: Optional[str] = None,
+        staging_dtype: str = 'float32',
+        prebin: bool = False,
+        prescreen: bool = False,
+        resume: bool = False,
+        cache: Optional[AlignmentCache] = None,
+        timeout: Optional[float] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        monitor: Optional[BatchruntomoMonitor] = None,
+        allocation: Optional[ResourceAllocation] = None,
+        backend: Optional[ExecutionBackend] = None,
+        scratch_directory: Optional[os.PathLike] = None,
+        keep_files: Sequence[str] = SCRATCH_KEEP_FILES,
+) -> EtomoOutput:
+    """Stage a tilt-series, generate a directive and run batchruntomo.
+
+    `generate_directive` is called with `tilt_series_file` and `pixel_size`
+    keyword arguments once the Etomo directory has been prepared.
+
+    If `prebin` is True the tilt-series is binned towards the target pixel size
+    for alignment as it is staged, `pixel_size` passed to `generate_directive`
+    is that of the binned tilt-series. xf shifts are then in binned pixels, the
+    factor is recorded as `binning_factor` on the output.
+
+    If `prescreen` is True blank, dark or occluded images are found before
+    alignment, excluded in the directive and reported on the output.
+
+    If `resume` is True batchruntomo starts from the first step without valid
+    outputs from a previous run.
+
+    If a `cache` is provided results are copied from it when available instead
+    of running batchruntomo. Staged data are fingerprinted in full by default.
+
+    batchruntomo is killed after `timeout` seconds. If it fails, times out or
+    produces no alignment results, fallback directives from `retry_policy` are
+    tried in order from the first step. `monitor` follows the output of each run.
+
+    An `allocation` from a `ResourceScheduler` limits the threads IMOD uses and
+    optionally pins batchruntomo to the reserved CPUs. `backend` decides where
+    batchruntomo runs, e.g. on a cluster node.
+
+    If a `scratch_directory` is given the alignment runs in a new directory
+    inside it and only `keep_files` are copied into `output_directory`, the
+    scratch directory is removed even if alignment fails. Alignments in scratch
+    space cannot be resumed.
+    """
+    with events.timed_events(
+            events.ALIGNMENT_STARTED,
+            events.ALIGNMENT_FINISHED,
+            events.ALIGNMENT_FAILED,
+            basename=basename,
+            directory=Path(output_directory),
+    ) as finished:
+        if cache is not None and fingerprint is None:
+            fingerprint = 'full'
+        with _alignment_directory(
+                basename, output_directory, scratch_directory, keep_files,
+                skip_if_completed, resume,
+        ) as working_directory:
+            if working_directory is None:
+                finished['skipped'] = True
+                return EtomoOutput(basename=basename, directory=Path(output_directory))
+            etomo_output, directive = _prepare_alignment(
+                tilt_series=tilt_series,
+                tilt_angles=tilt_angles,
+                pixel_size=pixel_size,
+                basename=basename,
+                output_directory=working_directory,
+                generate_directive=generate_directive,
+                fingerprint=fingerprint,
+                staging_dtype=staging_dtype,
+                prebin=prebin,
+                prescreen=prescreen,
+            )
+            starting_step = _get_starting_step(etomo_output, skip_if_completed, resume)
+            if starting_step is None:
+                finished['skipped'] = True
+                return _relocate_output(etomo_output, output_directory)
+            if cache is not None:
+                cache_key = cache.get_key(etomo_output, directive)
+                if cache.retrieve(cache_key, etomo_output) is True:
+                    events.emit(events.CACHE_HIT, basename, key=cache_key)
+                    finished['cached'] = True
+                    return _relocate_output(etomo_output, output_directory)
+            _align_with_retries(
+                etomo_output=etomo_output,
+                directives=_get_attempt_directives(directive, retry_policy),
+                starting_step=starting_step,
+                timeout=timeout,
+                monitor=monitor,
+                backend=backend,
+                **_get_resource_options(allocation),
+            )
+            if cache is not None:
+                cache.store(cache_key, etomo_output)
+            return _relocate_output(etomo_output, output_directory)
+
+
+async def align_tilt_series_async(
+        tilt_series: Union[np.ndarray, os.PathLike],
+        tilt_angles: Sequence[float],
+        pixel_size: float,
+        basename: str,
+        output_directory: Path,
+        generate_directive: DirectiveFactory,
+        skip_if_completed: bool = False,
+        fingerprint: Optional[str] = None,
+        staging_dtype: str = 'float32',
+        prebin: bool = False,
+        prescreen: bool = False,
+        resume: bool = False,
+        cache: Optional[AlignmentCache] = None,
+        timeout: Optional[float] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        monitor: Optional[BatchruntomoMonitor] = None,
+        allocation: Optional[ResourceAllocation] = None,
+        scratch_directory: Optional[os.PathLike] = None,
+        keep_files: Sequence[str] = SCRATCH_KEEP_FILES,
+        limiter: Optional[asyncio.Semaphore] = None,
+) -> EtomoOutput:
+    """Asynchronous version of `align_tilt_series`.
+
+    Staging runs in the default executor, batchruntomo runs as an asyncio
+    subprocess. `limiter` bounds the number of concurrent alignments when
+    shared between calls.
+    """
+    if limiter is None:
+        limiter = asyncio.Semaphore(1)  # private to this call, i.e. no limit
+    if cache is not None and fingerprint is None:
+        fingerprint = 'full'
+    async with limiter:
+        with events.timed_events(
+                events.ALIGNMENT_STARTED,
+                events.ALIGNMENT_FINISHED,
+                events.ALIGNMENT_FAILED,
+                basename=basename,
+                directory=Path(output_directory),
+        ) as finished:
+            loop = asyncio.get_running_loop()
+            with _alignment_directory(
+                    basename, output_directory, scratch_directory, keep_files,
+                    skip_if_completed, resume,
+            ) as working_directory:
+                if working_directory is None:
+                    finished['skipped'] = True
+                    return EtomoOutput(
+                        basename=basename, directory=Path(output_directory)
+                    )
+                etomo_output, directive = await loop.run_in_executor(
+                    None,
+                    functools.partial(
+                        _prepare_alignment,
+                        tilt_series=tilt_series,
+                        tilt_angles=tilt_angles,
+                        pixel_size=pixel_size,
+                        basename=basename,
+                        output_directory=working_directory,
+                        generate_directive=generate_directive,
+                        fingerprint=fingerprint,
+                        staging_dtype=staging_dtype,
+                        prebin=prebin,
+                        prescreen=prescreen,
+                    )
+                )
+                starting_step = _get_starting_step(
+                    etomo_output, skip_if_completed, resume
+                )
+                if starting_step is None:
+                    finished['skipped'] = True
+                    return _relocate_output(etomo_output, output_directory)
+                if cache is not None:
+                    cache_key = cache.get_key(etomo_output, directive)
+                    is_cached = await loop.run_in_executor(
+                        None, cache.retrieve, cache_key, etomo_output
+                    )
+                    if is_cached is True:
+                        events.emit(events.CACHE_HIT, basename, key=cache_key)
+                        finished['cached'] = True
+                        return _relocate_output(etomo_output, output_directory)
+                await _align_with_retries_async(
+                    etomo_output=etomo_output,
+                    directives=_get_attempt_directives(directive, retry_policy),
+                    starting_step=starting_step,
+                    timeout=timeout,
+                    monitor=monitor,
+                    **_get_resource_options(allocation),
+                )
+                if cache is not None:
+                    await loop.run_in_executor(
+                        None, cache.store, cache_key, etomo_output
+                    )
+    return _relocate_output(etomo_output, output_directory)
+
+
+def _prepare_alignment(
+        tilt_series: Union[np.ndarray, os.PathLike],
+        tilt_angles: Sequence[float],
+        pixel_size: float,
+        basename: str,
+        output_directory: Path,
+        generate_directive: DirectiveFactory,
+        fingerprint: Optional[str] = None,
+        staging_dtype: str = 'float32',
+        prebin: bool = False,
+        prescreen: bool = False,
+) -> Tuple[EtomoOutput, Dict[str, Any]]:
+    """Check IMOD, prepare the Etomo directory and generate a directive."""
+    check_imod_installation()
+    binning_factor = 1
+    if prebin is True:
+        binning_factor = int(find_optimal_power_of_2_binning_factor(
+            src_pixel_size=pixel_size, target_pixel_size=TARGET_PIXEL_SIZE_FOR_ALIGNMENT
+        ))
+    etomo_output = prepare_etomo_directory(
+        directory=Path(output_directory),
+        tilt_series=tilt_series,
+        tilt_angles=tilt_angles,
+        basename=basename,
+        fingerprint=fingerprint,
+        staging_dtype=staging_dtype,
+        binning_factor=binning_factor,
+    )
+    directive = generate_directive(
+        tilt_series_file=etomo_output.tilt_series_file,
+        pixel_size=pixel_size * binning_factor,
+    )
+    if prescreen is True:
+        excluded_views = find_bad_tilt_images(tilt_series)
+        if len(excluded_views) > 0:
+            directive['runtime.Excludeviews.any.views'] = ','.join(
+                str(view + 1) for view in excluded_views
+            )
+        etomo_output.excluded_views = excluded_views.tolist()
+    events.emit(events.DIRECTIVE_GENERATED, basename, directive=directive)
+    return etomo_output, directive
+
+
+@contextlib.contextmanager
+def _alignment_directory(
+        basename: str,
+        output_directory: Path,
+        scratch_directory: Optional[os.PathLike],
+        keep_files: Sequence[str],
+        skip_if_completed: bool,
+        resume: bool,
+) -> Iterator[Optional[Path]]:
+    """Directory to align in, None if results copied back from scratch exist.
+
+    Without a `scratch_directory` this is the output directory. Otherwise a new
+    directory in scratch space is used and `keep_files` are copied back on exit,
+    nothing is staged in the output directory so previous results are checked
+    for here.
+    """
+    if scratch_directory is None:
+        yield Path(output_directory)
+        return
+    if resume is True:
+        raise ValueError('alignments in a scratch directory cannot be resumed.')
+    etomo_output = EtomoOutput(basename=basename, directory=Path(output_directory))
+    if skip_if_completed is True and etomo_output.contains_alignment_results is True:
+        yield None
+        return
+    with scratch_etomo_directory(
+            output_directory=output_directory,
+            scratch_directory=scratch_directory,
+            basename=basename,
+            keep_files=keep_files,
+    ) as working_directory:
+        yield working_directory
+
+
+def _relocate_output(etomo_output: EtomoOutput, directory: Path) -> EtomoOutput:
+    """Point an output at the directory files were copied back into."""
+    if etomo_output.directory == Path(directory):
+        return etomo_output
+    relocated = EtomoOutput(basename=etomo_output.basename, directory=Path(directory))
+    relocated.excluded_views = etomo_output.excluded_views
+    return relocated
+
+
+def _get_starting_step(
+        etomo_output: EtomoOutput, skip_if_completed: bool, resume: bool
+) -> Optional[int]:
+    """Get the batchruntomo step to start from, None if there is nothing to run."""
+    if skip_if_completed is True and etomo_output.contains_alignment_results is True:
+        return None
+    starting_step = 0
+    if resume is True:
+        starting_step = find_batchruntomo_starting_step(etomo_output)
+    return starting_step if starting_step <= BATCHRUNTOMO_ENDING_STEP else None
+
+
+def _align_with_retries(
+        etomo_output: EtomoOutput,
+        directives: Sequence[Dict[str, Any]],
+        starting_step: int,
+        **kwargs,
+) -> None:
+    """Run batchruntomo with each directive in turn until alignment succeeds.
+
+    The first attempt starts from `starting_step`, fallbacks from the first
+    step. Other keyword arguments are passed to `run_batchruntomo`.
+    """
+    for attempt, directive in enumerate(directives):
+        try:
+            run_batchruntomo(
+                directory=etomo_output.directory,
+                basename=etomo_output.basename,
+                directive=directive,
+                starting_step=starting_step if attempt == 0 else 0,
+                **kwargs,
+            )
+            _check_alignment_results(etomo_output)
+            return
+        except RuntimeError:
+            if attempt == len(directives) - 1:
+                raise
+
+
+async def _align_with_retries_async(
+        etomo_output: EtomoOutput,
+        directives: Sequence[Dict[str, Any]],
+        starting_step: int,
+        **kwargs,
+) -> None:
+    """Asynchronous version of `_align_with_retries`."""
+    for attempt, directive in enumerate(directives):
+        try:
+            await run_batchruntomo_async(
+                directory=etomo_output.directory,
+                basename=etomo_output.basename,
+                directive=directive,
+                starting_step=starting_step if attempt == 0 else 0,
+                **kwargs,
+            )
+            _check_alignment_results(etomo_output)
+            return
+        except RuntimeError:
+            if attempt == len(directives) - 1:
+                raise
+
+
+def _get_attempt_directives(
+        directive: Dict[str, Any], retry_policy: Optional[RetryPolicy]
+) -> List[Dict[str, Any]]:
+    """Directives to try in order, the original followed by any fallbacks."""
+    if retry_policy is None:
+        return [directive]
+    return retry_policy.get_directives(directive)
+
+
+def _get_resource_options(allocation: Optional[ResourceAllocation]) -> Dict[str, Any]:
+    if allocation is None:
+        return {}
+    return {
+        'environment': allocation.environment,
+        'cpu_affinity': allocation.cpu_affinity,
+    }
+
+
+def _check_alignment_results(etomo_output: EtomoOutput) -> None:
+    if etomo_output.contains_alignment_results is False:
+        raise RuntimeError(f'{etomo_output.basename} failed to align correctly.')
@@ -1,13 +1,16 @@
 """Command line interface for fiducial and patch-tracking based alignments."""
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 import typer
-import mrcfile
 
+from .batch import DEFAULT_MAX_WORKERS
 from .fiducials import align_tilt_series_using_fiducials
+from .job_queue import JobQueue, run_worker
 from .patch_tracking import align_tilt_series_using_patch_tracking
+from .sweep import sweep_patch_tracking_parameters
 from .utils.io import read_tlt
+from .watch import watch_directory
 
 cli = typer.Typer(
     name='yet-another-imod-wrapper',
@@ -35,11 +38,25 @@ def fiducials(
     ),
     basename: Optional[str] = typer.Option(
         default=None, help='basename for files in output directory.'
-    )
-
+    ),
+    staging_dtype: str = typer.Option(
+        default='float32', help="data type of the tilt-series passed to IMOD, "
+                                "'float32', 'native' or 'float16'."
+    ),
+    prebin: bool = typer.Option(
+        default=False, help='bin the tilt-series in Fourier space before alignment.'
+    ),
+    prescreen: bool = typer.Option(
+        default=False, help='exclude blank, dark or occluded tilt-images.'
+    ),
+    timeout: Optional[float] = typer.Option(
+        default=None, help='seconds after which batchruntomo is killed.'
+    ),
+    scratch_directory: Optional[Path] = typer.Option(
+        default=None, help='node-local directory to align in, only results are kept.'
+    ),
 ):
     basename = tilt_series.stem if basename is None else basename
-    tilt_series = mrcfile.read(tilt_series)
     tilt_angles = read_tlt(tilt_angles)
     align_tilt_series_using_fiducials(
         tilt_series=tilt_series,
@@ -49,6 +66,11 @@ def fiducials(
         nominal_rotation_angle=nominal_rotation_angle,
         basename=basename,
         output_directory=output_directory,
+        staging_dtype=staging_dtype,
+        prebin=prebin,
+        prescreen=prescreen,
+        timeout=timeout,
+        scratch_directory=scratch_directory,
     )
 
 
@@ -74,10 +96,25 @@ def patch_tracking(
     ),
     basename: Optional[str] = typer.Option(
         default=None, help='basename for files in output directory.'
-    )
+    ),
+    staging_dtype: str = typer.Option(
+        default='float32', help="data type of the tilt-series passed to IMOD, "
+                                "'float32', 'native' or 'float16'."
+    ),
+    prebin: bool = typer.Option(
+        default=False, help='bin the tilt-series in Fourier space before alignment.'
+    ),
+    prescreen: bool = typer.Option(
+        default=False, help='exclude blank, dark or occluded tilt-images.'
+    ),
+    timeout: Optional[float] = typer.Option(
+        default=None, help='seconds after which batchruntomo is killed.'
+    ),
+    scratch_directory: Optional[Path] = typer.Option(
+        default=None, help='node-local directory to align in, only results are kept.'
+    ),
 ):
     basename = tilt_series.stem if basename is None else basename
-    tilt_series = mrcfile.read(tilt_series)
     tilt_angles = read_tlt(tilt_angles)
     align_tilt_series_using_patch_tracking(
         tilt_series=tilt_series,
@@ -88,4 +125,153 @@ def patch_tracking(
         patch_overlap_percentage=patch_overlap_percentage,
         basename=basename,
         output_directory=output_directory,
-    )
\ No newline at end of file
+        staging_dtype=staging_dtype,
+        prebin=prebin,
+        prescreen=prescreen,
+        timeout=timeout,
+        scratch_directory=scratch_directory,
+    )
+
+
+@cli.command(no_args_is_help=True)
+def patch_tracking_sweep(
+    tilt_series: Path = typer.Option(
+        ..., help='file containing tilt-series in MRC format.'
+    ),
+    tilt_angles: Path = typer.Option(
+        ..., help='text file containing tilt-angles, one per line.'
+    ),
+    output_directory: Path = typer.Option(..., help='directory for IMOD output.'),
+    pixel_size: float = typer.Option(..., help='pixel spacing in Ångstroms.'),
+    patch_size: List[float] = typer.Option(
+        ..., help='patch sidelength in Ångstroms, can be repeated.'
+    ),
+    patch_overlap_percentage: List[float] = typer.Option(
+        [33], help='percentage of tile-length to overlap on each side, can be repeated.'
+    ),
+    nominal_rotation_angle: float = typer.Option(
+        ..., help='in-plane rotation of tilt-axis away from the Y-axis in degrees, '
+                  'CCW positive.'
+    ),
+    basename: Optional[str] = typer.Option(
+        default=None, help='basename for files in output directory.'
+    ),
+    max_workers: Optional[int] = typer.Option(
+        default=None,
+        help='maximum number of variants aligned at the same time, defaults to '
+             f'the number of CPUs up to {DEFAULT_MAX_WORKERS}.'
+    ),
+):
+    basename = tilt_series.stem if basename is None else basename
+    tilt_angles = read_tlt(tilt_angles)
+    results = sweep_patch_tracking_parameters(
+        tilt_series=tilt_series,
+        tilt_angles=tilt_angles,
+        nominal_rotation_angle=nominal_rotation_angle,
+        pixel_size=pixel_size,
+        patch_sizes=patch_size,
+        patch_overlap_percentages=patch_overlap_percentage,
+        basename=basename,
+        output_directory=output_directory,
+        max_workers=max_workers,
+    )
+    results.to_csv(output_directory / 'sweep.csv', index=False)
+    typer.echo(results.to_string(index=False))
+
+
+@cli.command(no_args_is_help=True)
+def worker(
+    database: Path = typer.Option(..., help='SQLite job queue on a shared filesystem.'),
+    name: Optional[str] = typer.Option(
+        default=None, help='name of this worker, defaults to host:pid.'
+    ),
+    poll_interval: float = typer.Option(
+        default=10, help='seconds between checks of an empty queue.'
+    ),
+    lease_timeout: float = typer.Option(
+        default=120, help='seconds without a heartbeat after which a worker is dead.'
+    ),
+    max_jobs: Optional[int] = typer.Option(
+        default=None, help='stop after running this many jobs.'
+    ),
+    exit_when_empty: bool = typer.Option(
+        default=False, help='stop once the queue is empty.'
+    ),
+):
+    queue = JobQueue(database, lease_timeout=lease_timeout)
+    n_jobs = run_worker(
+        queue,
+        worker=name,
+        poll_interval=poll_interval,
+        heartbeat_interval=lease_timeout / 4,
+        max_jobs=max_jobs,
+        exit_when_empty=exit_when_empty,
+    )
+    typer.echo(f'ran {n_jobs} jobs')
+
+
+@cli.command(no_args_is_help=True)
+def watch(
+    directory: Path = typer.Option(..., help='directory tilt-series are written into.'),
+    output_directory: Path = typer.Option(..., help='directory for IMOD output.'),
+    method: str = typer.Option(
+        default='patch_tracking', help="'patch_tracking' or 'fiducials'."
+    ),
+    pixel_size: float = typer.Option(..., help='pixel spacing in Ångstroms.'),
+    nominal_rotation_angle: float = typer.Option(
+        ..., help='in-plane rotation of tilt-axis away from the Y-axis in degrees, '
+                  'CCW positive.'
+    ),
+    patch_size: Optional[float] = typer.Option(
+        default=None, help='patch sidelength in Ångstroms for patch-tracking.'
+    ),
+    patch_overlap_percentage: float = typer.Option(
+        default=33, help='percentage of tile-length to overlap on each side.'
+    ),
+    fiducial_size: Optional[float] = typer.Option(
+        default=None, help='fiducial diameter in nanometers for fiducials.'
+    ),
+    max_workers: int = typer.Option(
+        default=1, help='maximum number of tilt-series aligned at the same time.'
+    ),
+    stable_time: float = typer.Option(
+        default=30,
+        help='seconds a stack and its tilt-angles must be unchanged to be complete.',
+    ),
+    poll_interval: float = typer.Option(
+        default=10, help='seconds between checks of the directory.'
+    ),
+    database: Optional[Path] = typer.Option(
+        default=None, help='submit tilt-series to this job queue instead of aligning.'
+    ),
+    timeout: Optional[float] = typer.Option(
+        default=None, help='seconds after which batchruntomo is killed.'
+    ),
+):
+    alignment_parameters = {
+        'pixel_size': pixel_size,
+        'nominal_rotation_angle': nominal_rotation_angle,
+        'timeout': timeout,
+    }
+    if method == 'patch_tracking':
+        required = {'patch_size': patch_size}
+        alignment_parameters['patch_overlap_percentage'] = patch_overlap_percentage
+    elif method == 'fiducials':
+        required = {'fiducial_size': fiducial_size}
+    else:
+        raise typer.BadParameter(f'unknown alignment method {method!r}')
+    for name, value in required.items():
+        if value is None:
+            option = f'--{name.replace("_", "-")}'
+            raise typer.BadParameter(f'{option} is required for {method}')
+    alignment_parameters.update(required)
+    watch_directory(
+        directory=directory,
+        output_directory=output_directory,
+        method=method,
+        alignment_parameters=alignment_parameters,
+        max_workers=max_workers,
+        stable_time=stable_time,
+        poll_interval=poll_interval,
+        queue=None if database is None else JobQueue(database),
+    )
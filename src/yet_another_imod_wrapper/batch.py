@@ -0,0 +1,117 @@
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from .fiducials import align_tilt_series_using_fiducials
+from .patch_tracking import align_tilt_series_using_patch_tracking
+from .utils import events
+from .utils.etomo import EtomoOutput
+from .utils.scheduler import ResourceScheduler, estimate_alignment_memory
+
+ALIGNMENT_FUNCTIONS = {
+    'fiducials': align_tilt_series_using_fiducials,
+    'patch_tracking': align_tilt_series_using_patch_tracking,
+}
+
+# each batchruntomo step uses every core, a few alignments at once keep a node busy
+DEFAULT_MAX_WORKERS = 4
+
+
+class AlignmentFailure:
+    """Record of a tilt-series which failed to align as part of a batch."""
+
+    def __init__(self, basename: str, output_directory: Path, error: BaseException):
+        self.basename: str = basename
+        self.output_directory: Path = Path(output_directory)
+        self.error: BaseException = error
+
+    @property
+    def message(self) -> str:
+        return f'{type(self.error).__name__}: {self.error}'
+
+    @property
+    def traceback(self) -> str:
+        return ''.join(
+            traceback.format_exception(
+                type(self.error), self.error, self.error.__traceback__
+            )
+        )
+
+    def __repr__(self) -> str:
+        return f'AlignmentFailure(basename={self.basename!r}, message={self.message!r})'
+
+
+def align_many(
+        jobs: Sequence[Dict[str, Any]],
+        method: str = 'patch_tracking',
+        max_workers: Optional[int] = None,
+        scheduler: Optional[ResourceScheduler] = None,
+) -> List[Union[EtomoOutput, AlignmentFailure]]:
+    """Align many tilt-series concurrently.
+
+    Each job runs in its own batchruntomo process, at most `max_workers` run at
+    the same time. A failing job does not stop the rest of the batch.
+
+    Parameters
+    ----------
+    jobs: keyword arguments for the alignment function, one dictionary per
+        tilt-series. An optional 'method' key overrides `method` for that job.
+    method: alignment method, 'fiducials' or 'patch_tracking'.
+    max_workers: maximum number of tilt-series aligned at the same time,
+        defaults to as many jobs as fit the cores of `scheduler`, or without a
+        scheduler to the number of CPUs up to `DEFAULT_MAX_WORKERS`.
+    scheduler: admits jobs only while the cores and estimated memory they need
+        are free, limiting the threads each job uses to its share of cores.
+
+    Returns
+    -------
+    results: an `EtomoOutput` or `AlignmentFailure` per job, in the order of `jobs`.
+    """
+    if max_workers is None:
+        max_workers = get_default_max_workers(scheduler)
+    for job in jobs:
+        events.emit(events.ALIGNMENT_QUEUED, job.get('basename'))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _align_one, job=job, default_method=method, scheduler=scheduler
+            )
+            for job in jobs
+        ]
+        return [future.result() for future in futures]
+
+
+def get_default_max_workers(scheduler: Optional[ResourceScheduler] = None) -> int:
+    """Number of alignments to run at once, each uses every core it is given."""
+    if scheduler is not None:
+        return max(1, len(scheduler.cpus) // scheduler.cores_per_job)
+    return min(DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+
+
+def _align_one(
+        job: Dict[str, Any],
+        default_method: str,
+        scheduler: Optional[ResourceScheduler] = None,
+) -> Union[EtomoOutput, AlignmentFailure]:
+    """Run a single alignment job, capturing any error."""
+    job = dict(job)
+    method = job.pop('method', default_method)
+    try:
+        if method not in ALIGNMENT_FUNCTIONS:
+            raise ValueError(
+                f'unknown alignment method {method!r}, '
+                f'expected one of {list(ALIGNMENT_FUNCTIONS)}'
+            )
+        if scheduler is None:
+            return ALIGNMENT_FUNCTIONS[method](**job)
+        memory = estimate_alignment_memory(job['tilt_series'], job['pixel_size'])
+        with scheduler.allocate(memory=memory) as allocation:
+            return ALIGNMENT_FUNCTIONS[method](**job, allocation=allocation)
+    except Exception as error:
+        return AlignmentFailure(
+            basename=job.get('basename'),
+            output_directory=job.get('output_directory', '.'),
+            error=error,
+        )
@@ -5,5 +5,6 @@ BATCHRUNTOMO_CONFIG_FIDUCIALS = BATCHRUNTOMO_CONIFG_DIR / 'fiducials.adoc'
 BATCHRUNTOMO_CONFIG_PATCH_TRACKING = BATCHRUNTOMO_CONIFG_DIR / 'patch_tracking.adoc'
 
 TARGET_PIXEL_SIZE_FOR_ALIGNMENT = 10
+TARGET_PIXEL_SIZE_FOR_PREVIEW = 20
 
 MINIMUM_IMOD_VERSION = '4.11.0'
@@ -1,31 +1,53 @@
+import asyncio
+import functools
 from os import PathLike
 from pathlib import Path
-from typing import Dict, Any, Sequence
+from typing import Dict, Any, Optional, Sequence, Union
 
 import numpy as np
 
+from ._alignment import align_tilt_series, align_tilt_series_async
 from .utils.io import read_adoc
 from .constants import TARGET_PIXEL_SIZE_FOR_ALIGNMENT, BATCHRUNTOMO_CONFIG_FIDUCIALS
 from .utils.binning import find_optimal_power_of_2_binning_factor
-from .utils.etomo import prepare_etomo_directory, run_batchruntomo, EtomoOutput
-from .utils.installation import check_imod_installation
+from .utils.cache import AlignmentCache
+from .utils.etomo import SCRATCH_KEEP_FILES, EtomoOutput
+from .utils.backends import ExecutionBackend
+from .utils.monitor import BatchruntomoMonitor
+from .utils.retry import RetryPolicy
+from .utils.scheduler import ResourceAllocation
 
 
 def align_tilt_series_using_fiducials(
-        tilt_series: np.ndarray,
+        tilt_series: Union[np.ndarray, PathLike],
         tilt_angles: Sequence[float],
         pixel_size: float,
         fiducial_size: float,
         nominal_rotation_angle: float,
         basename: str,
         output_directory: Path,
-        skip_if_completed: bool = False
+        skip_if_completed: bool = False,
+        fingerprint: Optional[str] = None,
+        staging_dtype: str = 'float32',
+        prebin: bool = False,
+        prescreen: bool = False,
+        resume: bool = False,
+        cache: Optional[AlignmentCache] = None,
+        timeout: Optional[float] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        monitor: Optional[BatchruntomoMonitor] = None,
+        allocation: Optional[ResourceAllocation] = None,
+        backend: Optional[ExecutionBackend] = None,
+        scratch_directory: Optional[PathLike] = None,
+        keep_files: Sequence[str] = SCRATCH_KEEP_FILES,
 ) -> EtomoOutput:
     """Run fiducial based alignment in IMOD on a single tilt-series.
 
     Parameters
     ----------
-    tilt_series: (n, y, x) array of 2D tilt-images in a tilt-series.
+    tilt_series: (n, y, x) array of 2D tilt-images in a tilt-series or an MRC
+        file containing them. Lazy array-likes (e.g. memory maps, dask or zarr
+        arrays) are staged one image at a time, float32 MRC files are linked.
     tilt_angles: nominal stage tilt-angles from the microscope.
     pixel_size: nominal pixel size in Angstroms per pixel.
     fiducial_size: approximate size of fiducials in nanometers.
@@ -34,31 +56,124 @@ def align_tilt_series_using_fiducials(
     basename: basename for files in Etomo directory.
     skip_if_completed: skip alignment if previous results found.
     output_directory: tilt-series directory for IMOD.
+    fingerprint: 'full' or 'sampled' to only reuse a previously staged
+        tilt-series if its contents match, by default only the shape is checked.
+    staging_dtype: data type of the tilt-series handed to IMOD, 'float32',
+        'native' to keep integer data as is or 'float16'.
+    prebin: bin the tilt-series in Fourier space towards the pixel size used for
+        alignment before handing it to IMOD. Shifts in the resulting xf file
+        are then in pixels of the binned tilt-series, multiply them by
+        `binning_factor` of the output for pixels of the input tilt-series.
+    prescreen: exclude blank, dark or occluded tilt-images from alignment.
+        Excluded views are reported on the output as `excluded_views`.
+    resume: resume batchruntomo from the first step without valid outputs
+        from a previous run, e.g. after a crash. The directive should be unchanged.
+    cache: cache of alignment results shared between projects, results are
+        copied from the cache when the data, tilt-angles, directive and IMOD
+        version match. The staged data are fingerprinted in full by default.
+    timeout: seconds after which batchruntomo and the IMOD programs it started
+        are killed.
+    retry_policy: fallback directives tried in order if alignment fails,
+        e.g. at a larger binning.
+    monitor: follows batchruntomo output, `current_step` can be polled from
+        another thread. Runs are aborted on fatal IMOD errors.
+    allocation: cores and memory reserved by a `ResourceScheduler`, limits the
+        threads used by IMOD and optionally pins it to the reserved CPUs.
+    backend: where batchruntomo runs, locally by default. A
+        `BatchSchedulerBackend` submits it to a cluster scheduler such as SLURM.
+    scratch_directory: node-local scratch space or tmpfs to run the alignment
+        in, only `keep_files` are copied back into `output_directory`. The
+        scratch directory is removed even if alignment fails.
+    keep_files: glob patterns of files to copy back from scratch space,
+        formatted with `basename`.
     """
-    check_imod_installation()
-    output_directory = Path(output_directory)
-    etomo_output = prepare_etomo_directory(
-        directory=output_directory,
+    return align_tilt_series(
         tilt_series=tilt_series,
         tilt_angles=tilt_angles,
+        pixel_size=pixel_size,
         basename=basename,
-
+        output_directory=output_directory,
+        generate_directive=functools.partial(
+            generate_fiducial_based_alignment_directive,
+            fiducial_size=fiducial_size,
+            rotation_angle=nominal_rotation_angle,
+        ),
+        skip_if_completed=skip_if_completed,
+        fingerprint=fingerprint,
+        staging_dtype=staging_dtype,
+        prebin=prebin,
+        prescreen=prescreen,
+        resume=resume,
+        cache=cache,
+        timeout=timeout,
+        retry_policy=retry_policy,
+        monitor=monitor,
+        allocation=allocation,
+        backend=backend,
+        scratch_directory=scratch_directory,
+        keep_files=keep_files,
     )
-    directive = generate_fiducial_based_alignment_directive(
-        tilt_series_file=etomo_output.tilt_series_file,
+
+
+async def align_tilt_series_using_fiducials_async(
+        tilt_series: Union[np.ndarray, PathLike],
+        tilt_angles: Sequence[float],
+        pixel_size: float,
+        fiducial_size: float,
+        nominal_rotation_angle: float,
+        basename: str,
+        output_directory: Path,
+        skip_if_completed: bool = False,
+        fingerprint: Optional[str] = None,
+        staging_dtype: str = 'float32',
+        prebin: bool = False,
+        prescreen: bool = False,
+        resume: bool = False,
+        cache: Optional[AlignmentCache] = None,
+        timeout: Optional[float] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        monitor: Optional[BatchruntomoMonitor] = None,
+        allocation: Optional[ResourceAllocation] = None,
+        scratch_directory: Optional[PathLike] = None,
+        keep_files: Sequence[str] = SCRATCH_KEEP_FILES,
+        limiter: Optional[asyncio.Semaphore] = None,
+) -> EtomoOutput:
+    """Run fiducial based alignment in IMOD on a single tilt-series from asyncio.
+
+    Parameters are as for `align_tilt_series_using_fiducials`
+    except `backend`, batchruntomo always runs as an asyncio subprocess.
+    Cancelling the task kills batchruntomo and the IMOD programs it started.
+
+    Parameters
+    ----------
+    limiter: semaphore shared between calls to bound concurrent alignments.
+    """
+    return await align_tilt_series_async(
+        tilt_series=tilt_series,
+        tilt_angles=tilt_angles,
         pixel_size=pixel_size,
-        fiducial_size=fiducial_size,
-        rotation_angle=nominal_rotation_angle
+        basename=basename,
+        output_directory=output_directory,
+        generate_directive=functools.partial(
+            generate_fiducial_based_alignment_directive,
+            fiducial_size=fiducial_size,
+            rotation_angle=nominal_rotation_angle,
+        ),
+        skip_if_completed=skip_if_completed,
+        fingerprint=fingerprint,
+        staging_dtype=staging_dtype,
+        prebin=prebin,
+        prescreen=prescreen,
+        resume=resume,
+        cache=cache,
+        timeout=timeout,
+        retry_policy=retry_policy,
+        monitor=monitor,
+        allocation=allocation,
+        scratch_directory=scratch_directory,
+        keep_files=keep_files,
+        limiter=limiter,
     )
-    if etomo_output.contains_alignment_results is False or skip_if_completed is False:
-        run_batchruntomo(
-            directory=output_directory,
-            basename=basename,
-            directive=directive
-        )
-        if etomo_output.contains_alignment_results is False:
-            raise RuntimeError(f'{basename} failed to align correctly.')
-    return etomo_output
 
 
 def generate_fiducial_based_alignment_directive(
@@ -0,0 +1,362 @@
+"""Alignment job queue shared by workers on many nodes."""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from .batch import ALIGNMENT_FUNCTIONS
+from .utils import events
+from .utils.locking import DirectoryLock, DirectoryLockedError, get_worker_id
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# parameters which are paths, stored absolute so workers may run anywhere
+PATH_PARAMETERS = ('tilt_series', 'output_directory', 'scratch_directory')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    basename TEXT NOT NULL,
+    method TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    output_directory TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL,
+    error TEXT
+)
+"""
+
+
+class QueuedJob:
+    """A job claimed from a `JobQueue`."""
+
+    def __init__(
+            self,
+            id: int,
+            basename: str,
+            method: str,
+            parameters: Dict[str, Any],
+            output_directory: Path,
+            attempts: int,
+    ):
+        self.id: int = id
+        self.basename: str = basename
+        self.method: str = method
+        self.parameters: Dict[str, Any] = parameters
+        self.output_directory: Path = Path(output_directory)
+        self.attempts: int = attempts
+
+    def __repr__(self) -> str:
+        return f'QueuedJob(id={self.id!r}, basename={self.basename!r})'
+
+
+class JobQueue:
+    """Alignment jobs in an SQLite database on a shared filesystem.
+
+    Jobs are claimed atomically, at most one job per output directory runs at
+    a time. Running jobs whose worker has not sent a heartbeat for
+    `lease_timeout` seconds are requeued, or failed after `max_attempts`.
+
+    Parameters
+    ----------
+    database: SQLite database file, created if it does not exist.
+    lease_timeout: seconds without a heartbeat after which a worker is dead.
+    max_attempts: times a job is started before it is failed.
+    """
+
+    def __init__(
+            self,
+            database: os.PathLike,
+            lease_timeout: float = 120,
+            max_attempts: int = 3,
+    ):
+        self.database: Path = Path(database)
+        self.lease_timeout: float = lease_timeout
+        self.max_attempts: int = max_attempts
+        with self._connect() as connection:
+            connection.execute(SCHEMA)
+
+    def submit(self, job: Dict[str, Any], method: str = 'patch_tracking') -> int:
+        """Add a job to the queue, returning its id.
+
+        `job` holds keyword arguments for the alignment function as for
+        `align_many`, the tilt-series must be an MRC file. Paths are made
+        absolute so that workers do not depend on the current directory.
+        """
+        job = _resolve_paths(job)
+        method = job.pop('method', method)
+        if method not in ALIGNMENT_FUNCTIONS:
+            raise ValueError(
+                f'unknown alignment method {method!r}, '
+                f'expected one of {list(ALIGNMENT_FUNCTIONS)}'
+            )
+        try:
+            parameters = json.dumps(job, default=_encode_parameter)
+        except TypeError as error:
+            raise ValueError(
+                f'job parameters must be JSON serialisable, pass tilt-series as '
+                f'MRC files: {error}'
+            ) from error
+        with self._connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO jobs (basename, method, parameters, output_directory, '
+                'status, submitted_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    job['basename'],
+                    method,
+                    parameters,
+                    job['output_directory'],
+                    QUEUED,
+                    time.time(),
+                ),
+            )
+        events.emit(events.ALIGNMENT_QUEUED, job['basename'], job_id=cursor.lastrowid)
+        return cursor.lastrowid
+
+    def claim(self, worker: str) -> Optional[QueuedJob]:
+        """Atomically claim the oldest queued job whose directory is free."""
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            self._requeue_stale(connection)
+            row = connection.execute(
+                'SELECT id, basename, method, parameters, output_directory, attempts '
+                'FROM jobs WHERE status = ? AND output_directory NOT IN '
+                '(SELECT output_directory FROM jobs WHERE status = ?) '
+                'ORDER BY id LIMIT 1',
+                (QUEUED, RUNNING),
+            ).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            now = time.time()
+            connection.execute(
+                'UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, '
+                'started_at = ?, heartbeat_at = ?, finished_at = NULL, error = NULL '
+                'WHERE id = ?',
+                (RUNNING, worker, now, now, row[0]),
+            )
+            connection.execute('COMMIT')
+        job_id, basename, method, parameters, output_directory, attempts = row
+        return QueuedJob(
+            id=job_id,
+            basename=basename,
+            method=method,
+            parameters=json.loads(parameters),
+            output_directory=Path(output_directory),
+            attempts=attempts + 1,
+        )
+
+    def heartbeat(self, job_id: int, worker: str) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ?',
+                (time.time(), job_id, worker),
+            )
+
+    def finish(self, job_id: int, worker: str, error: Optional[str] = None) -> None:
+        """Record a job as succeeded, or failed with an error message."""
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, error = ? '
+                'WHERE id = ? AND worker = ?',
+                (
+                    SUCCEEDED if error is None else FAILED,
+                    time.time(), error, job_id, worker,
+                ),
+            )
+
+    def release(self, job_id: int, worker: str) -> None:
+        """Return a claimed job to the queue without counting the attempt."""
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, worker = NULL, attempts = attempts - 1 '
+                'WHERE id = ? AND worker = ?',
+                (QUEUED, job_id, worker),
+            )
+
+    def requeue_stale(self) -> int:
+        """Requeue jobs of dead workers, returning the number of jobs affected."""
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            count = self._requeue_stale(connection)
+            connection.execute('COMMIT')
+        return count
+
+    def jobs(self) -> pd.DataFrame:
+        """Status and timings of all jobs, one row per job."""
+        with self._connect() as connection:
+            jobs = pd.read_sql_query(
+                'SELECT id, basename, method, output_directory, status, worker, '
+                'attempts, submitted_at, started_at, heartbeat_at, finished_at, '
+                'error FROM jobs ORDER BY id',
+                connection,
+            )
+        jobs['duration'] = jobs['finished_at'] - jobs['started_at']
+        return jobs
+
+    def _requeue_stale(self, connection: sqlite3.Connection) -> int:
+        expired = time.time() - self.lease_timeout
+        connection.execute(
+            'UPDATE jobs SET status = ?, finished_at = ?, error = ? '
+            'WHERE status = ? AND heartbeat_at < ? AND attempts >= ?',
+            (FAILED, time.time(), 'worker died', RUNNING, expired, self.max_attempts),
+        )
+        cursor = connection.execute(
+            'UPDATE jobs SET status = ?, worker = NULL '
+            'WHERE status = ? AND heartbeat_at < ?',
+            (QUEUED, RUNNING, expired),
+        )
+        return cursor.rowcount
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit, transactions are started explicitly where needed
+        connection = sqlite3.connect(self.database, timeout=60, isolation_level=None)
+        return _ClosingConnection(connection)
+
+
+class _ClosingConnection:
+    """Close an SQLite connection on leaving a with block."""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.connection
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is not None and self.connection.in_transaction:
+            self.connection.execute('ROLLBACK')
+        self.connection.close()
+
+
+def run_worker(
+        queue: JobQueue,
+        worker: Optional[str] = None,
+        poll_interval: float = 10,
+        heartbeat_interval: float = 30,
+        max_jobs: Optional[int] = None,
+        exit_when_empty: bool = False,
+) -> int:
+    """Claim and run jobs from a queue until stopped.
+
+    While a job runs its output directory is locked and heartbeats are sent to
+    both the queue and the lock. Jobs whose directory is locked outside the
+    queue are returned to it.
+
+    Parameters
+    ----------
+    queue: queue to take jobs from.
+    worker: name of this worker, defaults to host and process id.
+    poll_interval: seconds to wait before checking an empty queue again.
+    heartbeat_interval: seconds between heartbeats, should be well below the
+        lease timeout of the queue.
+    max_jobs: stop after running this many jobs.
+    exit_when_empty: stop once no job can be claimed.
+
+    Returns
+    -------
+    n_jobs: number of jobs run.
+    """
+    worker = get_worker_id() if worker is None else worker
+    n_jobs = 0
+    while max_jobs is None or n_jobs < max_jobs:
+        job = queue.claim(worker)
+        if job is None:
+            if exit_when_empty is True:
+                break
+            time.sleep(poll_interval)
+            continue
+        lock = DirectoryLock(
+            job.output_directory, owner=worker, lease_timeout=queue.lease_timeout
+        )
+        try:
+            lock.acquire()
+        except DirectoryLockedError:
+            queue.release(job.id, worker)
+            time.sleep(poll_interval)
+            continue
+        try:
+            error = _run_job(queue, job, worker, lock, heartbeat_interval)
+        finally:
+            lock.release()
+        queue.finish(job.id, worker, error=error)
+        n_jobs += 1
+    return n_jobs
+
+
+def _run_job(
+        queue: JobQueue,
+        job: QueuedJob,
+        worker: str,
+        lock: DirectoryLock,
+        heartbeat_interval: float,
+) -> Optional[str]:
+    """Run a claimed job while sending heartbeats, returning an error message.
+
+    If a heartbeat fails the lock is marked lost and the job is failed once the
+    alignment returns, as another worker may have taken over its directory.
+    """
+    is_finished = threading.Event()
+
+    def send_heartbeats():
+        while not is_finished.wait(heartbeat_interval):
+            try:
+                queue.heartbeat(job.id, worker)
+                lock.heartbeat()
+            except Exception:
+                logger.exception(
+                    'heartbeat for job %s failed, lock on %s lost',
+                    job.id, job.output_directory,
+                )
+                lock.mark_lost()
+                return
+
+    heartbeat = threading.Thread(target=send_heartbeats, daemon=True)
+    heartbeat.start()
+    try:
+        ALIGNMENT_FUNCTIONS[job.method](**job.parameters)
+    except Exception as error:
+        return f'{type(error).__name__}: {error}'
+    finally:
+        is_finished.set()
+        heartbeat.join()
+    if lock.is_lost is True:
+        return f'LockLostError: lost lock on {job.output_directory}'
+    return None
+
+
+def _resolve_paths(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: str(Path(value).resolve())
+        if isinstance(value, os.PathLike)
+        or (key in PATH_PARAMETERS and isinstance(value, str))
+        else value
+        for key, value in job.items()
+    }
+
+
+def _encode_parameter(value: Any) -> Any:
+    if isinstance(value, os.PathLike):
+        return str(Path(value).resolve())
+    if isinstance(value, np.ndarray) and value.ndim <= 1:
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serialisable')
@@ -0,0 +1,197 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Union
+
+import numpy as np
+
+from .constants import TARGET_PIXEL_SIZE_FOR_PREVIEW
+from .fiducials import generate_fiducial_based_alignment_directive
+from .patch_tracking import _generate_directive as generate_patch_tracking_directive
+from .utils.binning import find_optimal_power_of_2_binning_factor
+from .utils.etomo import EtomoOutput, prepare_etomo_directory, run_batchruntomo
+from .utils.installation import check_imod_installation
+from .utils.xf import XF
+
+# batchruntomo step 2 is coarse alignment by cross-correlation
+PREVIEW_ENDING_STEP = 2
+
+
+class AlignmentPreview:
+    """Coarse alignment of a tilt-series with an optional refinement in progress."""
+
+    def __init__(
+            self,
+            xf: XF,
+            etomo_output: EtomoOutput,
+            refinement: Optional['Future[EtomoOutput]'] = None,
+    ):
+        self.xf: XF = xf
+        self.etomo_output: EtomoOutput = etomo_output
+        self.refinement: Optional['Future[EtomoOutput]'] = refinement
+
+    def wait(self, timeout: Optional[float] = None) -> EtomoOutput:
+        """Wait for the refinement to finish, raising any error from it."""
+        if self.refinement is None:
+            raise RuntimeError('no refinement was started for this preview.')
+        return self.refinement.result(timeout=timeout)
+
+    def __repr__(self) -> str:
+        return (
+            f'AlignmentPreview(basename={self.etomo_output.basename!r}, '
+            f'refining={self.refinement is not None and not self.refinement.done()})'
+        )
+
+
+def preview_alignment(
+        tilt_series: Union[np.ndarray, os.PathLike],
+        tilt_angles: Sequence[float],
+        pixel_size: float,
+        nominal_rotation_angle: float,
+        basename: str,
+        output_directory: Path,
+        method: str = 'patch_tracking',
+        fiducial_size: Optional[float] = None,
+        patch_size: Optional[float] = None,
+        patch_overlap_percentage: float = 33,
+        refine: bool = True,
+        preview_pixel_size: float = TARGET_PIXEL_SIZE_FOR_PREVIEW,
+) -> AlignmentPreview:
+    """Quickly align a tilt-series by cross-correlation, optionally refining it later.
+
+    batchruntomo stops after coarse alignment, cross-correlation runs on images
+    binned towards `preview_pixel_size`. The coarse transforms only contain
+    shifts, the nominal tilt-axis rotation is applied to them so that they can be
+    used like the xf file of a full alignment.
+
+    If `refine` is True, fiducial or patch-tracking alignment continues from
+    the coarse alignment in a background thread.
+
+    Parameters
+    ----------
+    tilt_series: (n, y, x) array of 2D tilt-images in a tilt-series or an MRC
+        file containing them.
+    tilt_angles: nominal stage tilt-angles from the microscope.
+    pixel_size: nominal pixel size in Angstroms per pixel.
+    nominal_rotation_angle: initial estimate for the rotation angle of the tilt
+        axis. https://bio3d.colorado.edu/imod/doc/tomoguide.html#UnknownAxisAngle
+    basename: basename for files in Etomo directory.
+    output_directory: tilt-series directory for IMOD.
+    method: refinement method, 'fiducials' or 'patch_tracking'.
+    fiducial_size: approximate size of fiducials in nanometers, required for
+        fiducial based refinement.
+    patch_size: sidelength of patches to be tracked in angstroms, required for
+        patch-tracking refinement.
+    patch_overlap_percentage: overlap between patches in each direction.
+    refine: continue into the full alignment in the background.
+    preview_pixel_size: target pixel size for cross-correlation in angstroms.
+
+    Returns
+    -------
+    preview: coarse alignment as `xf` and, if refining, a future resolving to
+        the output of the full alignment as `refinement`.
+    """
+    check_imod_installation()
+    etomo_output = prepare_etomo_directory(
+        directory=Path(output_directory),
+        tilt_series=tilt_series,
+        tilt_angles=tilt_angles,
+        basename=basename,
+    )
+    directive = _generate_refinement_directive(
+        method=method,
+        tilt_series_file=etomo_output.tilt_series_file,
+        pixel_size=pixel_size,
+        rotation_angle=nominal_rotation_angle,
+        fiducial_size=fiducial_size,
+        patch_size=patch_size,
+        patch_overlap_percentage=patch_overlap_percentage,
+    )
+    binning_factor = find_optimal_power_of_2_binning_factor(
+        src_pixel_size=pixel_size, target_pixel_size=preview_pixel_size
+    )
+    preview_directive = dict(directive)
+    preview_directive['comparam.xcorr.tiltxcorr.BinningToApply'] = str(
+        int(binning_factor)
+    )
+    run_batchruntomo(
+        directory=etomo_output.directory,
+        basename=basename,
+        directive=preview_directive,
+        ending_step=PREVIEW_ENDING_STEP,
+    )
+    if not etomo_output.prexg_file.exists():
+        raise RuntimeError(f'{basename} failed coarse alignment.')
+    coarse_xf_data = XF.from_file(etomo_output.prexg_file).xf_data
+    xf = XF(
+        _rotate_transforms(coarse_xf_data, nominal_rotation_angle),
+        initial_tilt_axis_rotation_angle=nominal_rotation_angle,
+    )
+    refinement = None
+    if refine:
+        executor = ThreadPoolExecutor(max_workers=1)
+        refinement = executor.submit(
+            _refine, etomo_output=etomo_output, directive=directive
+        )
+        executor.shutdown(wait=False)
+    return AlignmentPreview(xf=xf, etomo_output=etomo_output, refinement=refinement)
+
+
+def _generate_refinement_directive(
+        method: str,
+        tilt_series_file: Path,
+        pixel_size: float,
+        rotation_angle: float,
+        fiducial_size: Optional[float],
+        patch_size: Optional[float],
+        patch_overlap_percentage: float,
+) -> Dict[str, Any]:
+    if method == 'fiducials':
+        if fiducial_size is None:
+            raise ValueError('fiducial_size is required for fiducial based alignment.')
+        return generate_fiducial_based_alignment_directive(
+            tilt_series_file=tilt_series_file,
+            pixel_size=pixel_size,
+            fiducial_size=fiducial_size,
+            rotation_angle=rotation_angle,
+        )
+    elif method == 'patch_tracking':
+        if patch_size is None:
+            raise ValueError('patch_size is required for patch-tracking alignment.')
+        return generate_patch_tracking_directive(
+            tilt_series_file=tilt_series_file,
+            pixel_size=pixel_size,
+            rotation_angle=rotation_angle,
+            patch_size=patch_size,
+            patch_overlap_percentage=patch_overlap_percentage,
+        )
+    raise ValueError(
+        f"unknown alignment method {method!r}, expected 'fiducials' or 'patch_tracking'"
+    )
+
+
+def _refine(etomo_output: EtomoOutput, directive: Dict[str, Any]) -> EtomoOutput:
+    """Continue an alignment from the coarse aligned stack."""
+    run_batchruntomo(
+        directory=etomo_output.directory,
+        basename=etomo_output.basename,
+        directive=directive,
+        starting_step=PREVIEW_ENDING_STEP + 1,
+    )
+    if not etomo_output.contains_alignment_results:
+        raise RuntimeError(f'{etomo_output.basename} failed to align correctly.')
+    return etomo_output
+
+
+def _rotate_transforms(xf_data: np.ndarray, rotation_angle: float) -> np.ndarray:
+    """Follow (n, 6) xf transforms by a rotation making the tilt-axis vertical.
+
+    A tilt-axis at `rotation_angle` degrees (CCW positive) from the Y-axis is
+    rotated by `-rotation_angle`.
+    """
+    theta = np.deg2rad(-rotation_angle)
+    c, s = np.cos(theta), np.sin(theta)
+    rotation = np.array([[c, -s], [s, c]])
+    matrices = rotation @ xf_data[:, :4].reshape((-1, 2, 2))
+    shifts = xf_data[:, -2:] @ rotation.T
+    return np.concatenate([matrices.reshape((-1, 4)), shifts], axis=-1)
@@ -0,0 +1,214 @@
+import asyncio
+import functools
+import os
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .fiducials import generate_fiducial_based_alignment_directive
+from .patch_tracking import _generate_directive as generate_patch_tracking_directive
+from .utils.etomo import (
+    EtomoOutput,
+    clone_etomo_directory,
+    get_residual_error,
+    prepare_etomo_directory,
+    run_batchruntomo_async,
+)
+from .utils.installation import check_imod_installation
+
+RACE_METHODS = ('fiducials', 'patch_tracking')
+
+
+class RaceResult:
+    """Outcome of aligning a tilt-series with several methods at once."""
+
+    def __init__(
+            self,
+            method: str,
+            etomo_output: EtomoOutput,
+            residual_errors: Dict[str, Optional[float]],
+            errors: Dict[str, str],
+    ):
+        self.method: str = method
+        self.etomo_output: EtomoOutput = etomo_output
+        self.residual_errors: Dict[str, Optional[float]] = residual_errors
+        self.errors: Dict[str, str] = errors
+
+    def __repr__(self) -> str:
+        return (
+            f'RaceResult(method={self.method!r}, '
+            f'residual_errors={self.residual_errors!r})'
+        )
+
+
+def race_alignment_methods(
+        tilt_series: Union[np.ndarray, os.PathLike],
+        tilt_angles: Sequence[float],
+        pixel_size: float,
+        fiducial_size: float,
+        nominal_rotation_angle: float,
+        patch_size: float,
+        patch_overlap_percentage: float,
+        basename: str,
+        output_directory: Path,
+        residual_error_threshold: Optional[float] = None,
+) -> RaceResult:
+    """Run fiducial and patch-tracking alignment concurrently and keep the best.
+
+    Parameters are as for `race_alignment_methods_async`.
+    """
+    return asyncio.run(
+        race_alignment_methods_async(
+            tilt_series=tilt_series,
+            tilt_angles=tilt_angles,
+            pixel_size=pixel_size,
+            fiducial_size=fiducial_size,
+            nominal_rotation_angle=nominal_rotation_angle,
+            patch_size=patch_size,
+            patch_overlap_percentage=patch_overlap_percentage,
+            basename=basename,
+            output_directory=output_directory,
+            residual_error_threshold=residual_error_threshold,
+        )
+    )
+
+
+async def race_alignment_methods_async(
+        tilt_series: Union[np.ndarray, os.PathLike],
+        tilt_angles: Sequence[float],
+        pixel_size: float,
+        fiducial_size: float,
+        nominal_rotation_angle: float,
+        patch_size: float,
+        patch_overlap_percentage: float,
+        basename: str,
+        output_directory: Path,
+        residual_error_threshold: Optional[float] = None,
+) -> RaceResult:
+    """Run fiducial and patch-tracking alignment concurrently and keep the best.
+
+    The tilt-series is staged once in `output_directory / 'shared'`, each method
+    runs in a sibling subdirectory named after the method. The method with the
+    lowest mean residual error in align.log wins.
+
+    Parameters
+    ----------
+    tilt_series: (n, y, x) array of 2D tilt-images in a tilt-series or an MRC
+        file containing them.
+    tilt_angles: nominal stage tilt-angles from the microscope.
+    pixel_size: nominal pixel size in Angstroms per pixel.
+    fiducial_size: approximate size of fiducials in nanometers.
+    nominal_rotation_angle: initial estimate for the rotation angle of the tilt
+        axis. https://bio3d.colorado.edu/imod/doc/tomoguide.html#UnknownAxisAngle
+    patch_size: sidelength of patches to be tracked in angstroms.
+    patch_overlap_percentage: overlap between patches in each direction.
+    basename: basename for files in Etomo directories.
+    output_directory: directory containing one subdirectory per method.
+    residual_error_threshold: mean residual error in nanometers, once a method
+        finishes at or below this the other methods are cancelled.
+
+    Returns
+    -------
+    result: the winning method, its output, residual errors of each method which
+        finished and errors from those which failed.
+    """
+    check_imod_installation()
+    output_directory = Path(output_directory)
+    loop = asyncio.get_running_loop()
+    shared = await loop.run_in_executor(
+        None,
+        functools.partial(
+            prepare_etomo_directory,
+            directory=output_directory / 'shared',
+            tilt_series=tilt_series,
+            tilt_angles=tilt_angles,
+            basename=basename,
+        )
+    )
+    directive_factories = {
+        'fiducials': functools.partial(
+            generate_fiducial_based_alignment_directive,
+            pixel_size=pixel_size,
+            fiducial_size=fiducial_size,
+            rotation_angle=nominal_rotation_angle,
+        ),
+        'patch_tracking': functools.partial(
+            generate_patch_tracking_directive,
+            pixel_size=pixel_size,
+            rotation_angle=nominal_rotation_angle,
+            patch_size=patch_size,
+            patch_overlap_percentage=patch_overlap_percentage,
+        ),
+    }
+    tasks = {
+        asyncio.ensure_future(
+            _align_with_method(
+                shared=shared,
+                generate_directive=directive_factories[method],
+                directory=output_directory / method,
+            )
+        ): method
+        for method in RACE_METHODS
+    }
+    outputs, residual_errors, errors = {}, {}, {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                method = tasks[task]
+                try:
+                    outputs[method], residual_errors[method] = task.result()
+                except Exception as error:
+                    errors[method] = f'{type(error).__name__}: {error}'
+            if residual_error_threshold is not None and any(
+                    error is not None and error <= residual_error_threshold
+                    for error in residual_errors.values()
+            ):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if len(outputs) == 0:
+        raise RuntimeError(
+            f'{basename} failed to align with any method: '
+            + '; '.join(f'{method}: {error}' for method, error in errors.items())
+        )
+    winner = min(
+        outputs,
+        key=lambda method: np.inf if residual_errors[method] is None
+        else residual_errors[method]
+    )
+    return RaceResult(
+        method=winner,
+        etomo_output=outputs[winner],
+        residual_errors=residual_errors,
+        errors=errors,
+    )
+
+
+async def _align_with_method(
+        shared: EtomoOutput,
+        generate_directive: Callable[..., Dict[str, str]],
+        directory: Path,
+) -> Tuple[EtomoOutput, Optional[float]]:
+    """Align a clone of the shared directory, returning the mean residual error."""
+    loop = asyncio.get_running_loop()
+    etomo_output = await loop.run_in_executor(
+        None, functools.partial(clone_etomo_directory, shared, directory)
+    )
+    directive = generate_directive(tilt_series_file=etomo_output.tilt_series_file)
+    await run_batchruntomo_async(
+        directory=etomo_output.directory,
+        basename=etomo_output.basename,
+        directive=directive,
+    )
+    if not etomo_output.contains_alignment_results:
+        raise RuntimeError(f'{etomo_output.basename} failed to align correctly.')
+    residual_error = get_residual_error(etomo_output.align_log_file)
+    return etomo_output, None if residual_error is None else residual_error[0]
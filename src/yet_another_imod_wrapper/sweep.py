@@ -0,0 +1,152 @@
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .batch import get_default_max_workers
+from .patch_tracking import _generate_directive
+from .utils.etomo import (
+    EtomoOutput,
+    apply_comparam_directives,
+    clone_etomo_directory,
+    get_residual_error,
+    prepare_etomo_directory,
+    run_batchruntomo,
+)
+from .utils.installation import check_imod_installation
+
+# batchruntomo step 4 runs patch tracking, earlier steps are shared by all variants
+PATCH_TRACKING_STEP = 4
+
+
+def sweep_patch_tracking_parameters(
+        tilt_series: Union[np.ndarray, os.PathLike],
+        tilt_angles: Sequence[float],
+        nominal_rotation_angle: float,
+        pixel_size: float,
+        patch_sizes: Sequence[float],
+        patch_overlap_percentages: Sequence[float],
+        basename: str,
+        output_directory: Path,
+        max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """Run patch-tracking alignment for every combination of patch parameters.
+
+    Setup, coarse alignment and generation of the prealigned stack run once
+    in `output_directory / 'shared'`. Patch tracking and fine alignment then run
+    for each variant in parallel, in directories sharing the intermediate
+    image data.
+
+    Parameters
+    ----------
+    tilt_series: (n, y, x) array of 2D tilt-images in a tilt-series or an MRC
+        file containing them.
+    tilt_angles: nominal stage tilt-angles from the microscope.
+    nominal_rotation_angle: initial estimate for the rotation angle of the tilt
+        axis. https://bio3d.colorado.edu/imod/doc/tomoguide.html#UnknownAxisAngle
+    pixel_size: pixel size of the tilt-series in angstroms-per-pixel
+    patch_sizes: sidelengths of patches to be tracked in angstroms.
+    patch_overlap_percentages: overlaps between patches in each direction.
+    basename: basename for IMOD files.
+    output_directory: directory containing one subdirectory per variant.
+    max_workers: maximum number of variants aligned at the same time,
+        defaults to the number of CPUs up to `DEFAULT_MAX_WORKERS` as each
+        batchruntomo run uses every core.
+
+    Returns
+    -------
+    results: one row per variant with `patch_size`, `patch_overlap_percentage`,
+        `directory`, `residual_error_mean` and `residual_error_sd` (nanometers)
+        and `error` columns. `error` is empty unless the variant failed.
+    """
+    check_imod_installation()
+    output_directory = Path(output_directory)
+    variants = list(itertools.product(patch_sizes, patch_overlap_percentages))
+    shared = prepare_etomo_directory(
+        directory=output_directory / 'shared',
+        tilt_series=tilt_series,
+        tilt_angles=tilt_angles,
+        basename=basename,
+    )
+    directives = [
+        _generate_directive(
+            tilt_series_file=shared.tilt_series_file,
+            pixel_size=pixel_size,
+            rotation_angle=nominal_rotation_angle,
+            patch_size=patch_size,
+            patch_overlap_percentage=patch_overlap_percentage,
+        )
+        for patch_size, patch_overlap_percentage in variants
+    ]
+    run_batchruntomo(
+        directory=shared.directory,
+        basename=basename,
+        directive=directives[0],
+        ending_step=PATCH_TRACKING_STEP - 1,
+    )
+    if not (shared.directory / f'{basename}_preali.mrc').exists():
+        raise RuntimeError(f'{basename} failed to generate a prealigned stack.')
+
+    if max_workers is None:
+        max_workers = get_default_max_workers()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _align_variant,
+                shared=shared,
+                shared_directive=directives[0],
+                directive=directive,
+                directory=output_directory / _get_variant_name(*variant),
+            )
+            for variant, directive in zip(variants, directives)
+        ]
+        results = []
+        for (patch_size, patch_overlap_percentage), future in zip(variants, futures):
+            row = {
+                'patch_size': patch_size,
+                'patch_overlap_percentage': patch_overlap_percentage,
+                'directory': output_directory / _get_variant_name(
+                    patch_size, patch_overlap_percentage
+                ),
+                'residual_error_mean': np.nan,
+                'residual_error_sd': np.nan,
+                'error': '',
+            }
+            try:
+                etomo_output = future.result()
+                residual_error = get_residual_error(etomo_output.align_log_file)
+                if residual_error is not None:
+                    row['residual_error_mean'], row['residual_error_sd'] = residual_error
+            except Exception as error:
+                row['error'] = f'{type(error).__name__}: {error}'
+            results.append(row)
+    return pd.DataFrame(results)
+
+
+def _align_variant(
+        shared: EtomoOutput,
+        shared_directive: Dict[str, str],
+        directive: Dict[str, str],
+        directory: Path,
+) -> EtomoOutput:
+    """Run patch tracking and fine alignment for one variant."""
+    etomo_output = clone_etomo_directory(shared, directory)
+    changes = {k: v for k, v in directive.items() if shared_directive.get(k) != v}
+    apply_comparam_directives(etomo_output.directory, changes)
+    run_batchruntomo(
+        directory=etomo_output.directory,
+        basename=etomo_output.basename,
+        directive=directive,
+        starting_step=PATCH_TRACKING_STEP,
+    )
+    if not etomo_output.contains_alignment_results:
+        raise RuntimeError(f'{directory.name} failed to align correctly.')
+    return etomo_output
+
+
+def _get_variant_name(patch_size: float, patch_overlap_percentage: float) -> str:
+    return f'patch_size_{patch_size:g}_overlap_{patch_overlap_percentage:g}'
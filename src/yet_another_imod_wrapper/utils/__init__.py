@@ -3,3 +3,14 @@ from . import etomo
 from . import binning
 from . import io
 from . import xf
+from . import fingerprint
+from . import prescreen
+from . import cache
+from . import retry
+from . import monitor
+from . import profiling
+from . import events
+from . import scheduler
+from . import backends
+from . import locking
+from . import projection
@@ -0,0 +1,350 @@
+import abc
+import concurrent.futures
+import os
+import re
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Sequence, Tuple
+
+from . import events
+from .monitor import BatchruntomoMonitor
+
+BATCH_JOB_SCRIPT_SUFFIX = '_batchruntomo.sh'
+BATCH_JOB_EXIT_CODE_SUFFIX = '_batchruntomo.exit'
+BATCH_JOB_ID_PATTERN = re.compile(r'\d+')
+PROCESS_ID_SUFFIX = '_batchruntomo.pid'
+
+
+class BatchruntomoJob:
+    """A batchruntomo command and how it should be run."""
+
+    def __init__(
+            self,
+            command: List[str],
+            directory: Path,
+            basename: str,
+            append_log: bool = False,
+            timeout: Optional[float] = None,
+            environment: Optional[Dict[str, str]] = None,
+            cpu_affinity: Optional[Sequence[int]] = None,
+    ):
+        self.command: List[str] = list(command)
+        self.directory: Path = Path(directory)
+        self.basename: str = basename
+        self.append_log: bool = append_log
+        self.timeout: Optional[float] = timeout
+        self.environment: Optional[Dict[str, str]] = environment
+        self.cpu_affinity: Optional[Sequence[int]] = cpu_affinity
+
+    @property
+    def log_file(self) -> Path:
+        return self.directory / 'log.txt'
+
+
+class ExecutionBackend(abc.ABC):
+    """Runs batchruntomo jobs, subclasses decide where and how.
+
+    `run` blocks until the job has finished and returns its exit code. Output
+    should end up in the job's log file and be fed to `monitor` so fatal errors
+    and the last step are known. `TimeoutError` is raised if the job did not
+    finish within its timeout. Backends holding resources release them in
+    `close`, they can be used as context managers.
+    """
+
+    @abc.abstractmethod
+    def run(self, job: BatchruntomoJob, monitor: BatchruntomoMonitor) -> int:
+        """Run a job to completion, returning the exit code of batchruntomo."""
+
+    def close(self) -> None:  # noqa: B027
+        """Release resources held by the backend, by default there are none."""
+
+    def __enter__(self) -> 'ExecutionBackend':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class LocalBackend(ExecutionBackend):
+    """Run batchruntomo as a child of this process.
+
+    Output is streamed to the log and monitor line by line, a fatal error or
+    timeout kills batchruntomo along with any IMOD programs it started.
+    """
+
+    def run(self, job: BatchruntomoJob, monitor: BatchruntomoMonitor) -> int:
+        with open(job.log_file, mode='a' if job.append_log else 'w') as log:
+            process = subprocess.Popen(
+                job.command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+                env=get_environment(job.environment),
+            )
+            set_cpu_affinity(process.pid, job.cpu_affinity)
+            monitor.start(process.pid)
+            reader = threading.Thread(
+                target=_stream_output,
+                args=(process, log, monitor, job.basename),
+                daemon=True,
+            )
+            reader.start()
+            try:
+                returncode = process.wait(timeout=job.timeout)
+            except subprocess.TimeoutExpired as error:
+                kill_process_group(process.pid)
+                process.wait()
+                raise TimeoutError(
+                    f'batchruntomo timed out after {job.timeout}s'
+                ) from error
+            except BaseException:
+                kill_process_group(process.pid)
+                process.wait()
+                raise
+            finally:
+                # the monitor sees every line before it finishes, e.g. for profiling
+                reader.join()
+                monitor.finish(job.directory)
+        return returncode
+
+
+class ProcessPoolBackend(ExecutionBackend):
+    """Run batchruntomo from a pool of worker processes.
+
+    Output is streamed and monitored in the worker, the final state of its
+    monitor is copied back once the job has finished. Step events and
+    profiling are not available from worker processes. The worker records the
+    process id of batchruntomo in the Etomo directory, on timeout or interrupt
+    its process group is killed from here. Call `close` or use the backend as
+    a context manager to shut the pool down.
+
+    Parameters
+    ----------
+    max_workers: number of worker processes, defaults to the number of CPUs.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+
+    def run(self, job: BatchruntomoJob, monitor: BatchruntomoMonitor) -> int:
+        process_id_file = job.directory / f'{job.basename}{PROCESS_ID_SUFFIX}'
+        future = self._pool.submit(
+            _run_in_worker, job, monitor.fatal_patterns, process_id_file
+        )
+        try:
+            done, _ = concurrent.futures.wait([future], timeout=job.timeout)
+            if not done:
+                raise TimeoutError(f'batchruntomo timed out after {job.timeout}s')
+            returncode, (current_step, current_comfile, fatal_error) = future.result()
+        except BaseException:
+            future.cancel()
+            _kill_worker_job(process_id_file)
+            raise
+        monitor.current_step = current_step
+        monitor.current_comfile = current_comfile
+        monitor.fatal_error = fatal_error
+        return returncode
+
+    def close(self) -> None:
+        self._pool.shutdown()
+
+
+class BatchSchedulerBackend(ExecutionBackend):
+    """Submit batchruntomo to a batch scheduler such as SLURM.
+
+    A job script is written into the Etomo directory and passed as the last
+    argument to `submit_command`. The script appends output to the log and
+    finally writes the exit code of batchruntomo to a file, which is polled
+    for every `poll_interval` seconds. The log is fed to the monitor once the
+    job has finished. The Etomo directory must be on a filesystem shared with
+    the compute nodes.
+
+    Parameters
+    ----------
+    submit_command: command used to submit the job script, e.g. ('sbatch',).
+    cancel_command: command used to cancel a job on timeout, called with the
+        first number printed by `submit_command` as its job id, e.g. ('scancel',).
+    poll_interval: seconds between checks for job completion.
+    directives: extra lines for the job script header, e.g. '#SBATCH --mem=16G'.
+    """
+
+    def __init__(
+            self,
+            submit_command: Sequence[str] = ('sbatch',),
+            cancel_command: Optional[Sequence[str]] = ('scancel',),
+            poll_interval: float = 5,
+            directives: Sequence[str] = (),
+    ):
+        self.submit_command: List[str] = list(submit_command)
+        self.cancel_command: Optional[List[str]] = (
+            None if cancel_command is None else list(cancel_command)
+        )
+        self.poll_interval: float = poll_interval
+        self.directives: List[str] = list(directives)
+
+    def run(self, job: BatchruntomoJob, monitor: BatchruntomoMonitor) -> int:
+        script_file = job.directory / f'{job.basename}{BATCH_JOB_SCRIPT_SUFFIX}'
+        exit_code_file = job.directory / f'{job.basename}{BATCH_JOB_EXIT_CODE_SUFFIX}'
+        exit_code_file.unlink(missing_ok=True)
+        if job.append_log is False or not job.log_file.exists():
+            job.log_file.write_text('')
+        log_offset = job.log_file.stat().st_size
+        script_file.write_text(self.get_job_script(job, exit_code_file))
+        script_file.chmod(0o755)
+        job_id = self._submit(script_file.resolve())
+        try:
+            returncode = self._wait(exit_code_file, job.timeout)
+        except BaseException:
+            self._cancel(job_id)
+            raise
+        with open(job.log_file, mode='rb') as log:
+            log.seek(log_offset)
+            for line in log:
+                feed_monitor(monitor, line.decode(errors='replace'), job.basename)
+        return returncode
+
+    def get_job_script(self, job: BatchruntomoJob, exit_code_file: Path) -> str:
+        """Shell script which runs batchruntomo and records its exit code.
+
+        Paths are absolute and the script changes into the Etomo directory, so
+        it does not depend on the directory it is started from.
+        """
+        directory = shlex.quote(str(job.directory.resolve()))
+        log_file = shlex.quote(str(job.log_file.resolve()))
+        exit_code_file = exit_code_file.resolve()
+        temporary_exit_code_file = shlex.quote(f'{exit_code_file}.tmp')
+        lines = ['#!/bin/sh', *self.directives, f'cd {directory}']
+        lines += [
+            f'export {name}={shlex.quote(value)}'
+            for name, value in (job.environment or {}).items()
+        ]
+        lines += [
+            f'{_join_command(job.command)} >> {log_file} 2>&1',
+            f'echo $? > {temporary_exit_code_file}',
+            f'mv {temporary_exit_code_file} {shlex.quote(str(exit_code_file))}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def _submit(self, script_file: Path) -> Optional[str]:
+        """Submit a job script, returning the job id if one was printed."""
+        result = subprocess.run(
+            [*self.submit_command, str(script_file)], capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f'failed to submit {script_file.name} with exit code '
+                f'{result.returncode}: {result.stderr.strip()}'
+            )
+        match = BATCH_JOB_ID_PATTERN.search(result.stdout)
+        return None if match is None else match.group()
+
+    def _wait(self, exit_code_file: Path, timeout: Optional[float]) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not exit_code_file.exists():
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f'batchruntomo timed out after {timeout}s')
+            time.sleep(self.poll_interval)
+        return int(exit_code_file.read_text().strip())
+
+    def _cancel(self, job_id: Optional[str]) -> None:
+        if self.cancel_command is not None and job_id is not None:
+            subprocess.run([*self.cancel_command, job_id], capture_output=True)
+
+
+class _ProcessIdMonitor(BatchruntomoMonitor):
+    """Monitor recording the process id of batchruntomo while it runs."""
+
+    def __init__(self, process_id_file: Path, fatal_patterns: Sequence[re.Pattern]):
+        super().__init__(fatal_patterns=fatal_patterns)
+        self.process_id_file: Path = process_id_file
+
+    def start(self, pid: int) -> None:
+        self.process_id_file.write_text(str(pid))
+
+    def finish(self, directory: Path) -> None:
+        self.process_id_file.unlink(missing_ok=True)
+
+
+def _run_in_worker(
+        job: BatchruntomoJob,
+        fatal_patterns: Sequence[re.Pattern],
+        process_id_file: Path,
+) -> Tuple[int, Tuple[Optional[int], Optional[str], Optional[str]]]:
+    """Run a job locally in a worker process, returning the monitor state."""
+    monitor = _ProcessIdMonitor(process_id_file, fatal_patterns=fatal_patterns)
+    returncode = LocalBackend().run(job, monitor)
+    state = (monitor.current_step, monitor.current_comfile, monitor.fatal_error)
+    return returncode, state
+
+
+def _kill_worker_job(process_id_file: Path) -> None:
+    """Kill batchruntomo started by a worker process if it is still running."""
+    try:
+        pid = int(process_id_file.read_text())
+    except (FileNotFoundError, ValueError):
+        return
+    kill_process_group(pid)
+
+
+def _join_command(command: Sequence[str]) -> str:
+    return ' '.join(shlex.quote(str(argument)) for argument in command)
+
+
+def get_environment(environment: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+    return None if environment is None else {**os.environ, **environment}
+
+
+def set_cpu_affinity(pid: int, cpu_affinity: Optional[Sequence[int]]) -> None:
+    """Restrict a process to some CPUs, processes it starts later inherit this."""
+    if cpu_affinity is not None and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(pid, cpu_affinity)
+        except ProcessLookupError:
+            pass
+
+
+def feed_monitor(monitor: BatchruntomoMonitor, line: str, basename: str) -> bool:
+    """Feed a line of output to the monitor, emitting an event on step changes."""
+    previous_comfile = monitor.current_comfile
+    is_fatal = monitor.feed(line)
+    if monitor.current_comfile != previous_comfile:
+        events.emit(
+            events.BATCHRUNTOMO_STEP,
+            basename,
+            step=monitor.current_step,
+            comfile=monitor.current_comfile,
+        )
+    return is_fatal
+
+
+def _stream_output(
+        process: subprocess.Popen,
+        log: IO[str],
+        monitor: BatchruntomoMonitor,
+        basename: str,
+) -> None:
+    """Write output to the log as it arrives, killing the process on fatal errors."""
+    is_aborted = False
+    for line in iter(process.stdout.readline, b''):
+        line = line.decode(errors='replace')
+        log.write(line)
+        log.flush()
+        if feed_monitor(monitor, line, basename) and not is_aborted:
+            kill_process_group(process.pid)
+            is_aborted = True
+    process.stdout.close()
+
+
+def kill_process_group(pid: int) -> None:
+    """Kill a process started in a new session along with its children."""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(pid, signal.SIGKILL)
+        else:
+            os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
@@ -1,3 +1,8 @@
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
 import numpy as np
 
 
@@ -23,3 +28,55 @@ def _find_optimal_binning_factor(
     binned_pixel_sizes = binning_factors * src_pixel_size
     pixel_size_deltas = np.abs(binned_pixel_sizes - target_pixel_size)
     return binning_factors[np.argmin(pixel_size_deltas)]
+
+
+def fourier_bin_images(
+        images: np.ndarray, binning_factor: int, n_threads: Optional[int] = None
+) -> np.ndarray:
+    """Bin images by cropping their Fourier transforms.
+
+    Images are trimmed to a multiple of `binning_factor` about their center
+    before cropping so that the binned pixel size is exactly `binning_factor`
+    times the original pixel size. The mean of each image is preserved.
+
+    Parameters
+    ----------
+    images: (..., h, w) array of images.
+    binning_factor: integer binning factor.
+    n_threads: number of threads over which images are split,
+        defaults to the number of CPUs.
+
+    Returns
+    -------
+    binned_images: (..., h // binning_factor, w // binning_factor) float32 array.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    if binning_factor == 1:
+        return images
+    h, w = images.shape[-2:]
+    binned_h, binned_w = h // binning_factor, w // binning_factor
+    dh = (h - binned_h * binning_factor) // 2
+    dw = (w - binned_w * binning_factor) // 2
+    images = images[..., dh:dh + binned_h * binning_factor, dw:dw + binned_w * binning_factor]
+    batch_shape = images.shape[:-2]
+    images = images.reshape((-1, *images.shape[-2:]))
+    n_threads = min(n_threads or os.cpu_count() or 1, len(images))
+    crop = functools.partial(_fourier_crop, output_shape=(binned_h, binned_w))
+    if n_threads <= 1:
+        binned_images = crop(images)
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            chunks = np.array_split(images, n_threads)
+            binned_images = np.concatenate(list(executor.map(crop, chunks)))
+    return binned_images.reshape((*batch_shape, binned_h, binned_w))
+
+
+def _fourier_crop(images: np.ndarray, output_shape: Tuple[int, int]) -> np.ndarray:
+    """Crop the Fourier transforms of a (b, h, w) stack of images."""
+    h = images.shape[-2]
+    output_h, output_w = output_shape
+    fourier_transforms = np.fft.rfft2(images, norm='forward')
+    rows = np.r_[0:(output_h + 1) // 2, h - output_h // 2:h]
+    fourier_transforms = fourier_transforms[:, rows, :output_w // 2 + 1]
+    binned_images = np.fft.irfft2(fourier_transforms, s=output_shape, norm='forward')
+    return binned_images.astype(np.float32)
@@ -0,0 +1,147 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from .etomo import EtomoOutput
+from .installation import _get_imod_version
+
+DEFAULT_CACHE_SIZE = 10 * 1024 ** 3  # bytes
+
+logger = logging.getLogger(__name__)
+
+
+class AlignmentCache:
+    """Content-addressed cache of alignment results shared between projects.
+
+    Entries are keyed on the fingerprint of the staged tilt-series, the tilt
+    angles, the batchruntomo directive and the IMOD version. Each entry holds
+    the `.xf`, `.tlt` and `align.log` files from an Etomo directory.
+
+    The least recently used entries are evicted once the cache grows beyond
+    `max_size` bytes. Entries are written to a temporary directory and renamed
+    into place so multiple processes can share a cache without locking.
+    """
+
+    def __init__(self, directory: os.PathLike, max_size: int = DEFAULT_CACHE_SIZE):
+        self.directory: Path = Path(directory)
+        self.max_size: int = max_size
+        self.entries_directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def entries_directory(self) -> Path:
+        return self.directory / 'entries'
+
+    def get_key(self, etomo_output: EtomoOutput, directive: Dict[str, Any]) -> str:
+        """Get the cache key for an Etomo directory prepared with a fingerprint."""
+        manifest = etomo_output.staging_manifest
+        if manifest is None or manifest.get('fingerprint') is None:
+            raise ValueError(
+                f'no fingerprint found for {etomo_output.tilt_series_file}, '
+                'prepare the directory with a fingerprint to use a cache.'
+            )
+        key_data = {
+            'tilt_series': manifest,
+            'tilt_angles': etomo_output.rawtlt_file.read_text(),
+            'directive': {str(k): str(v) for k, v in directive.items()},
+            'imod_version': str(_get_imod_version()),
+        }
+        serialized = json.dumps(key_data, sort_keys=True).encode()
+        return hashlib.sha256(serialized).hexdigest()
+
+    def retrieve(self, key: str, etomo_output: EtomoOutput) -> bool:
+        """Copy cached results into an Etomo directory.
+
+        Returns
+        -------
+        hit: True if results were found and copied.
+        """
+        entry = self.entries_directory / key
+        try:
+            for src, dst in _get_cached_files(entry, etomo_output):
+                _atomic_copy(src, dst)
+            os.utime(entry)  # mark as recently used
+        except FileNotFoundError:  # missing or evicted by another process
+            return False
+        return True
+
+    def store(self, key: str, etomo_output: EtomoOutput) -> None:
+        """Add results from an Etomo directory to the cache and evict old entries.
+
+        Results already stored by another process are left in place, failures
+        to store them, e.g. a full disk, are logged as the cache is optional.
+        """
+        staging_directory = self.directory / f'tmp-{uuid.uuid4().hex}'
+        staging_directory.mkdir()
+        try:
+            for dst, src in _get_cached_files(staging_directory, etomo_output):
+                shutil.copyfile(src, dst)
+            os.rename(staging_directory, self.entries_directory / key)
+        except OSError as error:
+            if error.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                logger.warning(
+                    'failed to store %s in cache %s: %s',
+                    etomo_output.basename, self.directory, error,
+                )
+        finally:
+            shutil.rmtree(staging_directory, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in `max_size`."""
+        entries = sorted(self._list_entries(), key=lambda entry: entry[1])
+        total_size = sum(size for _, _, size in entries)
+        for entry, _, size in entries:
+            if total_size <= self.max_size:
+                break
+            trash = self.directory / f'trash-{uuid.uuid4().hex}'
+            try:
+                os.rename(entry, trash)
+            except OSError:  # evicted by another process
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total_size -= size
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        max_size, self.max_size = self.max_size, -1
+        try:
+            self.evict()
+        finally:
+            self.max_size = max_size
+
+    def _list_entries(self) -> List[Tuple[Path, float, int]]:
+        """(path, last used time, size in bytes) for each entry."""
+        entries = []
+        for entry in self.entries_directory.iterdir():
+            try:
+                last_used = entry.stat().st_mtime
+                size = sum(file.stat().st_size for file in entry.iterdir())
+            except FileNotFoundError:
+                continue
+            entries.append((entry, last_used, size))
+        return entries
+
+
+def _get_cached_files(
+        entry: Path, etomo_output: EtomoOutput
+) -> List[Tuple[Path, Path]]:
+    """(file in cache entry, file in Etomo directory) pairs."""
+    files = [etomo_output.xf_file, etomo_output.tlt_file, etomo_output.align_log_file]
+    return [(entry / file.name, file) for file in files]
+
+
+def _atomic_copy(src: Path, dst: Path) -> None:
+    """Copy a file such that `dst` is never seen partially written."""
+    tmp = dst.with_name(f'.{dst.name}.{uuid.uuid4().hex}')
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
@@ -1,12 +1,61 @@
-import subprocess
+import asyncio
+import contextlib
+import os
+import shutil
 import tempfile
 from pathlib import Path
-from typing import Sequence, List, Dict, Union
+from typing import IO, Any, Iterator, Sequence, List, Dict, Optional, Tuple, Union
 
 import mrcfile
 import numpy as np
 
-from .io import write_adoc
+from .fingerprint import (
+    fingerprint_tilt_series,
+    read_fingerprint_manifest,
+    write_fingerprint_manifest,
+)
+from .binning import fourier_bin_images
+from . import events
+from .io import link_file, write_adoc
+from .backends import (
+    BatchruntomoJob,
+    ExecutionBackend,
+    LocalBackend,
+    feed_monitor,
+    get_environment,
+    kill_process_group,
+    set_cpu_affinity,
+)
+from .monitor import BatchruntomoMonitor
+from .profiling import PROFILE_FILENAME, BatchruntomoProfiler, read_profile
+
+# MRC modes for data types which can be written into an Etomo directory
+STAGING_MRC_MODES = {
+    np.dtype(np.int8): 0,
+    np.dtype(np.int16): 1,
+    np.dtype(np.float32): 2,
+    np.dtype(np.uint16): 6,
+    np.dtype(np.float16): 12,
+}
+PREBINNING_IMAGES_PER_CHUNK = 8
+BATCHRUNTOMO_DIRECTIVE_FILENAME = 'batchruntomo.adoc'
+# files copied back from scratch space by default, formatted with the basename
+SCRATCH_KEEP_FILES = (
+    '{basename}.xf', '{basename}.tlt', 'align.log', '{basename}.edf', 'log.txt',
+    '{basename}.fingerprint.json',
+)
+
+# batchruntomo runs up to fine alignment
+BATCHRUNTOMO_ENDING_STEP = 6
+# files written by each batchruntomo step, any one set of files marks completion
+BATCHRUNTOMO_STEP_OUTPUTS = {
+    0: [('{basename}.edf', 'xcorr.com')],  # setup
+    2: [('{basename}.prexg',)],  # coarse cross-correlation
+    3: [('{basename}_preali.mrc',)],  # prealigned stack
+    4: [('{basename}.seed',), ('{basename}.fid',)],  # seeding or patch tracking
+    5: [('{basename}.fid',)],  # bead tracking
+    6: [('{basename}.xf', '{basename}.tlt', 'align.log')],  # fine alignment
+}
 
 
 class EtomoOutput:
@@ -17,6 +66,7 @@ class EtomoOutput:
     def __init__(self, basename: str, directory: Path):
         self.directory: Path = directory
         self.basename: str = basename
+        self.excluded_views: List[int] = []  # 0-indexed, set by pre-screening
 
     @property
     def tilt_series_file(self) -> Path:
@@ -30,6 +80,10 @@ class EtomoOutput:
     def xf_file(self) -> Path:
         return self.directory / f'{self.basename}.xf'
 
+    @property
+    def prexg_file(self) -> Path:
+        return self.directory / f'{self.basename}.prexg'
+
     @property
     def tlt_file(self) -> Path:
         return self.directory / f'{self.basename}.tlt'
@@ -38,6 +92,37 @@ class EtomoOutput:
     def edf_file(self) -> Path:
         return self.directory / f'{self.basename}.edf'
 
+    @property
+    def fingerprint_file(self) -> Path:
+        return self.directory / f'{self.basename}.fingerprint.json'
+
+    @property
+    def staging_manifest(self) -> Optional[Dict[str, Any]]:
+        """Manifest describing the staged tilt-series.
+
+        The content fingerprint is None unless staged with a fingerprint.
+        """
+        return read_fingerprint_manifest(self.fingerprint_file)
+
+    @property
+    def binning_factor(self) -> int:
+        """Binning of the staged tilt-series relative to the input.
+
+        Shifts in the xf file and image shapes of the staged tilt-series are in
+        binned pixels, multiply shifts by this factor for input pixels.
+        """
+        manifest = self.staging_manifest
+        return 1 if manifest is None else int(manifest.get('binning_factor', 1))
+
+    @property
+    def profile_file(self) -> Path:
+        return self.directory / PROFILE_FILENAME
+
+    @property
+    def profile(self) -> Optional[Dict[str, Any]]:
+        """Resource usage of the last profiled batchruntomo run, if any."""
+        return read_profile(self.profile_file)
+
     @property
     def align_log_file(self) -> Path:
         return self.directory / 'align.log'
@@ -53,46 +138,510 @@ class EtomoOutput:
 
 def prepare_etomo_directory(
         directory: Path,
-        tilt_series: np.ndarray,
+        tilt_series: Union[np.ndarray, os.PathLike],
         tilt_angles: Sequence[float],
         basename: str,
+        fingerprint: Optional[str] = None,
+        staging_dtype: str = 'float32',
+        binning_factor: int = 1,
 ) -> EtomoOutput:
-    """Prepare a directory for IMOD tilt-series alignment."""
-    directory.mkdir(exist_ok=True, parents=True)
-    output = EtomoOutput(basename=basename, directory=directory)
+    """Prepare a directory for IMOD tilt-series alignment.
+
+    `tilt_series` may be a lazy array-like, it is written one image at a time.
+    If `tilt_series` is an MRC file which already has the staging data type
+    it is linked into the directory, otherwise it is converted from a memory map.
+
+    By default an existing tilt-series file is reused if its shape and data type
+    match. If `fingerprint` is 'full' or 'sampled' the file is only reused if a
+    manifest next to it records the same content fingerprint.
+
+    `staging_dtype` is one of
+    - 'float32': always write float32 (MRC mode 2).
+    - 'native': keep int8, int16, uint16 or float16 data as is, uint8 is
+      widened to uint16. Other types are written as float32.
+    - 'float16': write float16 (MRC mode 12), values must be within range.
+
+    If `binning_factor` is greater than 1 the tilt-series is binned by Fourier
+    cropping as it is written, integer data are then staged as float32. The
+    binning factor is recorded in the staging manifest in any case.
+    """
+    with events.timed_events(
+            events.STAGING_STARTED,
+            events.STAGING_FINISHED,
+            events.STAGING_FAILED,
+            basename=basename,
+            directory=directory,
+    ) as finished:
+        directory.mkdir(exist_ok=True, parents=True)
+        output = EtomoOutput(basename=basename, directory=directory)
+        if isinstance(tilt_series, (str, os.PathLike)):
+            with mrcfile.mmap(tilt_series, mode='r') as mrc:
+                dtype = _get_staging_dtype(mrc.data.dtype, staging_dtype, binning_factor)
+                is_linkable = (
+                    mrc.data.dtype.newbyteorder('=') == dtype and binning_factor == 1
+                )
+                source_file = Path(tilt_series) if is_linkable else None
+                _stage_tilt_series(
+                    output, mrc.data, dtype, fingerprint, binning_factor, source_file
+                )
+        else:
+            dtype = _get_staging_dtype(tilt_series.dtype, staging_dtype, binning_factor)
+            _stage_tilt_series(output, tilt_series, dtype, fingerprint, binning_factor)
+        np.savetxt(output.rawtlt_file, tilt_angles, fmt='%.2f', delimiter='')
+        finished['bytes'] = output.tilt_series_file.stat().st_size
+    return output
+
+
+def _get_staging_dtype(
+        input_dtype: np.dtype, staging_dtype: str, binning_factor: int = 1
+) -> np.dtype:
+    """Get the data type used to write a tilt-series into an Etomo directory."""
+    input_dtype = np.dtype(input_dtype).newbyteorder('=')
+    if binning_factor > 1 and input_dtype.kind != 'f':
+        # binned data are not integers
+        input_dtype = np.dtype(np.float32)
+    if staging_dtype == 'float32':
+        return np.dtype(np.float32)
+    elif staging_dtype == 'float16':
+        return np.dtype(np.float16)
+    elif staging_dtype == 'native':
+        if input_dtype == np.uint8:
+            return np.dtype(np.uint16)
+        elif input_dtype in STAGING_MRC_MODES:
+            return input_dtype
+        return np.dtype(np.float32)
+    raise ValueError(
+        f"staging_dtype must be 'float32', 'native' or 'float16', got {staging_dtype!r}"
+    )
+
+
+def _stage_tilt_series(
+        output: EtomoOutput,
+        tilt_series: np.ndarray,
+        dtype: np.dtype,
+        fingerprint: Optional[str] = None,
+        binning_factor: int = 1,
+        source_file: Optional[Path] = None,
+) -> None:
+    """Write a tilt-series into an Etomo directory unless it is already there.
+
+    If `source_file` is provided it is linked into place rather than written.
+    """
     tilt_series_file = output.tilt_series_file
-    data_on_disk_shape = None
+    is_linked = False
+    data_on_disk = None
     if tilt_series_file.exists():
+        if source_file is not None and os.path.samefile(source_file, tilt_series_file):
+            is_linked = True
         with mrcfile.open(tilt_series_file, header_only=True) as mrc:
-            data_on_disk_shape = (mrc.header.nz, mrc.header.ny, mrc.header.nx)
-    if not np.array_equal(tilt_series.shape, data_on_disk_shape):
-        mrcfile.write(
+            data_on_disk = (
+                (int(mrc.header.nz), int(mrc.header.ny), int(mrc.header.nx)),
+                int(mrc.header.mode)
+            )
+    n, ny, nx = tilt_series.shape
+    staged_shape = (n, ny // binning_factor, nx // binning_factor)
+    data_matches = (staged_shape, STAGING_MRC_MODES[dtype]) == data_on_disk
+    if fingerprint is None:
+        manifest = read_fingerprint_manifest(output.fingerprint_file)
+        if not data_matches:
+            manifest = None
+            output.fingerprint_file.unlink(missing_ok=True)
+            _write_tilt_series(
+                tilt_series_file, tilt_series, dtype, binning_factor, source_file
+            )
+        if manifest is None or manifest.get('binning_factor') != binning_factor:
+            manifest = {
+                'mode': None,
+                'fingerprint': None,
+                'dtype': dtype.name,
+                'binning_factor': binning_factor,
+            }
+            write_fingerprint_manifest(manifest, output.fingerprint_file)
+    else:
+        manifest = {
+            'mode': fingerprint,
+            'fingerprint': fingerprint_tilt_series(tilt_series, mode=fingerprint),
+            'dtype': dtype.name,
+            'binning_factor': binning_factor,
+        }
+        if not (data_matches and read_fingerprint_manifest(output.fingerprint_file) == manifest):
+            output.fingerprint_file.unlink(missing_ok=True)
+            # a linked source file is already the staged tilt-series
+            if is_linked is False:
+                _write_tilt_series(
+                    tilt_series_file, tilt_series, dtype, binning_factor, source_file
+                )
+            write_fingerprint_manifest(manifest, output.fingerprint_file)
+
+
+def _write_tilt_series(
+        tilt_series_file: Path,
+        tilt_series: np.ndarray,
+        dtype: np.dtype = np.dtype(np.float32),
+        binning_factor: int = 1,
+        source_file: Optional[Path] = None,
+) -> None:
+    """Write a tilt-series into an Etomo directory.
+
+    `tilt_series` can be any array-like with a `shape` which supports indexing
+    along its first dimension, e.g. a memory map, dask or zarr array. Data are
+    streamed into a memory-mapped file one image at a time, peak memory use is
+    around one image. When binning, a few images are binned in parallel at a time.
+
+    If `source_file` is provided it is linked to `tilt_series_file` instead.
+    """
+    # never write through a link to the source data
+    tilt_series_file.unlink(missing_ok=True)
+    if source_file is not None:
+        link_file(source_file, tilt_series_file)
+        return
+    n_images, ny, nx = tilt_series.shape
+    staged_shape = (n_images, ny // binning_factor, nx // binning_factor)
+    images_per_chunk = 1 if binning_factor == 1 else PREBINNING_IMAGES_PER_CHUNK
+    total, total_squared, n_pixels = 0.0, 0.0, 0
+    data_min, data_max = np.inf, -np.inf
+    try:
+        with mrcfile.new_mmap(
             tilt_series_file,
-            tilt_series.astype(np.float32),
+            shape=staged_shape,
+            mrc_mode=STAGING_MRC_MODES[dtype],
             overwrite=True
+        ) as mrc:
+            for start in range(0, n_images, images_per_chunk):
+                stop = min(start + images_per_chunk, n_images)
+                images = np.asarray(tilt_series[start:stop])
+                if binning_factor > 1:
+                    images = fourier_bin_images(images, binning_factor=binning_factor)
+                if dtype == np.float16:
+                    _check_float16_range(images)
+                mrc.data[start:stop] = images
+                total += images.sum(dtype=np.float64)
+                total_squared += np.square(images, dtype=np.float64).sum()
+                n_pixels += images.size
+                data_min = min(data_min, images.min())
+                data_max = max(data_max, images.max())
+            if n_pixels > 0:
+                mean = total / n_pixels
+                variance = max(total_squared / n_pixels - mean ** 2, 0)
+                mrc.header.dmin = data_min
+                mrc.header.dmax = data_max
+                mrc.header.dmean = mean
+                mrc.header.rms = np.sqrt(variance)
+    except BaseException:
+        tilt_series_file.unlink(missing_ok=True)
+        raise
+
+
+def _check_float16_range(images: np.ndarray) -> None:
+    """Check that images can be stored as float16 without overflowing."""
+    float16_max = float(np.finfo(np.float16).max)
+    if max(-float(images.min()), float(images.max())) > float16_max:
+        raise ValueError(
+            f'tilt-series values exceed the float16 range (+/- {float16_max}), '
+            "use staging_dtype='float32' or 'native'."
         )
-    np.savetxt(output.rawtlt_file, tilt_angles, fmt='%.2f', delimiter='')
-    return output
+
+
+def clone_etomo_directory(
+        etomo_output: EtomoOutput, directory: Path, exclude: Sequence[str] = ('log.txt',)
+) -> EtomoOutput:
+    """Make a copy of an Etomo directory which shares image data with the original.
+
+    MRC files are linked, all other files are copied so that command files
+    can be modified independently.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    for file in etomo_output.directory.iterdir():
+        if file.name in exclude or not file.is_file():
+            continue
+        destination = directory / file.name
+        destination.unlink(missing_ok=True)
+        if file.suffix == '.mrc':
+            link_file(file, destination)
+        else:
+            shutil.copy2(file, destination)
+    return EtomoOutput(basename=etomo_output.basename, directory=directory)
+
+
+@contextlib.contextmanager
+def scratch_etomo_directory(
+        output_directory: Path,
+        scratch_directory: Path,
+        basename: str,
+        keep_files: Sequence[str] = SCRATCH_KEEP_FILES,
+) -> Iterator[Path]:
+    """Work in a fresh directory in scratch space, copying back only some files.
+
+    Files matching `keep_files`, glob patterns formatted with `basename`, are
+    copied into `output_directory` when leaving the context, whether or not an
+    error occurred. The scratch directory is then removed.
+    """
+    output_directory = Path(output_directory)
+    scratch_directory = Path(scratch_directory)
+    scratch_directory.mkdir(parents=True, exist_ok=True)
+    working_directory = Path(tempfile.mkdtemp(prefix=f'{basename}_', dir=scratch_directory))
+    try:
+        yield working_directory
+    finally:
+        try:
+            output_directory.mkdir(parents=True, exist_ok=True)
+            for pattern in keep_files:
+                for file in working_directory.glob(pattern.format(basename=basename)):
+                    if file.is_file():
+                        shutil.copy2(file, output_directory / file.name)
+        finally:
+            shutil.rmtree(working_directory, ignore_errors=True)
+
+
+class BatchruntomoError(RuntimeError):
+    """batchruntomo exited with an error, was aborted or timed out."""
+
+    def __init__(
+            self,
+            basename: str,
+            returncode: Optional[int],
+            step: Optional[int] = None,
+            timed_out: bool = False,
+            fatal_error: Optional[str] = None,
+    ):
+        self.basename: str = basename
+        self.returncode: Optional[int] = returncode
+        self.step: Optional[int] = step
+        self.timed_out: bool = timed_out
+        self.fatal_error: Optional[str] = fatal_error
+        if timed_out is True:
+            message = f'batchruntomo timed out on {basename}'
+        elif fatal_error is not None:
+            message = f'batchruntomo aborted on {basename}'
+        else:
+            message = f'batchruntomo failed on {basename} with exit code {returncode}'
+        if step is not None:
+            message += f' at step {step}'
+        if fatal_error is not None:
+            message += f': {fatal_error}'
+        super().__init__(message)
 
 
 def run_batchruntomo(
-        directory: Path, basename: str, directive: Dict[str, str]
+        directory: Path,
+        basename: str,
+        directive: Dict[str, str],
+        starting_step: int = 0,
+        ending_step: int = BATCHRUNTOMO_ENDING_STEP,
+        timeout: Optional[float] = None,
+        monitor: Optional[BatchruntomoMonitor] = None,
+        profile: bool = False,
+        environment: Optional[Dict[str, str]] = None,
+        cpu_affinity: Optional[Sequence[int]] = None,
+        backend: Optional[ExecutionBackend] = None,
+) -> None:
+    """Run batchruntomo on a single tilt-series with a specified directive.
+
+    When resuming from a `starting_step` after 0 output is appended to the log.
+    batchruntomo is started in a new session, on timeout or when its output
+    contains a fatal error it is killed along with any IMOD programs it started.
+    Output is written to the log line by line as it is parsed by `monitor`.
+    If `profile` is True resource usage of each command file is written to
+    profile.json next to the log, this requires psutil.
+
+    `environment` is added to the environment of batchruntomo, `cpu_affinity`
+    restricts it and the programs it starts to a set of CPUs where supported.
+    `backend` decides where batchruntomo runs, by default it is started from
+    this process. The directive is written to the Etomo directory so it can be
+    read from other nodes.
+
+    Raises
+    ------
+    BatchruntomoError: batchruntomo exited with a non-zero code, was aborted
+        or timed out.
+    """
+    with events.timed_events(
+            events.BATCHRUNTOMO_STARTED,
+            events.BATCHRUNTOMO_FINISHED,
+            events.BATCHRUNTOMO_FAILED,
+            basename=basename,
+            directory=directory,
+            starting_step=starting_step,
+            ending_step=ending_step,
+    ):
+        monitor = _get_monitor(monitor, profile)
+        directive_file = directory / BATCHRUNTOMO_DIRECTIVE_FILENAME
+        write_adoc(directive, directive_file)
+        job = BatchruntomoJob(
+            # absolute paths, backends may start batchruntomo from elsewhere
+            command=_get_batchruntomo_command(
+                directory=directory.resolve(),
+                basename=basename,
+                directive_file=directive_file.resolve(),
+                starting_step=starting_step,
+                ending_step=ending_step,
+            ),
+            directory=directory,
+            basename=basename,
+            append_log=starting_step > 0,
+            timeout=timeout,
+            environment=environment,
+            cpu_affinity=cpu_affinity,
+        )
+        backend = LocalBackend() if backend is None else backend
+        try:
+            returncode = backend.run(job, monitor)
+        except TimeoutError as error:
+            raise BatchruntomoError(
+                basename=basename,
+                returncode=None,
+                step=_find_failed_step(directory, basename, starting_step, monitor),
+                timed_out=True,
+            ) from error
+        _check_batchruntomo_run(returncode, directory, basename, starting_step, monitor)
+
+
+async def run_batchruntomo_async(
+        directory: Path,
+        basename: str,
+        directive: Dict[str, str],
+        starting_step: int = 0,
+        ending_step: int = BATCHRUNTOMO_ENDING_STEP,
+        timeout: Optional[float] = None,
+        monitor: Optional[BatchruntomoMonitor] = None,
+        profile: bool = False,
+        environment: Optional[Dict[str, str]] = None,
+        cpu_affinity: Optional[Sequence[int]] = None,
 ) -> None:
-    """Run batchruntomo on a single tilt-series with a specified directive."""
-    with tempfile.TemporaryDirectory() as temporary_directory:
-        directive_file = Path(temporary_directory) / 'directive.adoc'
+    """Run batchruntomo on a single tilt-series without blocking the event loop.
+
+    batchruntomo is started in a new session, cancelling the awaiting task,
+    a timeout or a fatal error in its output kills it along with any IMOD
+    programs it started. Profiling, `environment` and `cpu_affinity` are as for
+    `run_batchruntomo`. Execution backends are not supported, batchruntomo
+    always runs as a subprocess of this process.
+
+    Raises
+    ------
+    BatchruntomoError: batchruntomo exited with a non-zero code, was aborted
+        or timed out.
+    """
+    with events.timed_events(
+            events.BATCHRUNTOMO_STARTED,
+            events.BATCHRUNTOMO_FINISHED,
+            events.BATCHRUNTOMO_FAILED,
+            basename=basename,
+            directory=directory,
+            starting_step=starting_step,
+            ending_step=ending_step,
+    ):
+        monitor = _get_monitor(monitor, profile)
+        directive_file = directory / BATCHRUNTOMO_DIRECTIVE_FILENAME
         write_adoc(directive, directive_file)
         batchruntomo_command = _get_batchruntomo_command(
             directory=directory,
             basename=basename,
-            directive_file=directive_file
+            directive_file=directive_file,
+            starting_step=starting_step,
+            ending_step=ending_step,
+        )
+        log_mode = 'w' if starting_step == 0 else 'a'
+        with open(directory / 'log.txt', mode=log_mode) as log:
+            process = await asyncio.create_subprocess_exec(
+                *batchruntomo_command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True,
+                env=get_environment(environment),
+            )
+            set_cpu_affinity(process.pid, cpu_affinity)
+            monitor.start(process.pid)
+            try:
+                returncode = await asyncio.wait_for(
+                    _stream_output_async(process, log, monitor, basename),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError as error:
+                kill_process_group(process.pid)
+                await process.wait()
+                raise BatchruntomoError(
+                    basename=basename,
+                    returncode=process.returncode,
+                    step=_find_failed_step(directory, basename, starting_step, monitor),
+                    timed_out=True,
+                ) from error
+            except asyncio.CancelledError:
+                kill_process_group(process.pid)
+                await process.wait()
+                raise
+            finally:
+                monitor.finish(directory)
+        _check_batchruntomo_run(returncode, directory, basename, starting_step, monitor)
+
+
+def _get_monitor(
+        monitor: Optional[BatchruntomoMonitor], profile: bool
+) -> BatchruntomoMonitor:
+    if monitor is None:
+        monitor = BatchruntomoProfiler() if profile is True else BatchruntomoMonitor()
+    elif profile is True and not isinstance(monitor, BatchruntomoProfiler):
+        raise ValueError('profiling requires the monitor to be a BatchruntomoProfiler.')
+    monitor.reset()
+    return monitor
+
+
+async def _stream_output_async(
+        process: asyncio.subprocess.Process,
+        log: IO[str],
+        monitor: BatchruntomoMonitor,
+        basename: str,
+) -> int:
+    """Asynchronous version of `_stream_output`, returns the exit code."""
+    is_aborted = False
+    async for line in process.stdout:
+        line = line.decode(errors='replace')
+        log.write(line)
+        log.flush()
+        if feed_monitor(monitor, line, basename) and not is_aborted:
+            kill_process_group(process.pid)
+            is_aborted = True
+    return await process.wait()
+
+
+def _check_batchruntomo_run(
+        returncode: int,
+        directory: Path,
+        basename: str,
+        starting_step: int,
+        monitor: BatchruntomoMonitor,
+) -> None:
+    if monitor.fatal_error is not None or returncode != 0:
+        raise BatchruntomoError(
+            basename=basename,
+            returncode=returncode,
+            step=_find_failed_step(directory, basename, starting_step, monitor),
+            fatal_error=monitor.fatal_error,
         )
-        with open(directory / 'log.txt', mode='w') as log:
-            subprocess.run(batchruntomo_command, stdout=log, stderr=log)
+
+
+def _find_failed_step(
+        directory: Path, basename: str, starting_step: int, monitor: BatchruntomoMonitor
+) -> Optional[int]:
+    """Find the step a failed batchruntomo run stopped at.
+
+    The last step seen in the output is used, if none was seen the step is
+    found from the outputs in the directory.
+    """
+    if monitor.current_step is not None:
+        return monitor.current_step
+    etomo_output = EtomoOutput(basename=basename, directory=directory)
+    if not etomo_output.tilt_series_file.exists():
+        return None
+    step = max(starting_step, find_batchruntomo_starting_step(etomo_output))
+    return step if step <= BATCHRUNTOMO_ENDING_STEP else None
 
 
 def _get_batchruntomo_command(
-        directory: Path, basename: str, directive_file: Path
+        directory: Path,
+        basename: str,
+        directive_file: Path,
+        starting_step: int = 0,
+        ending_step: int = BATCHRUNTOMO_ENDING_STEP,
 ) -> List[str]:
     """Get batchruntomo command."""
     command = [
@@ -100,11 +649,65 @@ def _get_batchruntomo_command(
         '-DirectiveFile', f'{directive_file}',
         '-CurrentLocation', f'{directory}',
         '-RootName', basename,
-        '-EndingStep', '6'
     ]
+    if starting_step > 0:
+        command += ['-StartingStep', f'{starting_step}']
+    command += ['-EndingStep', f'{ending_step}']
     return command
 
 
+def find_batchruntomo_starting_step(etomo_output: EtomoOutput) -> int:
+    """Find the first batchruntomo step without valid outputs in an Etomo directory.
+
+    Outputs are valid if they are non-empty, complete for MRC files and were
+    written after the tilt-series was staged. Step 1 (preprocessing) leaves no
+    reliable trace and is rerun whenever cross-correlation is incomplete.
+
+    Returns
+    -------
+    starting_step: step to resume from, greater than `BATCHRUNTOMO_ENDING_STEP`
+        if all steps have valid outputs.
+    """
+    if not etomo_output.tilt_series_file.exists():
+        return 0
+    stat = etomo_output.tilt_series_file.stat()
+    staged_time = max(stat.st_mtime, stat.st_ctime)
+    completed_step = -1
+    for step, alternatives in BATCHRUNTOMO_STEP_OUTPUTS.items():
+        files = [
+            [etomo_output.directory / name.format(basename=etomo_output.basename)
+             for name in alternative]
+            for alternative in alternatives
+        ]
+        if not any(
+            all(_is_valid_step_output(file, staged_time) for file in alternative)
+            for alternative in files
+        ):
+            break
+        completed_step = step
+    return completed_step + 1
+
+
+def _is_valid_step_output(file: Path, staged_time: float) -> bool:
+    """Check that a file was written completely after the tilt-series was staged."""
+    if not file.exists():
+        return False
+    stat = file.stat()
+    if stat.st_size == 0 or stat.st_mtime < staged_time:
+        return False
+    if file.suffix == '.mrc':
+        try:
+            with mrcfile.open(file, header_only=True) as mrc:
+                header = mrc.header
+                header_nbytes = header.nbytes + int(header.nsymbt)
+                itemsize = mrcfile.utils.dtype_from_mode(header.mode).itemsize
+                data_nbytes = int(header.nx) * int(header.ny) * int(header.nz) * itemsize
+        except (ValueError, OSError):
+            return False
+        return stat.st_size >= header_nbytes + data_nbytes
+    return True
+
+
 def get_tilt_angle_offset(align_log_file: Path) -> Union[float, None]:
     """Get the total tilt angle offset from an align.log file."""
     with open(align_log_file, mode='r') as file:
@@ -124,3 +727,56 @@ def get_input_tilt_axis_rotation_angle(align_log_file: Path) -> Union[float, Non
         for line in file:
             if 'RotationAngle =' in line:
                 return float(line.strip().split('=')[-1])
+
+
+def get_residual_error(align_log_file: Path) -> Union[Tuple[float, float], None]:
+    """Get the mean and standard deviation of the residual error from an align.log file.
+
+    Residual errors are in nanometers.
+    """
+    with open(align_log_file, mode='r') as file:
+        for line in file:
+            if 'Residual error mean and sd:' in line:
+                mean, sd = line.split(':')[-1].split()[:2]
+                return float(mean), float(sd)
+    return None
+
+
+def set_comfile_parameters(
+        comfile: Path, program: str, parameters: Dict[str, str]
+) -> None:
+    """Set parameters for a program in an IMOD command file.
+
+    Parameters which are not already in the command file are added after the
+    line which runs the program.
+    """
+    lines = comfile.read_text().splitlines()
+    program_line = next(
+        idx for idx, line in enumerate(lines) if line.split()[:1] == [f'${program}']
+    )
+    remaining = dict(parameters)
+    idx = program_line + 1
+    while idx < len(lines) and not lines[idx].startswith('$'):
+        key = lines[idx].split()[0] if lines[idx].split() else None
+        if key in remaining:
+            lines[idx] = f'{key}\t{remaining.pop(key)}'
+        idx += 1
+    new_lines = [f'{key}\t{value}' for key, value in remaining.items()]
+    lines[program_line + 1:program_line + 1] = new_lines
+    comfile.write_text('\n'.join(lines) + '\n')
+
+
+def apply_comparam_directives(directory: Path, directive: Dict[str, str]) -> None:
+    """Apply 'comparam' directives to command files in an Etomo directory.
+
+    batchruntomo applies these when it sets up a directory, this allows them
+    to be changed afterwards. Directives for missing command files are ignored.
+    """
+    for key, value in directive.items():
+        section, *fields = key.split('.')
+        if section != 'comparam' or len(fields) != 3:
+            continue
+        comfile, program, parameter = fields
+        comfile = directory / f'{comfile}.com'
+        if comfile.exists():
+            set_comfile_parameters(comfile, program=program, parameters={parameter: value})
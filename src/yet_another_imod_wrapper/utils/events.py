@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from warnings import warn
+
+ALIGNMENT_QUEUED = 'alignment_queued'
+ALIGNMENT_STARTED = 'alignment_started'
+ALIGNMENT_FINISHED = 'alignment_finished'
+ALIGNMENT_FAILED = 'alignment_failed'
+STAGING_STARTED = 'staging_started'
+STAGING_FINISHED = 'staging_finished'
+STAGING_FAILED = 'staging_failed'
+DIRECTIVE_GENERATED = 'directive_generated'
+BATCHRUNTOMO_STARTED = 'batchruntomo_started'
+BATCHRUNTOMO_STEP = 'batchruntomo_step'
+BATCHRUNTOMO_FINISHED = 'batchruntomo_finished'
+BATCHRUNTOMO_FAILED = 'batchruntomo_failed'
+CACHE_HIT = 'cache_hit'
+
+
+class Event:
+    """Something which happened while aligning a tilt-series."""
+
+    def __init__(self, name: str, basename: Optional[str], data: Dict[str, Any]):
+        self.name: str = name
+        self.basename: Optional[str] = basename
+        self.time: float = time.time()
+        self.data: Dict[str, Any] = data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'event': self.name, 'basename': self.basename, 'time': self.time, **self.data}
+
+    def __repr__(self) -> str:
+        return f'Event(name={self.name!r}, basename={self.basename!r})'
+
+
+Hook = Callable[[Event], None]
+_hooks: List[Hook] = []
+
+
+def add_hook(hook: Hook) -> Hook:
+    """Register a callable receiving every event, returns the hook."""
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook: Hook) -> None:
+    _hooks.remove(hook)
+
+
+def emit(name: str, basename: Optional[str] = None, **data: Any) -> None:
+    """Send an event to all registered hooks.
+
+    Does nothing if no hooks are registered. Errors in hooks are turned into
+    warnings so that they cannot stop an alignment.
+    """
+    if not _hooks:
+        return
+    event = Event(name=name, basename=basename, data=data)
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as error:
+            warn(f'event hook {hook!r} failed on {name}: {error}')
+
+
+@contextmanager
+def timed_events(
+        started: str, finished: str, failed: str, basename: Optional[str], **data: Any
+) -> Iterator[Dict[str, Any]]:
+    """Emit events before and after a block of code, with its duration.
+
+    Yields a dictionary, entries added to it are sent with the finished event.
+    """
+    if not _hooks:
+        yield {}
+        return
+    emit(started, basename, **data)
+    start = time.perf_counter()
+    finished_data: Dict[str, Any] = {}
+    try:
+        yield finished_data
+    except BaseException as error:
+        emit(
+            failed, basename, **data, duration=time.perf_counter() - start,
+            error=f'{type(error).__name__}: {error}',
+        )
+        raise
+    emit(finished, basename, **data, **finished_data, duration=time.perf_counter() - start)
+
+
+class JSONLinesSink:
+    """Hook appending each event to a file as a line of JSON."""
+
+    def __init__(self, file: os.PathLike):
+        self.file = Path(file)
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event) -> None:
+        line = json.dumps(event.to_dict(), default=str)
+        with self._lock, open(self.file, mode='a') as f:
+            f.write(line + '\n')
+
+    def __repr__(self) -> str:
+        return f'JSONLinesSink(file={str(self.file)!r})'
+
+
+class PrometheusTextfileSink:
+    """Hook keeping alignment metrics in a file for the node exporter textfile collector.
+
+    The file is rewritten atomically after each event.
+    """
+
+    PREFIX = 'yet_another_imod_wrapper'
+    COUNTERS = {
+        ALIGNMENT_QUEUED: ('alignments_queued_total', 'Alignments queued.'),
+        ALIGNMENT_STARTED: ('alignments_started_total', 'Alignments started.'),
+        ALIGNMENT_FINISHED: ('alignments_succeeded_total', 'Alignments which succeeded.'),
+        ALIGNMENT_FAILED: ('alignments_failed_total', 'Alignments which failed.'),
+        CACHE_HIT: ('cache_hits_total', 'Alignments copied from a cache.'),
+        BATCHRUNTOMO_FAILED: ('batchruntomo_failures_total', 'Failed batchruntomo runs.'),
+    }
+    DURATIONS = {
+        ALIGNMENT_FINISHED: ('alignment_duration_seconds', 'Duration of successful alignments.'),
+        BATCHRUNTOMO_FINISHED: ('batchruntomo_duration_seconds', 'Duration of batchruntomo runs.'),
+        STAGING_FINISHED: ('staging_duration_seconds', 'Duration of staging.'),
+    }
+
+    def __init__(self, file: os.PathLike):
+        self.file = Path(file)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {name: 0 for name, _ in self.COUNTERS.values()}
+        self._durations: Dict[str, List[float]] = {
+            name: [0, 0] for name, _ in self.DURATIONS.values()
+        }
+        self._bytes_staged = 0
+
+    def __call__(self, event: Event) -> None:
+        with self._lock:
+            if event.name in self.COUNTERS:
+                self._counters[self.COUNTERS[event.name][0]] += 1
+            if event.name in self.DURATIONS and 'duration' in event.data:
+                duration = self._durations[self.DURATIONS[event.name][0]]
+                duration[0] += event.data['duration']
+                duration[1] += 1
+            if event.name == STAGING_FINISHED:
+                self._bytes_staged += event.data.get('bytes', 0)
+            self._write()
+
+    def _write(self) -> None:
+        counters = self._counters
+        lines = []
+        for name, description in self.COUNTERS.values():
+            lines += self._metric(name, 'counter', description, counters[name])
+        in_progress = (
+            counters['alignments_started_total']
+            - counters['alignments_succeeded_total']
+            - counters['alignments_failed_total']
+        )
+        queued = counters['alignments_queued_total'] - counters['alignments_started_total']
+        lines += self._metric(
+            'alignments_in_progress', 'gauge', 'Alignments running.', in_progress
+        )
+        lines += self._metric(
+            'queue_depth', 'gauge', 'Alignments queued but not started.', max(0, queued)
+        )
+        lines += self._metric(
+            'staged_bytes_total', 'counter', 'Bytes of tilt-series staged.', self._bytes_staged
+        )
+        for name, description in self.DURATIONS.values():
+            total, count = self._durations[name]
+            full_name = f'{self.PREFIX}_{name}'
+            lines += [
+                f'# HELP {full_name} {description}',
+                f'# TYPE {full_name} summary',
+                f'{full_name}_sum {total}',
+                f'{full_name}_count {count}',
+            ]
+        temporary_file = self.file.with_name(f'.{self.file.name}.tmp')
+        temporary_file.write_text('\n'.join(lines) + '\n')
+        os.replace(temporary_file, self.file)
+
+    def _metric(self, name: str, kind: str, description: str, value: float) -> List[str]:
+        full_name = f'{self.PREFIX}_{name}'
+        return [
+            f'# HELP {full_name} {description}',
+            f'# TYPE {full_name} {kind}',
+            f'{full_name} {value}',
+        ]
+
+    def __repr__(self) -> str:
+        return f'PrometheusTextfileSink(file={str(self.file)!r})'
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+FINGERPRINT_MODES = ('full', 'sampled')
+N_SAMPLED_ROWS_PER_IMAGE = 16
+
+
+def fingerprint_tilt_series(tilt_series: np.ndarray, mode: str = 'full') -> str:
+    """Compute a hex digest identifying the contents of a tilt-series.
+
+    Images are hashed one at a time so lazy array-likes (e.g. memory maps)
+    are never loaded in full.
+
+    Parameters
+    ----------
+    tilt_series: (n, y, x) array of 2D tilt-images in a tilt-series.
+    mode: 'full' hashes every pixel, 'sampled' hashes a fixed number of evenly
+        spaced rows from every image.
+    """
+    if mode not in FINGERPRINT_MODES:
+        raise ValueError(f'fingerprint mode must be one of {FINGERPRINT_MODES}')
+    n, ny, nx = tilt_series.shape
+    hasher = hashlib.blake2b(digest_size=16)
+    header = (mode, (n, ny, nx), np.dtype(tilt_series.dtype).str)
+    hasher.update(repr(header).encode())
+    if mode == 'full':
+        rows = None
+    else:
+        rows = np.unique(np.linspace(0, ny - 1, num=N_SAMPLED_ROWS_PER_IMAGE, dtype=int))
+    for idx in range(n):
+        if rows is None:
+            hasher.update(np.ascontiguousarray(tilt_series[idx]).data)
+        else:
+            for row in rows:
+                hasher.update(np.ascontiguousarray(tilt_series[idx, row]).data)
+    return hasher.hexdigest()
+
+
+def read_fingerprint_manifest(manifest_file: os.PathLike) -> Optional[Dict[str, Any]]:
+    """Read a staging manifest, returning None if missing or unreadable."""
+    try:
+        with open(manifest_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_fingerprint_manifest(manifest: Dict[str, Any], manifest_file: os.PathLike):
+    """Write a staging manifest."""
+    with open(manifest_file, mode='w') as f:
+        json.dump(manifest, f, indent=2)
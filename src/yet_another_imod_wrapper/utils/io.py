@@ -1,4 +1,5 @@
 import os
+import sys
 from os import PathLike
 from typing import Dict
 
@@ -47,3 +48,39 @@ def write_adoc(data: dict, output_filename: PathLike):
     with open(output_filename, 'w') as adoc:
         for k, v in data.items():
             adoc.write(f"{k} = {v}\n")
+
+
+def link_file(source: PathLike, destination: PathLike) -> str:
+    """Make `destination` refer to the data in `source` without copying it.
+
+    A hard link is tried first, then a copy-on-write reflink (Linux only),
+    falling back to a symbolic link.
+
+    Returns
+    -------
+    method: 'hardlink', 'reflink' or 'symlink'.
+    """
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except OSError:
+        pass
+    if sys.platform.startswith('linux') and _reflink(source, destination):
+        return 'reflink'
+    os.symlink(os.path.abspath(source), destination)
+    return 'symlink'
+
+
+def _reflink(source: PathLike, destination: PathLike) -> bool:
+    """Try to make a copy-on-write clone of a file, returns True on success."""
+    import fcntl
+
+    ficlone = 0x40049409
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), ficlone, src.fileno())
+        return True
+    except OSError:
+        if os.path.exists(destination):
+            os.unlink(destination)
+        return False
@@ -0,0 +1,153 @@
+import json
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+LOCK_FILENAME = '.yet_another_imod_wrapper.lock'
+
+
+class DirectoryLockedError(RuntimeError):
+    """An Etomo directory is locked by another live worker."""
+
+
+class LockLostError(RuntimeError):
+    """A held lock was broken or replaced by another worker."""
+
+
+class DirectoryLock:
+    """Exclusive lock on an Etomo directory for a shared filesystem.
+
+    The lock is a file created with O_EXCL in the directory. Its owner refreshes
+    the modification time with `heartbeat`, a lock which has not been refreshed
+    for `lease_timeout` seconds belongs to a dead worker and is broken. Stale
+    locks are renamed out of the way before being removed so that only one of
+    several workers breaking the same lock succeeds.
+
+    Parameters
+    ----------
+    directory: directory to lock, created if it does not exist.
+    owner: identifies the holder of the lock, defaults to host and process id.
+    lease_timeout: seconds without a heartbeat after which the lock is stale.
+    """
+
+    def __init__(
+            self,
+            directory: os.PathLike,
+            owner: Optional[str] = None,
+            lease_timeout: float = 120,
+    ):
+        self.directory: Path = Path(directory)
+        self.owner: str = get_worker_id() if owner is None else owner
+        self.lease_timeout: float = lease_timeout
+        self.is_locked: bool = False
+        self.is_lost: bool = False
+
+    @property
+    def lock_file(self) -> Path:
+        return self.directory / LOCK_FILENAME
+
+    def acquire(self) -> None:
+        """Take the lock, breaking it if it is stale.
+
+        Raises
+        ------
+        DirectoryLockedError: the lock is held by a live worker.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for _ in range(2):
+            try:
+                descriptor = os.open(
+                    self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY
+                )
+            except FileExistsError:
+                if not self.is_stale():
+                    raise DirectoryLockedError(
+                        f'{self.directory} is locked by {self.read_owner()}'
+                    ) from None
+                self._break_stale_lock()
+                continue
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump({'owner': self.owner, 'acquired_at': time.time()}, file)
+            self.is_locked = True
+            self.is_lost = False
+            return
+        raise DirectoryLockedError(f'{self.directory} is locked by {self.read_owner()}')
+
+    def heartbeat(self) -> None:
+        """Mark the lock as held by a live worker.
+
+        Raises
+        ------
+        LockLostError: the lock file was removed or now belongs to another worker.
+        """
+        if self.is_locked is not True:
+            return
+        if self.read_owner() != self.owner:
+            self.mark_lost()
+            raise LockLostError(f'lock on {self.directory} was taken over')
+        os.utime(self.lock_file)
+
+    def mark_lost(self) -> None:
+        """Stop treating the lock as held, release will leave the lock file alone."""
+        self.is_locked = False
+        self.is_lost = True
+
+    def release(self) -> None:
+        if self.is_locked is True:
+            if self.read_owner() == self.owner:
+                self.lock_file.unlink(missing_ok=True)
+            self.is_locked = False
+
+    def is_stale(self) -> bool:
+        try:
+            modified_time = self.lock_file.stat().st_mtime
+        except FileNotFoundError:
+            return True
+        return time.time() - modified_time > self.lease_timeout
+
+    def read_owner(self) -> Optional[str]:
+        try:
+            return json.loads(self.lock_file.read_text())['owner']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _break_stale_lock(self) -> None:
+        """Atomically move a stale lock aside, then remove it.
+
+        Raises
+        ------
+        DirectoryLockedError: the lock was replaced by a live worker meanwhile.
+        """
+        broken_file = self.lock_file.with_name(
+            f'{LOCK_FILENAME}.{uuid.uuid4().hex}.stale'
+        )
+        try:
+            os.rename(self.lock_file, broken_file)
+        except FileNotFoundError:
+            return  # broken by another worker first
+        try:
+            modified_time = broken_file.stat().st_mtime
+            if time.time() - modified_time <= self.lease_timeout:
+                # a live worker took the lock between the check and the rename
+                try:
+                    os.link(broken_file, self.lock_file)
+                except FileExistsError:
+                    pass
+                raise DirectoryLockedError(f'{self.directory} is locked by another worker')
+        finally:
+            broken_file.unlink(missing_ok=True)
+
+    def __enter__(self) -> 'DirectoryLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+
+def get_worker_id() -> str:
+    """Identify this process across nodes as host:pid."""
+    return f'{socket.gethostname()}:{os.getpid()}'
@@ -0,0 +1,70 @@
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Pattern, Sequence
+
+# command files run by batchruntomo and the step they belong to
+BATCHRUNTOMO_COMFILE_STEPS: Dict[str, int] = {
+    'copytomocoms': 0,
+    'eraser': 1,
+    'xcorr': 2,
+    'prenewst': 3,
+    'xcorr_pt': 4,
+    'autofidseed': 4,
+    'track': 5,
+    'align': 6,
+}
+STEP_PATTERN = re.compile(r'\brunning\s+(\w+?)(?:\.com)?\b', re.IGNORECASE)
+# IMOD programs exit with 'ERROR: PROGRAM - message', batchruntomo reports
+# giving up on a data set with 'ABORT SET', warnings mentioning errors are not fatal
+FATAL_PATTERNS: List[Pattern] = [
+    re.compile(r'^\s*ERROR:\s*\w+\s+-'),
+    re.compile(r'^\s*ABORT SET'),
+]
+
+
+class BatchruntomoMonitor:
+    """Follows batchruntomo output line by line.
+
+    The current step is updated when batchruntomo starts a command file,
+    lines matching any of `fatal_patterns` mark the run as failed. A monitor
+    can be passed to `run_batchruntomo` and polled from another thread.
+    """
+
+    def __init__(self, fatal_patterns: Sequence[Pattern] = FATAL_PATTERNS):
+        self.fatal_patterns: List[Pattern] = list(fatal_patterns)
+        self.current_step: Optional[int] = None
+        self.current_comfile: Optional[str] = None
+        self.fatal_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def start(self, pid: int) -> None:
+        """Called once batchruntomo has started with its process id."""
+
+    def finish(self, directory: Path) -> None:
+        """Called once batchruntomo has exited with its working directory."""
+
+    def reset(self) -> None:
+        with self._lock:
+            self.current_step = None
+            self.current_comfile = None
+            self.fatal_error = None
+
+    def feed(self, line: str) -> bool:
+        """Parse a line of output, returns True if it contains a fatal error."""
+        match = STEP_PATTERN.search(line)
+        with self._lock:
+            if match is not None and match.group(1) in BATCHRUNTOMO_COMFILE_STEPS:
+                self.current_comfile = match.group(1)
+                self.current_step = BATCHRUNTOMO_COMFILE_STEPS[self.current_comfile]
+            if self.fatal_error is None and any(
+                    pattern.search(line) for pattern in self.fatal_patterns
+            ):
+                self.fatal_error = line.strip()
+            return self.fatal_error is not None
+
+    def __repr__(self) -> str:
+        return (
+            f'BatchruntomoMonitor(current_step={self.current_step!r}, '
+            f'fatal_error={self.fatal_error!r})'
+        )
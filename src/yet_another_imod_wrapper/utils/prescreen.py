@@ -0,0 +1,106 @@
+import os
+from typing import Tuple, Union
+
+import mrcfile
+import numpy as np
+import pandas as pd
+
+PRESCREEN_TARGET_SIDELENGTH = 256
+PRESCREEN_IMAGES_PER_CHUNK = 16
+
+
+def calculate_tilt_image_statistics(tilt_series: np.ndarray) -> pd.DataFrame:
+    """Calculate per-image statistics for a tilt-series.
+
+    Images are subsampled to around 256 pixels along their longest edge and
+    processed a chunk at a time, statistics for all images in a chunk are
+    calculated together.
+
+    Parameters
+    ----------
+    tilt_series: (n, y, x) array-like of 2D tilt-images in a tilt-series.
+
+    Returns
+    -------
+    statistics: dataframe with `mean`, `variance` and `spectral_power` columns,
+        one row per image. `spectral_power` is the mean power of the
+        mean-subtracted image between 1/32 and 1/4 of the sampling frequency.
+    """
+    n, ny, nx = tilt_series.shape
+    step = max(1, max(ny, nx) // PRESCREEN_TARGET_SIDELENGTH)
+    subsampled_shape = (len(range(0, ny, step)), len(range(0, nx, step)))
+    band = _frequency_band_mask(subsampled_shape, low=1 / 32, high=1 / 4)
+    means, variances, spectral_powers = [], [], []
+    for start in range(0, n, PRESCREEN_IMAGES_PER_CHUNK):
+        stop = min(start + PRESCREEN_IMAGES_PER_CHUNK, n)
+        images = np.asarray(tilt_series[start:stop, ::step, ::step], dtype=np.float32)
+        chunk_means = images.mean(axis=(-2, -1))
+        chunk_variances = images.var(axis=(-2, -1))
+        power = np.abs(np.fft.rfft2(images - chunk_means[:, None, None])) ** 2
+        power /= images.shape[-2] * images.shape[-1]
+        means.append(chunk_means)
+        variances.append(chunk_variances)
+        spectral_powers.append(power[:, band].mean(axis=-1))
+    return pd.DataFrame({
+        'mean': np.concatenate(means),
+        'variance': np.concatenate(variances),
+        'spectral_power': np.concatenate(spectral_powers),
+    })
+
+
+def find_bad_tilt_images(
+        tilt_series: Union[np.ndarray, os.PathLike],
+        dark_fraction: float = 0.25,
+        z_threshold: float = 5,
+) -> np.ndarray:
+    """Find blank, dark or occluded images in a tilt-series.
+
+    An image is flagged if
+    - its mean is below `dark_fraction` times the median image mean, or
+    - its log variance or log spectral power is more than `z_threshold`
+      robust standard deviations below the median over the tilt-series.
+
+    Parameters
+    ----------
+    tilt_series: (n, y, x) array-like of 2D tilt-images or an MRC file.
+    dark_fraction: fraction of the median image mean below which images are dark.
+    z_threshold: threshold on robust z-scores for variance and spectral power.
+
+    Returns
+    -------
+    indices: sorted 0-indexed indices of flagged images.
+    """
+    if isinstance(tilt_series, (str, os.PathLike)):
+        with mrcfile.mmap(tilt_series, mode='r') as mrc:
+            statistics = calculate_tilt_image_statistics(mrc.data)
+    else:
+        statistics = calculate_tilt_image_statistics(tilt_series)
+    is_bad = np.zeros(len(statistics), dtype=bool)
+    median_mean = np.median(statistics['mean'])
+    if median_mean > 0:
+        is_bad |= statistics['mean'].to_numpy() < dark_fraction * median_mean
+    for column in ('variance', 'spectral_power'):
+        values = statistics[column].to_numpy()
+        is_bad |= values <= 0
+        log_values = np.log(np.clip(values, np.finfo(np.float32).tiny, None))
+        is_bad |= _robust_z_scores(log_values) < -z_threshold
+    return np.flatnonzero(is_bad)
+
+
+def _robust_z_scores(values: np.ndarray) -> np.ndarray:
+    """z-scores based on the median and median absolute deviation."""
+    median = np.median(values)
+    mad = np.median(np.abs(values - median)) * 1.4826
+    if mad == 0:
+        return np.zeros_like(values)
+    return (values - median) / mad
+
+
+def _frequency_band_mask(
+        image_shape: Tuple[int, int], low: float, high: float
+) -> np.ndarray:
+    """Mask for an rfft2 selecting spatial frequencies between low and high (cycles/pixel)."""
+    fy = np.fft.fftfreq(image_shape[0])[:, np.newaxis]
+    fx = np.fft.rfftfreq(image_shape[1])[np.newaxis, :]
+    frequency = np.sqrt(fy ** 2 + fx ** 2)
+    return (frequency >= low) & (frequency <= high)
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Pattern, Sequence
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from .monitor import FATAL_PATTERNS, BatchruntomoMonitor
+
+PROFILE_FILENAME = 'profile.json'
+DEFAULT_SAMPLING_INTERVAL = 0.5
+
+
+class BatchruntomoProfiler(BatchruntomoMonitor):
+    """Monitor which also measures resource usage of each command file.
+
+    The process tree of batchruntomo is sampled every `interval` seconds,
+    usage between samples is attributed to the command file running at the
+    time. CPU time includes finished child processes, bytes written only
+    include processes alive when sampled. Requires psutil.
+    """
+
+    def __init__(
+            self,
+            interval: float = DEFAULT_SAMPLING_INTERVAL,
+            fatal_patterns: Sequence[Pattern] = FATAL_PATTERNS,
+    ):
+        if psutil is None:
+            raise ImportError(
+                'profiling requires psutil, '
+                'install it with `pip install yet-another-imod-wrapper[profile]`'
+            )
+        super().__init__(fatal_patterns=fatal_patterns)
+        self.interval: float = interval
+        self._profile_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._reset_profile()
+
+    def reset(self) -> None:
+        super().reset()
+        self._reset_profile()
+
+    def _reset_profile(self) -> None:
+        self.steps: List[Dict[str, Any]] = []
+        self._start_time: Optional[float] = None
+        self._cpu_time = 0.0
+        self._bytes_written: Dict[int, int] = {}
+
+    def feed(self, line: str) -> bool:
+        previous_comfile = self.current_comfile
+        is_fatal = super().feed(line)
+        if self.current_comfile != previous_comfile and self._start_time is not None:
+            with self._profile_lock:
+                self._begin_step(time.perf_counter())
+        return is_fatal
+
+    def start(self, pid: int) -> None:
+        process = psutil.Process(pid)
+        with self._profile_lock:
+            self._start_time = time.perf_counter()
+            self._begin_step(self._start_time)
+        self._stop.clear()
+        self._sampler = threading.Thread(
+            target=self._sample_until_stopped, args=(process,), daemon=True
+        )
+        self._sampler.start()
+
+    def finish(self, directory: Path) -> None:
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        with self._profile_lock:
+            self._end_step(time.perf_counter())
+        with open(directory / PROFILE_FILENAME, mode='w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Profile of the run with totals and one entry per command file."""
+        with self._profile_lock:
+            steps = [dict(step) for step in self.steps]
+        return {
+            'interval': self.interval,
+            'wall_time': sum(step['wall_time'] for step in steps),
+            'cpu_time': sum(step['cpu_time'] for step in steps),
+            'peak_rss': max((step['peak_rss'] for step in steps), default=0),
+            'bytes_written': sum(step['bytes_written'] for step in steps),
+            'steps': steps,
+        }
+
+    def _begin_step(self, now: float) -> None:
+        self._end_step(now)
+        self.steps.append({
+            'step': self.current_step,
+            'comfile': self.current_comfile,
+            'start': now - self._start_time,
+            'wall_time': 0.0,
+            'cpu_time': 0.0,
+            'peak_rss': 0,
+            'bytes_written': 0,
+        })
+
+    def _end_step(self, now: float) -> None:
+        if len(self.steps) > 0:
+            self.steps[-1]['wall_time'] = now - self._start_time - self.steps[-1]['start']
+
+    def _sample_until_stopped(self, process: 'psutil.Process') -> None:
+        while not self._stop.wait(self.interval):
+            self._sample(process)
+
+    def _sample(self, process: 'psutil.Process') -> None:
+        """Attribute usage since the last sample to the current command file."""
+        try:
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return
+        cpu_time, rss, bytes_written = 0.0, 0, 0
+        for child in processes:
+            try:
+                with child.oneshot():
+                    times = child.cpu_times()
+                    memory = child.memory_info()
+                    io = child.io_counters() if hasattr(child, 'io_counters') else None
+            except psutil.Error:
+                continue
+            cpu_time += times.user + times.system + times.children_user + times.children_system
+            rss += memory.rss
+            if io is not None:
+                previous = self._bytes_written.get(child.pid, 0)
+                bytes_written += max(0, io.write_bytes - previous)
+                self._bytes_written[child.pid] = io.write_bytes
+        with self._profile_lock:
+            step = self.steps[-1]
+            step['cpu_time'] += max(0.0, cpu_time - self._cpu_time)
+            step['peak_rss'] = max(step['peak_rss'], rss)
+            step['bytes_written'] += bytes_written
+            self._cpu_time = max(self._cpu_time, cpu_time)
+
+
+def read_profile(file: Path) -> Optional[Dict[str, Any]]:
+    """Read a profile written by `BatchruntomoProfiler`, None if it does not exist."""
+    if not Path(file).exists():
+        return None
+    with open(file, mode='r') as f:
+        return json.load(f)
@@ -0,0 +1,174 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, Tuple
+
+import mrcfile
+import numpy as np
+
+from .etomo import EtomoOutput
+from .io import read_tlt, read_xf
+from .xf import XFBatch
+
+PROJECTION_CHUNK_SIZE = 65536
+
+
+def get_projection_matrices(
+        xf_data: np.ndarray,
+        tilt_angles: Sequence[float],
+        image_shape: Tuple[int, int],
+        volume_shape: Optional[Tuple[int, int, int]] = None,
+) -> np.ndarray:
+    """Affine matrices projecting 3D coordinates into each raw tilt-image.
+
+    A point `(x, y, z)` relative to the center of the volume is rotated about
+    the Y-axis by the tilt angle, projected along Z, then mapped from the
+    aligned into the raw tilt-image by the inverse of its xf transform:
+
+        x_aligned = x * cos(theta) + z * sin(theta)
+        y_aligned = y
+        (x_raw, y_raw) = A^-1 @ ((x_aligned, y_aligned) - (DX, DY)) + center
+
+    Centers follow the IMOD convention `(N-1) / 2`, coordinates are 0-indexed
+    pixels of the tilt-series given to IMOD.
+
+    Parameters
+    ----------
+    xf_data: `(n, 6)` array of xf data.
+    tilt_angles: `(n, )` refined tilt angles in degrees.
+    image_shape: `(ny, nx)` of tilt-images.
+    volume_shape: `(nz, ny, nx)` of the volume coordinates are given in, if
+        None coordinates are relative to the center of the volume.
+
+    Returns
+    -------
+    projection_matrices: `(n, 2, 4)` array, multiplying homogeneous
+        coordinates `(x, y, z, 1)` gives `(x, y)` in each tilt-image.
+    """
+    xf = XFBatch(xf_data, offsets=[0, len(xf_data)])
+    theta = np.deg2rad(np.asarray(tilt_angles, dtype=float).reshape(-1))
+    if len(theta) != len(xf.xf_data):
+        raise ValueError('one tilt angle is needed per line of xf data.')
+    projections = np.zeros((len(theta), 2, 3))
+    projections[:, 0, 0] = np.cos(theta)
+    projections[:, 0, 2] = np.sin(theta)
+    projections[:, 1, 1] = 1
+    linear = xf.inverse_transformation_matrices @ projections
+    image_center = (np.asarray(image_shape[::-1], dtype=float) - 1) / 2
+    translation = image_center - xf.image_shifts
+    if volume_shape is not None:
+        volume_center = (np.asarray(volume_shape[::-1], dtype=float) - 1) / 2
+        translation -= linear @ volume_center
+    return np.concatenate([linear, translation[:, :, np.newaxis]], axis=-1)
+
+
+def project_points(
+        points: np.ndarray,
+        projection_matrices: np.ndarray,
+        chunk_size: int = PROJECTION_CHUNK_SIZE,
+        max_workers: Optional[int] = None,
+        dtype: np.dtype = np.float64,
+) -> np.ndarray:
+    """Project 3D coordinates into every tilt-image.
+
+    Points are processed `chunk_size` at a time to bound temporary memory,
+    chunks are spread over `max_workers` threads if given.
+
+    Parameters
+    ----------
+    points: `(m, 3)` array of `(x, y, z)` coordinates.
+    projection_matrices: `(n, 2, 4)` array from `get_projection_matrices`.
+    chunk_size: number of points projected at a time.
+    max_workers: number of threads projecting chunks, None projects in this thread.
+    dtype: data type of the projected coordinates.
+
+    Returns
+    -------
+    projected: `(n, m, 2)` array of `(x, y)` coordinates in each tilt-image.
+    """
+    points = np.asarray(points).reshape((-1, 3))
+    # (n, 3, 2) so that points @ linear gives (n, m, 2) written tilt by tilt
+    linear = projection_matrices[:, :, :3].transpose((0, 2, 1)).astype(dtype)
+    translation = projection_matrices[:, np.newaxis, :, 3].astype(dtype)
+    projected = np.empty((len(projection_matrices), len(points), 2), dtype=dtype)
+
+    def project_chunk(start: int) -> None:
+        stop = min(start + chunk_size, len(points))
+        chunk = projected[:, start:stop]
+        np.matmul(np.asarray(points[start:stop], dtype=dtype), linear, out=chunk)
+        chunk += translation
+
+    starts = range(0, len(points), chunk_size)
+    if max_workers is None:
+        for start in starts:
+            project_chunk(start)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(project_chunk, starts))
+    return projected
+
+
+class TiltSeriesProjector:
+    """Project 3D coordinates into the tilt-images of an aligned tilt-series.
+
+    Projection matrices are built once, see `get_projection_matrices` for the
+    conventions used.
+    """
+
+    def __init__(
+            self,
+            xf_data: np.ndarray,
+            tilt_angles: Sequence[float],
+            image_shape: Tuple[int, int],
+            volume_shape: Optional[Tuple[int, int, int]] = None,
+    ):
+        self.projection_matrices: np.ndarray = get_projection_matrices(
+            xf_data=xf_data,
+            tilt_angles=tilt_angles,
+            image_shape=image_shape,
+            volume_shape=volume_shape,
+        )
+
+    @classmethod
+    def from_etomo_output(
+            cls,
+            etomo_output: EtomoOutput,
+            image_shape: Optional[Tuple[int, int]] = None,
+            volume_shape: Optional[Tuple[int, int, int]] = None,
+    ):
+        """Projector from the xf and refined tlt files of an alignment.
+
+        The image shape is read from the staged tilt-series if not given.
+        """
+        if image_shape is None:
+            image_shape = _get_image_shape(etomo_output.tilt_series_file)
+        return cls(
+            xf_data=read_xf(etomo_output.xf_file),
+            tilt_angles=read_tlt(etomo_output.tlt_file),
+            image_shape=image_shape,
+            volume_shape=volume_shape,
+        )
+
+    @property
+    def n_tilts(self) -> int:
+        return len(self.projection_matrices)
+
+    def project(
+            self,
+            points: np.ndarray,
+            chunk_size: int = PROJECTION_CHUNK_SIZE,
+            max_workers: Optional[int] = None,
+            dtype: np.dtype = np.float64,
+    ) -> np.ndarray:
+        """Project `(m, 3)` coordinates into an `(n_tilts, m, 2)` array."""
+        return project_points(
+            points,
+            self.projection_matrices,
+            chunk_size=chunk_size,
+            max_workers=max_workers,
+            dtype=dtype,
+        )
+
+
+def _get_image_shape(tilt_series_file: os.PathLike) -> Tuple[int, int]:
+    with mrcfile.open(tilt_series_file, header_only=True) as mrc:
+        return int(mrc.header.ny), int(mrc.header.nx)
@@ -0,0 +1,87 @@
+from typing import Callable, Dict, List, Sequence
+
+DirectiveTransform = Callable[[Dict[str, str]], Dict[str, str]]
+
+BINNING_KEYS = (
+    'comparam.prenewst.newstack.BinByFactor',
+    'runtime.AlignedStack.any.binByFactor',
+)
+PATCH_SIZE_KEY = 'comparam.xcorr_pt.tiltxcorr.SizeOfPatchesXandY'
+
+
+class RetryPolicy:
+    """Fallback directives to try, in order, when an alignment fails.
+
+    Each fallback transforms a copy of the original directive. Alignments are
+    retried from the start after batchruntomo fails, times out or produces
+    no alignment results.
+    """
+
+    def __init__(self, fallbacks: Sequence[DirectiveTransform]):
+        self.fallbacks: List[DirectiveTransform] = list(fallbacks)
+
+    def get_directives(self, directive: Dict[str, str]) -> List[Dict[str, str]]:
+        """Directives for each attempt, starting with `directive` itself."""
+        return [directive] + [fallback(dict(directive)) for fallback in self.fallbacks]
+
+    def __repr__(self) -> str:
+        names = [
+            getattr(fallback, '__name__', repr(fallback)) for fallback in self.fallbacks
+        ]
+        return f'RetryPolicy(fallbacks={names!r})'
+
+
+def double_binning(directive: Dict[str, str]) -> Dict[str, str]:
+    """Align at twice the binning, keeping the physical size of patches."""
+    for key in BINNING_KEYS:
+        if key in directive:
+            directive[key] = str(2 * int(directive[key]))
+    if PATCH_SIZE_KEY in directive:
+        directive[PATCH_SIZE_KEY] = _scale_pair(directive[PATCH_SIZE_KEY], 0.5)
+    return directive
+
+
+def scale_patch_size(factor: float) -> DirectiveTransform:
+    """Make a fallback which tracks patches `factor` times the original size."""
+    def _scale_patch_size(directive: Dict[str, str]) -> Dict[str, str]:
+        if PATCH_SIZE_KEY in directive:
+            directive[PATCH_SIZE_KEY] = _scale_pair(directive[PATCH_SIZE_KEY], factor)
+        return directive
+    _scale_patch_size.__name__ = f'scale_patch_size({factor:g})'
+    return _scale_patch_size
+
+
+def switch_to_patch_tracking(
+        patch_size: float, patch_overlap_percentage: float = 33
+) -> DirectiveTransform:
+    """Make a fallback which aligns by patch tracking instead of fiducials.
+
+    Parameters
+    ----------
+    patch_size: sidelength of patches to be tracked in angstroms.
+    patch_overlap_percentage: overlap between patches in each direction.
+    """
+    def _switch_to_patch_tracking(directive: Dict[str, str]) -> Dict[str, str]:
+        # imported here, patch_tracking imports this module
+        from ..patch_tracking import generate_patch_tracking_alignment_directive
+
+        pixel_size = float(directive['setupset.copyarg.pixel']) * 10
+        stack_extension = directive.get('setupset.copyarg.stackext', 'mrc')
+        patch_size_px = int(patch_size / pixel_size)
+        patch_tracking_directive = generate_patch_tracking_alignment_directive(
+            tilt_series_file=f'tilt_series.{stack_extension.lstrip(".")}',
+            pixel_size=pixel_size,
+            rotation_angle=float(directive.get('setupset.copyarg.rotation', 0)),
+            patch_size_xy=(patch_size_px, patch_size_px),
+            patch_overlap_percentage=patch_overlap_percentage,
+        )
+        patch_tracking_directive.update({
+            key: value for key, value in directive.items()
+            if key.startswith(('setupset.copyarg.', 'runtime.Excludeviews.'))
+        })
+        return patch_tracking_directive
+    return _switch_to_patch_tracking
+
+
+def _scale_pair(value: str, factor: float) -> str:
+    return ','.join(str(max(1, int(float(v) * factor))) for v in value.split(','))
@@ -0,0 +1,141 @@
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import mrcfile
+import numpy as np
+
+from yet_another_imod_wrapper.constants import TARGET_PIXEL_SIZE_FOR_ALIGNMENT
+from .binning import find_optimal_power_of_2_binning_factor
+
+DEFAULT_CORES_PER_JOB = 4
+BASE_MEMORY_PER_JOB = 512 * 1024 ** 2  # bytes, IMOD programs and small buffers
+UNBINNED_IMAGES_IN_MEMORY = 4
+
+
+class ResourceAllocation:
+    """Cores and memory reserved for one job by a `ResourceScheduler`."""
+
+    def __init__(self, cpus: List[int], memory: int, pin_cpus: bool = False):
+        self.cpus: List[int] = cpus
+        self.memory: int = memory
+        self.pin_cpus: bool = pin_cpus
+
+    @property
+    def environment(self) -> Dict[str, str]:
+        """Environment variables limiting the number of threads IMOD uses."""
+        n_cores = str(len(self.cpus))
+        return {'IMOD_PROCESSORS': n_cores, 'OMP_NUM_THREADS': n_cores}
+
+    @property
+    def cpu_affinity(self) -> Optional[List[int]]:
+        """CPUs batchruntomo should be restricted to, None if not pinned."""
+        return self.cpus if self.pin_cpus is True else None
+
+    def __repr__(self) -> str:
+        return f'ResourceAllocation(cpus={self.cpus!r}, memory={self.memory!r})'
+
+
+class ResourceScheduler:
+    """Admits concurrent jobs only while their core and memory budgets fit.
+
+    Parameters
+    ----------
+    cores: number of cores to share between jobs, defaults to all cores
+        available to this process.
+    memory: bytes of memory to share between jobs, defaults to physical memory.
+    cores_per_job: cores reserved for each job unless requested otherwise.
+    pin_cpus: restrict each job to the cores reserved for it.
+    """
+
+    def __init__(
+            self,
+            cores: Optional[int] = None,
+            memory: Optional[int] = None,
+            cores_per_job: int = DEFAULT_CORES_PER_JOB,
+            pin_cpus: bool = False,
+    ):
+        available_cpus = _get_available_cpus()
+        self.cpus: List[int] = available_cpus[:cores] if cores is not None else available_cpus
+        self.memory: int = memory if memory is not None else _get_total_memory()
+        self.cores_per_job: int = cores_per_job
+        self.pin_cpus: bool = pin_cpus
+        self._free_cpus: List[int] = list(self.cpus)
+        self._free_memory: int = self.memory
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def allocate(
+            self, memory: int, cores: Optional[int] = None
+    ) -> Iterator[ResourceAllocation]:
+        """Block until resources for a job are free, reserving them within the block.
+
+        Requests larger than the total are reduced to the total so that such
+        jobs run on their own.
+        """
+        cores = min(cores or self.cores_per_job, len(self.cpus))
+        memory = min(memory, self.memory)
+        with self._condition:
+            self._condition.wait_for(
+                lambda: len(self._free_cpus) >= cores and self._free_memory >= memory
+            )
+            cpus = self._free_cpus[:cores]
+            del self._free_cpus[:cores]
+            self._free_memory -= memory
+        try:
+            yield ResourceAllocation(cpus=cpus, memory=memory, pin_cpus=self.pin_cpus)
+        finally:
+            with self._condition:
+                self._free_cpus = sorted(self._free_cpus + cpus)
+                self._free_memory += memory
+                self._condition.notify_all()
+
+    def __repr__(self) -> str:
+        return (
+            f'ResourceScheduler(cores={len(self.cpus)}, memory={self.memory}, '
+            f'cores_per_job={self.cores_per_job})'
+        )
+
+
+def estimate_alignment_memory(
+        tilt_series: Union[np.ndarray, os.PathLike], pixel_size: float
+) -> int:
+    """Rough estimate of the peak memory in bytes used to align a tilt-series.
+
+    IMOD holds a few unbinned float32 images and stacks binned towards the
+    target pixel size for alignment in memory.
+    """
+    n_images, ny, nx = _get_shape(tilt_series)
+    binning_factor = find_optimal_power_of_2_binning_factor(
+        src_pixel_size=pixel_size, target_pixel_size=TARGET_PIXEL_SIZE_FOR_ALIGNMENT
+    )
+    image_bytes = ny * nx * np.dtype(np.float32).itemsize
+    binned_stack_bytes = n_images * image_bytes / binning_factor ** 2
+    return int(
+        BASE_MEMORY_PER_JOB
+        + UNBINNED_IMAGES_IN_MEMORY * image_bytes
+        + 2 * binned_stack_bytes
+    )
+
+
+def _get_shape(tilt_series: Union[np.ndarray, os.PathLike]) -> Tuple[int, int, int]:
+    if isinstance(tilt_series, (str, os.PathLike)):
+        with mrcfile.open(tilt_series, mode='r', header_only=True) as mrc:
+            header = mrc.header
+            return int(header.nz), int(header.ny), int(header.nx)
+    return tuple(tilt_series.shape)
+
+
+def _get_available_cpus() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _get_total_memory() -> int:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return sys.maxsize
@@ -1,5 +1,6 @@
 import os
-from typing import Optional
+from functools import cached_property
+from typing import Optional, Sequence
 from warnings import warn
 
 import numpy as np
@@ -92,3 +93,177 @@ class XF:
         Rotation center is in IMOD convention `(N-1) / 2`.
         """
         return -self.image_shifts
+
+
+class XFBatch:
+    """xf data for many tilt-series in one array-backed container.
+
+    Rows of all tilt-series are stored in a single `(n, 6)` array, the rows of
+    series `i` are `xf_data[offsets[i]:offsets[i + 1]]`. Derived properties
+    are computed for all images at once and cached, the data should not be
+    modified after construction.
+    """
+
+    def __init__(
+        self,
+        xf_data: np.ndarray,
+        offsets: np.ndarray,
+        initial_tilt_axis_rotation_angles: Optional[Sequence[float]] = None,
+    ):
+        self.xf_data = np.array(xf_data, dtype=float).reshape((-1, 6))
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        if (
+            self.offsets.ndim != 1 or self.offsets[0] != 0
+            or self.offsets[-1] != len(self.xf_data) or np.any(np.diff(self.offsets) < 0)
+        ):
+            raise ValueError('offsets must increase from 0 to the number of rows.')
+        self.initial_tilt_axis_rotation_angles = None
+        if initial_tilt_axis_rotation_angles is not None:
+            self.initial_tilt_axis_rotation_angles = np.asarray(
+                initial_tilt_axis_rotation_angles, dtype=float
+            ).reshape(-1)
+            if len(self.initial_tilt_axis_rotation_angles) != self.n_series:
+                raise ValueError('one initial tilt-axis angle is needed per tilt-series.')
+        self.xf_data.flags.writeable = False
+
+    @classmethod
+    def from_arrays(
+        cls,
+        xf_arrays: Sequence[np.ndarray],
+        initial_tilt_axis_rotation_angles: Optional[Sequence[float]] = None,
+    ):
+        xf_arrays = [np.asarray(xf).reshape((-1, 6)) for xf in xf_arrays]
+        offsets = np.zeros(len(xf_arrays) + 1, dtype=np.intp)
+        np.cumsum([len(xf) for xf in xf_arrays], out=offsets[1:])
+        xf_data = np.concatenate(xf_arrays) if xf_arrays else np.zeros((0, 6))
+        return cls(xf_data, offsets, initial_tilt_axis_rotation_angles)
+
+    @classmethod
+    def from_files(
+        cls,
+        filenames: Sequence[os.PathLike],
+        initial_tilt_axis_rotation_angles: Optional[Sequence[float]] = None,
+    ):
+        return cls.from_arrays(
+            [read_xf(filename) for filename in filenames],
+            initial_tilt_axis_rotation_angles,
+        )
+
+    @classmethod
+    def from_xfs(cls, xfs: Sequence[XF]):
+        angles = [xf.initial_tilt_axis_rotation_angle for xf in xfs]
+        if any(angle is None for angle in angles):
+            angles = None
+        return cls.from_arrays([xf.xf_data for xf in xfs], angles)
+
+    @property
+    def n_series(self) -> int:
+        return len(self.offsets) - 1
+
+    @cached_property
+    def lengths(self) -> np.ndarray:
+        """`(n_series, )` array with the number of images in each tilt-series."""
+        return np.diff(self.offsets)
+
+    @cached_property
+    def series_indices(self) -> np.ndarray:
+        """`(n, )` array with the index of the tilt-series each image belongs to."""
+        return np.repeat(np.arange(self.n_series), self.lengths)
+
+    def __len__(self) -> int:
+        return self.n_series
+
+    def __getitem__(self, index: int) -> XF:
+        """xf data of a single tilt-series."""
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        angle = None
+        if self.initial_tilt_axis_rotation_angles is not None:
+            angle = float(self.initial_tilt_axis_rotation_angles[index])
+        return XF(np.array(self.xf_data[start:stop]), angle)
+
+    @property
+    def shifts(self) -> np.ndarray:
+        """`(n, 2)` array of `(DX, DY)` from xf data."""
+        return self.xf_data[:, -2:]
+
+    @property
+    def transformation_matrices(self) -> np.ndarray:
+        """`(n, 2, 2)` array containing `A11, A12, A21, A22` from xf data."""
+        return self.xf_data[:, :4].reshape((-1, 2, 2))
+
+    @cached_property
+    def inverse_transformation_matrices(self) -> np.ndarray:
+        """`(n, 2, 2)` array of inverse transformation matrices.
+
+        Inverses are calculated in closed form, singular matrices fall back to
+        the pseudo-inverse.
+        """
+        a11, a12, a21, a22 = self.xf_data[:, :4].T
+        determinants = a11 * a22 - a12 * a21
+        is_singular = np.abs(determinants) < np.finfo(float).eps
+        determinants[is_singular] = 1
+        inverses = np.stack([a22, -a12, -a21, a11], axis=-1).reshape((-1, 2, 2))
+        inverses /= determinants[:, np.newaxis, np.newaxis]
+        if np.any(is_singular):
+            inverses[is_singular] = np.linalg.pinv(self.transformation_matrices[is_singular])
+        return inverses
+
+    @cached_property
+    def in_plane_rotations(self) -> np.ndarray:
+        """`(n, )` array of in plane rotation angles from xf data.
+
+        Angles are in degrees and counter-clockwise angles are positive. The
+        sign of each tilt-series is chosen to best match its initial tilt-axis
+        rotation angle, as for `XF`.
+        """
+        theta = np.rad2deg(np.arctan2(-self.xf_data[:, 2], self.xf_data[:, 0]))
+        if self.initial_tilt_axis_rotation_angles is None:
+            warn(
+                'no initial values were provided for tilt-axis angles and there '
+                'are multiple valid solutions for the requested in-plane rotation angles.'
+            )
+            return theta
+        initial_theta = self.initial_tilt_axis_rotation_angles[self.series_indices]
+        is_flipped = np.zeros(self.n_series, dtype=bool)
+        is_nonempty = self.lengths > 0
+        starts = self.offsets[:-1][is_nonempty]
+        if len(starts) > 0:
+            difference = np.add.reduceat(np.abs(initial_theta - theta), starts)
+            flipped_difference = np.add.reduceat(np.abs(-initial_theta - theta), starts)
+            is_flipped[is_nonempty] = flipped_difference < difference
+        return np.where(is_flipped[self.series_indices], -theta, theta)
+
+    @cached_property
+    def image_shifts(self) -> np.ndarray:
+        """`(n, 2)` array of xy shifts aligning tilt-images with the projected specimen.
+
+        Rotation center is in IMOD convention `(N-1) / 2`.
+        """
+        return np.einsum('nij,nj->ni', self.inverse_transformation_matrices, self.shifts)
+
+    @property
+    def specimen_shifts(self) -> np.ndarray:
+        """`(n, 2)` array of xy shifts aligning the projected specimen with tilt-images.
+
+        Rotation center is in IMOD convention `(N-1) / 2`.
+        """
+        return -self.image_shifts
+
+    def compose(self, other: 'XFBatch') -> 'XFBatch':
+        """Transforms applying `self` followed by `other`, as IMOD's xfproduct.
+
+        Both batches must hold the same number of images per tilt-series.
+        """
+        if not np.array_equal(self.offsets, other.offsets):
+            raise ValueError('batches must hold the same number of images per tilt-series.')
+        matrices = other.transformation_matrices @ self.transformation_matrices
+        shifts = np.einsum('nij,nj->ni', other.transformation_matrices, self.shifts)
+        shifts += other.shifts
+        xf_data = np.concatenate([matrices.reshape((-1, 4)), shifts], axis=-1)
+        return XFBatch(xf_data, self.offsets, self.initial_tilt_axis_rotation_angles)
+
+    def inverse(self) -> 'XFBatch':
+        """Transforms undoing each transform in the batch."""
+        matrices = self.inverse_transformation_matrices
+        xf_data = np.concatenate([matrices.reshape((-1, 4)), -self.image_shifts], axis=-1)
+        return XFBatch(xf_data, self.offsets, self.initial_tilt_axis_rotation_angles)
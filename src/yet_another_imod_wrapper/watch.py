@@ -0,0 +1,224 @@
+"""Align tilt-series as they are written into a directory."""
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .batch import ALIGNMENT_FUNCTIONS
+from .job_queue import JobQueue
+from .utils import events
+from .utils.io import read_tlt
+
+WATCH_STATE_FILENAME = 'watch_state.json'
+TILT_SERIES_SUFFIXES = ('.mrc', '.st')
+TILT_ANGLE_SUFFIXES = ('.rawtlt', '.tlt')
+
+# states of tilt-series in the state file
+RUNNING = 'running'
+QUEUED = 'queued'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class TiltSeriesWatcher:
+    """Watch a directory for completed tilt-series and align them.
+
+    A tilt-series is complete once a tilt-angle file with the same stem exists
+    and neither the size nor the modification time of the stack or the
+    tilt-angle file has changed for `stable_time` seconds, as acquisition
+    software may rewrite the tilt-angle file after every tilt. Each tilt-series
+    is aligned into its own subdirectory of `output_directory`, at most
+    `max_workers` at a time, or submitted to a `JobQueue`. Tilt-series already
+    handled are recorded in a state file and skipped after a restart,
+    unfinished alignments are resumed.
+
+    Parameters
+    ----------
+    directory: directory the microscope writes tilt-series into.
+    output_directory: directory for Etomo directories and the state file.
+    method: alignment method, 'fiducials' or 'patch_tracking'.
+    alignment_parameters: further keyword arguments for the alignment function,
+        e.g. `pixel_size`, `nominal_rotation_angle` and `patch_size`.
+    max_workers: maximum number of tilt-series aligned at the same time.
+    stable_time: seconds a stack and its tilt-angle file must stay unchanged
+        to count as complete.
+    queue: submit completed tilt-series to this queue instead of aligning them.
+    """
+
+    def __init__(
+            self,
+            directory: os.PathLike,
+            output_directory: os.PathLike,
+            method: str,
+            alignment_parameters: Dict[str, Any],
+            max_workers: int = 1,
+            stable_time: float = 30,
+            queue: Optional[JobQueue] = None,
+    ):
+        if method not in ALIGNMENT_FUNCTIONS:
+            raise ValueError(
+                f'unknown alignment method {method!r}, '
+                f'expected one of {list(ALIGNMENT_FUNCTIONS)}'
+            )
+        self.directory: Path = Path(directory).absolute()
+        self.output_directory: Path = Path(output_directory).absolute()
+        self.method: str = method
+        self.alignment_parameters: Dict[str, Any] = dict(alignment_parameters)
+        self.stable_time: float = stable_time
+        self.queue: Optional[JobQueue] = queue
+        self.futures: Dict[Path, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._last_changed: Dict[Path, Tuple[tuple, float]] = {}
+        self._lock = threading.Lock()
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+        self.state: Dict[str, Dict[str, Any]] = self._read_state()
+
+    @property
+    def state_file(self) -> Path:
+        return self.output_directory / WATCH_STATE_FILENAME
+
+    def poll(self) -> List[Path]:
+        """Start alignment of newly completed tilt-series, returning their files."""
+        started = []
+        for tilt_series_file, tilt_angle_file in self.find_completed_tilt_series():
+            key = str(tilt_series_file)
+            with self._lock:
+                state = self.state.get(key, {}).get('status')
+            if state in (SUCCEEDED, FAILED, QUEUED) or tilt_series_file in self.futures:
+                continue
+            self._start(tilt_series_file, tilt_angle_file, resume=state == RUNNING)
+            started.append(tilt_series_file)
+        return started
+
+    def run(
+            self, poll_interval: float = 10, stop: Optional[threading.Event] = None
+    ) -> None:
+        """Poll the directory until `stop` is set, then wait for alignments."""
+        stop = threading.Event() if stop is None else stop
+        try:
+            while True:
+                self.poll()
+                if stop.wait(poll_interval):
+                    break
+        finally:
+            self.shutdown()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def find_completed_tilt_series(self) -> List[Tuple[Path, Path]]:
+        """Find stacks which are complete along with their tilt-angle files."""
+        completed = []
+        now = time.monotonic()
+        for file in sorted(self.directory.iterdir()):
+            if file.suffix not in TILT_SERIES_SUFFIXES or not file.is_file():
+                continue
+            tilt_angle_file = _find_tilt_angle_file(file)
+            if tilt_angle_file is None:
+                continue
+            stack, angles = file.stat(), tilt_angle_file.stat()
+            signature = (stack.st_size, stack.st_mtime, angles.st_size, angles.st_mtime)
+            last_signature, last_changed = self._last_changed.get(file, (None, now))
+            if signature != last_signature:
+                self._last_changed[file] = (signature, now)
+                last_changed = now
+            if now - last_changed >= self.stable_time:
+                completed.append((file, tilt_angle_file))
+        return completed
+
+    def _start(
+            self, tilt_series_file: Path, tilt_angle_file: Path, resume: bool
+    ) -> None:
+        job = {
+            **self.alignment_parameters,
+            'tilt_series': tilt_series_file,
+            'tilt_angles': read_tlt(tilt_angle_file),
+            'basename': tilt_series_file.stem,
+            'output_directory': self.output_directory / tilt_series_file.stem,
+        }
+        if self.queue is not None:
+            self.queue.submit(job, method=self.method)
+            self._set_state(tilt_series_file, QUEUED)
+            return
+        if resume is True:
+            job['resume'] = True
+        self._set_state(tilt_series_file, RUNNING)
+        events.emit(events.ALIGNMENT_QUEUED, job['basename'])
+        future = self._executor.submit(ALIGNMENT_FUNCTIONS[self.method], **job)
+        future.add_done_callback(
+            lambda future: self._on_finished(tilt_series_file, future)
+        )
+        self.futures[tilt_series_file] = future
+
+    def _on_finished(self, tilt_series_file: Path, future: Future) -> None:
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self._set_state(tilt_series_file, SUCCEEDED)
+        else:
+            self._set_state(
+                tilt_series_file, FAILED, error=f'{type(error).__name__}: {error}'
+            )
+
+    def _set_state(self, tilt_series_file: Path, status: str, **fields) -> None:
+        with self._lock:
+            self.state[str(tilt_series_file)] = {
+                'status': status,
+                'output_directory': str(self.output_directory / tilt_series_file.stem),
+                'updated_at': time.time(),
+                **fields,
+            }
+            temporary_file = self.state_file.with_name(f'.{self.state_file.name}.tmp')
+            temporary_file.write_text(json.dumps(self.state, indent=2))
+            os.replace(temporary_file, self.state_file)
+
+    def _read_state(self) -> Dict[str, Dict[str, Any]]:
+        if not self.state_file.exists():
+            return {}
+        return json.loads(self.state_file.read_text())
+
+
+def watch_directory(
+        directory: os.PathLike,
+        output_directory: os.PathLike,
+        method: str,
+        alignment_parameters: Dict[str, Any],
+        max_workers: int = 1,
+        stable_time: float = 30,
+        poll_interval: float = 10,
+        queue: Optional[JobQueue] = None,
+        stop: Optional[threading.Event] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Align tilt-series written into a directory until `stop` is set.
+
+    See `TiltSeriesWatcher` for how completed tilt-series are detected.
+
+    Returns
+    -------
+    state: status of each tilt-series seen, keyed by file.
+    """
+    watcher = TiltSeriesWatcher(
+        directory=directory,
+        output_directory=output_directory,
+        method=method,
+        alignment_parameters=alignment_parameters,
+        max_workers=max_workers,
+        stable_time=stable_time,
+        queue=queue,
+    )
+    watcher.run(poll_interval=poll_interval, stop=stop)
+    return watcher.state
+
+
+def _find_tilt_angle_file(
+        tilt_series_file: Path, suffixes: Sequence[str] = TILT_ANGLE_SUFFIXES
+) -> Optional[Path]:
+    for suffix in suffixes:
+        tilt_angle_file = tilt_series_file.with_suffix(suffix)
+        if tilt_angle_file.exists():
+            return tilt_angle_file
+    return None
@@ -0,0 +1,153 @@
+import os
+import time
+
+import pytest
+
+from yet_another_imod_wrapper import utils
+from yet_another_imod_wrapper.utils.backends import (
+    BatchruntomoJob,
+    BatchSchedulerBackend,
+    ExecutionBackend,
+    LocalBackend,
+    ProcessPoolBackend,
+)
+
+FAKE_BATCHRUNTOMO = 'echo "Running xcorr.com"; echo "aligned $IMOD_PROCESSORS"'
+FAKE_SUBMIT = '#!/bin/sh\nsh "$1" > /dev/null 2>&1 &\necho "Submitted batch job 42"\n'
+
+
+@pytest.fixture
+def fake_batchruntomo(monkeypatch):
+    def set_script(script):
+        monkeypatch.setattr(
+            utils.etomo, '_get_batchruntomo_command', lambda **kwargs: ['sh', '-c', script]
+        )
+    set_script(FAKE_BATCHRUNTOMO)
+    return set_script
+
+
+@pytest.fixture
+def fake_sbatch(tmp_path):
+    """Stand-in for sbatch which runs the job script in the background."""
+    submit = tmp_path / 'fake_sbatch'
+    submit.write_text(FAKE_SUBMIT)
+    submit.chmod(0o755)
+    return BatchSchedulerBackend(
+        submit_command=[str(submit)], cancel_command=None, poll_interval=0.05
+    )
+
+
+@pytest.mark.parametrize('backend_type', [LocalBackend, ProcessPoolBackend])
+def test_run_batchruntomo_backends(tmp_path, fake_batchruntomo, backend_type):
+    """Output reaches the log and monitor whichever process runs batchruntomo."""
+    monitor = utils.monitor.BatchruntomoMonitor()
+    with backend_type() as backend:
+        utils.etomo.run_batchruntomo(
+            directory=tmp_path,
+            basename='TS',
+            directive={'setupset.copyarg.name': 'TS'},
+            monitor=monitor,
+            environment={'IMOD_PROCESSORS': '2'},
+            backend=backend,
+        )
+    assert 'aligned 2' in (tmp_path / 'log.txt').read_text()
+    assert monitor.current_comfile == 'xcorr'
+    assert (tmp_path / utils.etomo.BATCHRUNTOMO_DIRECTIVE_FILENAME).exists()
+
+
+def test_batch_scheduler_backend(tmp_path, fake_batchruntomo, fake_sbatch):
+    """A submitted job is waited for and its log fed to the monitor."""
+    monitor = utils.monitor.BatchruntomoMonitor()
+    utils.etomo.run_batchruntomo(
+        directory=tmp_path,
+        basename='TS',
+        directive={},
+        monitor=monitor,
+        environment={'IMOD_PROCESSORS': '2'},
+        backend=fake_sbatch,
+    )
+    assert 'aligned 2' in (tmp_path / 'log.txt').read_text()
+    assert monitor.current_step == 2
+    assert (tmp_path / 'TS_batchruntomo.exit').read_text().strip() == '0'
+
+
+def test_batch_scheduler_backend_failure(tmp_path, fake_batchruntomo, fake_sbatch):
+    """Exit codes and fatal errors of submitted jobs are raised."""
+    fake_batchruntomo('echo "Running track.com"; echo "ERROR: beadtrack - too few beads"; exit 3')
+    with pytest.raises(utils.etomo.BatchruntomoError) as excinfo:
+        utils.etomo.run_batchruntomo(
+            directory=tmp_path, basename='TS', directive={}, backend=fake_sbatch
+        )
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.step == 5
+    assert excinfo.value.fatal_error is not None
+
+
+def test_batch_scheduler_backend_timeout(tmp_path, fake_batchruntomo, fake_sbatch):
+    """Jobs which do not finish in time are cancelled."""
+    cancelled = tmp_path / 'cancelled'
+    fake_sbatch.cancel_command = ['sh', '-c', f'echo "$0" > {cancelled}']
+    fake_batchruntomo('sleep 2')
+    start = time.perf_counter()
+    with pytest.raises(utils.etomo.BatchruntomoError) as excinfo:
+        utils.etomo.run_batchruntomo(
+            directory=tmp_path, basename='TS', directive={}, timeout=0.2,
+            backend=fake_sbatch,
+        )
+    assert excinfo.value.timed_out is True
+    assert time.perf_counter() - start < 2
+    assert cancelled.read_text().strip() == '42'
+
+
+def test_batch_scheduler_backend_submit_error(tmp_path, fake_batchruntomo):
+    backend = BatchSchedulerBackend(submit_command=['false'], cancel_command=None)
+    with pytest.raises(RuntimeError, match='failed to submit'):
+        utils.etomo.run_batchruntomo(
+            directory=tmp_path, basename='TS', directive={}, backend=backend
+        )
+
+
+def test_execution_backend_is_abstract():
+    with pytest.raises(TypeError):
+        ExecutionBackend()
+
+
+def test_process_pool_backend_timeout_kills_batchruntomo(tmp_path, fake_batchruntomo):
+    """Timeouts are forwarded to the worker's batchruntomo process group."""
+    fake_batchruntomo(f'echo $$ > {tmp_path / "pid"}; sleep 5')
+    start = time.perf_counter()
+    with ProcessPoolBackend(max_workers=1) as backend:
+        with pytest.raises(utils.etomo.BatchruntomoError) as excinfo:
+            utils.etomo.run_batchruntomo(
+                directory=tmp_path, basename='TS', directive={}, timeout=0.5,
+                backend=backend,
+            )
+    assert excinfo.value.timed_out is True
+    assert time.perf_counter() - start < 5
+    with pytest.raises(ProcessLookupError):
+        os.kill(int((tmp_path / 'pid').read_text()), 0)
+    assert not (tmp_path / 'TS_batchruntomo.pid').exists()
+
+
+def test_batch_job_script_uses_absolute_paths(tmp_path, monkeypatch):
+    """Job scripts do not depend on the directory they are submitted from."""
+    (tmp_path / 'TS').mkdir()
+    monkeypatch.chdir(tmp_path)
+    job = BatchruntomoJob(command=['batchruntomo'], directory='TS', basename='TS')
+    script = BatchSchedulerBackend().get_job_script(job, tmp_path / 'TS' / 'TS.exit')
+    assert f'cd {tmp_path / "TS"}' in script.splitlines()
+
+
+def test_monitor_finishes_after_all_output(tmp_path, fake_batchruntomo):
+    """The monitor has seen the last line of output when it is finished."""
+    class RecordingMonitor(utils.monitor.BatchruntomoMonitor):
+        def finish(self, directory):
+            self.comfile_at_finish = self.current_comfile
+
+    fake_batchruntomo('echo "Running xcorr.com"; echo "Running align.com"')
+    for _ in range(20):
+        monitor = RecordingMonitor()
+        utils.etomo.run_batchruntomo(
+            directory=tmp_path, basename='TS', directive={}, monitor=monitor
+        )
+        assert monitor.comfile_at_finish == 'align'
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from yet_another_imod_wrapper import batch
+from yet_another_imod_wrapper.utils.etomo import EtomoOutput
+from yet_another_imod_wrapper.utils import scheduler as scheduler_module
+from yet_another_imod_wrapper.utils.scheduler import ResourceScheduler
+
+
+def test_align_many_continues_after_failure(monkeypatch, tmp_path):
+    """A failing job is reported without stopping the rest of the batch."""
+    def fake_alignment(basename: str, output_directory: Path, **kwargs):
+        if basename == 'bad':
+            raise RuntimeError(f'{basename} failed to align correctly.')
+        return EtomoOutput(basename=basename, directory=output_directory)
+
+    monkeypatch.setitem(batch.ALIGNMENT_FUNCTIONS, 'patch_tracking', fake_alignment)
+    jobs = [
+        {'basename': name, 'output_directory': tmp_path / name}
+        for name in ('TS_01', 'bad', 'TS_02')
+    ]
+    results = batch.align_many(jobs, method='patch_tracking', max_workers=2)
+
+    assert [type(result) for result in results] == [
+        EtomoOutput, batch.AlignmentFailure, EtomoOutput
+    ]
+    assert results[0].basename == 'TS_01'
+    assert results[1].basename == 'bad'
+    assert 'failed to align correctly' in results[1].message
+
+
+def test_align_many_unknown_method(tmp_path):
+    results = batch.align_many(
+        [{'basename': 'TS_01', 'output_directory': tmp_path, 'method': 'magic'}]
+    )
+    assert isinstance(results[0], batch.AlignmentFailure)
+    assert isinstance(results[0].error, ValueError)
+
+
+def test_default_max_workers(monkeypatch):
+    """Few alignments run at once by default, as each uses every core."""
+    monkeypatch.setattr(batch.os, 'cpu_count', lambda: 64)
+    assert batch.get_default_max_workers() == batch.DEFAULT_MAX_WORKERS
+    monkeypatch.setattr(batch.os, 'cpu_count', lambda: 2)
+    assert batch.get_default_max_workers() == 2
+    monkeypatch.setattr(scheduler_module, '_get_available_cpus', lambda: list(range(16)))
+    scheduler = ResourceScheduler(memory=2 ** 30, cores_per_job=4)
+    assert batch.get_default_max_workers(scheduler) == 4
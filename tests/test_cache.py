@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pytest
+from packaging import version
+
+from yet_another_imod_wrapper.utils import cache as cache_module
+from yet_another_imod_wrapper.utils.cache import AlignmentCache
+from yet_another_imod_wrapper.utils.etomo import prepare_etomo_directory
+
+
+@pytest.fixture
+def fake_imod_version(monkeypatch):
+    monkeypatch.setattr(cache_module, '_get_imod_version', lambda: version.parse('4.11.24'))
+
+
+def _aligned_etomo_directory(directory, tilt_series, xf_contents='1 0 0 1 0 0\n'):
+    output = prepare_etomo_directory(
+        directory=directory,
+        tilt_series=tilt_series,
+        tilt_angles=np.arange(len(tilt_series)),
+        basename='TS',
+        fingerprint='full',
+    )
+    output.xf_file.write_text(xf_contents)
+    output.tlt_file.write_text('0\n')
+    output.align_log_file.write_text('log\n')
+    return output
+
+
+def test_cache_store_and_retrieve(tmp_path, fake_imod_version):
+    cache = AlignmentCache(tmp_path / 'cache')
+    tilt_series = np.zeros((3, 8, 8))
+    directive = {'setupset.copyarg.rotation': '85'}
+
+    first = _aligned_etomo_directory(tmp_path / 'first', tilt_series)
+    key = cache.get_key(first, directive)
+    cache.store(key, first)
+
+    second = prepare_etomo_directory(
+        directory=tmp_path / 'second',
+        tilt_series=tilt_series,
+        tilt_angles=np.arange(3),
+        basename='TS',
+        fingerprint='full',
+    )
+    assert cache.get_key(second, directive) == key
+    assert cache.get_key(second, {'setupset.copyarg.rotation': '86'}) != key
+    assert second.contains_alignment_results is False
+    assert cache.retrieve(key, second) is True
+    assert second.xf_file.read_text() == first.xf_file.read_text()
+
+    other_data = prepare_etomo_directory(
+        directory=tmp_path / 'other',
+        tilt_series=tilt_series + 1,
+        tilt_angles=np.arange(3),
+        basename='TS',
+        fingerprint='full',
+    )
+    assert cache.get_key(other_data, directive) != key
+
+
+def test_cache_evicts_least_recently_used(tmp_path, fake_imod_version):
+    cache = AlignmentCache(tmp_path / 'cache', max_size=10 ** 6)
+    keys = []
+    for idx in range(3):
+        output = _aligned_etomo_directory(tmp_path / f'{idx}', np.full((3, 8, 8), idx))
+        key = cache.get_key(output, {})
+        cache.store(key, output)
+        os.utime(cache.entries_directory / key, (idx, idx))
+        keys.append(key)
+
+    cache.retrieve(keys[0], output)  # marks the first entry as recently used
+    entry_size = sum(f.stat().st_size for f in (cache.entries_directory / keys[0]).iterdir())
+    cache.max_size = 2 * entry_size
+    cache.evict()
+    assert sorted(p.name for p in cache.entries_directory.iterdir()) == sorted(
+        [keys[0], keys[2]]
+    )
+
+
+def test_cache_requires_fingerprint(tmp_path, fake_imod_version):
+    output = prepare_etomo_directory(
+        directory=tmp_path, tilt_series=np.zeros((3, 8, 8)),
+        tilt_angles=np.arange(3), basename='TS'
+    )
+    with pytest.raises(ValueError):
+        AlignmentCache(tmp_path / 'cache').get_key(output, {})
+
+
+def test_cache_store_reports_failures(tmp_path, fake_imod_version, caplog):
+    """Entries stored by another process are kept, other failures are logged."""
+    cache = AlignmentCache(tmp_path / 'cache')
+    output = _aligned_etomo_directory(tmp_path / 'first', np.zeros((3, 8, 8)))
+    key = cache.get_key(output, {})
+    cache.store(key, output)
+    cache.store(key, output)
+    assert caplog.records == []
+    assert len(list(cache.entries_directory.iterdir())) == 1
+
+    output.align_log_file.unlink()
+    cache.clear()
+    cache.store(key, output)
+    assert 'failed to store TS' in caplog.text
+    assert list(cache.entries_directory.iterdir()) == []
+    assert [path.name for path in cache.directory.iterdir()] == ['entries']
@@ -0,0 +1,114 @@
+import json
+
+import numpy as np
+import pytest
+
+from yet_another_imod_wrapper import _alignment
+from yet_another_imod_wrapper.utils import events
+from yet_another_imod_wrapper.utils.etomo import prepare_etomo_directory
+
+
+@pytest.fixture
+def received():
+    received = []
+    hook = events.add_hook(received.append)
+    yield received
+    events.remove_hook(hook)
+
+
+def test_hook_errors_become_warnings(received):
+    def broken_hook(event):
+        raise ValueError('broken')
+
+    events.add_hook(broken_hook)
+    try:
+        with pytest.warns(UserWarning, match='broken'):
+            events.emit(events.CACHE_HIT, 'TS', key='abc')
+    finally:
+        events.remove_hook(broken_hook)
+    assert [event.name for event in received] == [events.CACHE_HIT]
+
+
+def test_alignment_events(monkeypatch, tmp_path, received):
+    def fake_batchruntomo(directory, basename, **kwargs):
+        for name in (f'{basename}.xf', f'{basename}.tlt'):
+            (directory / name).write_text('\n')
+
+    monkeypatch.setattr(_alignment, 'check_imod_installation', lambda: None)
+    monkeypatch.setattr(_alignment, 'run_batchruntomo', fake_batchruntomo)
+    _alignment.align_tilt_series(
+        tilt_series=np.zeros((3, 8, 8), dtype=np.float32),
+        tilt_angles=[-3, 0, 3],
+        pixel_size=5,
+        basename='TS',
+        output_directory=tmp_path,
+        generate_directive=lambda tilt_series_file, pixel_size: {},
+    )
+    assert [event.name for event in received] == [
+        events.ALIGNMENT_STARTED,
+        events.STAGING_STARTED,
+        events.STAGING_FINISHED,
+        events.DIRECTIVE_GENERATED,
+        events.ALIGNMENT_FINISHED,
+    ]
+    assert received[2].data['bytes'] > 3 * 8 * 8 * 4
+    assert received[-1].data['duration'] >= 0
+
+
+def test_directive_event_includes_prescreen_exclusions(monkeypatch, tmp_path):
+    def fake_batchruntomo(directory, basename, **kwargs):
+        for name in (f'{basename}.xf', f'{basename}.tlt'):
+            (directory / name).write_text('\n')
+
+    monkeypatch.setattr(_alignment, 'check_imod_installation', lambda: None)
+    monkeypatch.setattr(_alignment, 'run_batchruntomo', fake_batchruntomo)
+    monkeypatch.setattr(
+        _alignment, 'find_bad_tilt_images', lambda tilt_series: np.array([2])
+    )
+    directives = []
+
+    def record_directive(event):
+        # copy as hooks see the directive as it was when the event was emitted
+        if event.name == events.DIRECTIVE_GENERATED:
+            directives.append(dict(event.data['directive']))
+
+    hook = events.add_hook(record_directive)
+    try:
+        _alignment.align_tilt_series(
+            tilt_series=np.zeros((3, 8, 8), dtype=np.float32),
+            tilt_angles=[-3, 0, 3],
+            pixel_size=5,
+            basename='TS',
+            output_directory=tmp_path,
+            generate_directive=lambda tilt_series_file, pixel_size: {},
+            prescreen=True,
+        )
+    finally:
+        events.remove_hook(hook)
+    assert directives == [{'runtime.Excludeviews.any.views': '3'}]
+
+
+def test_sinks(tmp_path):
+    json_lines_sink = events.add_hook(events.JSONLinesSink(tmp_path / 'events.jsonl'))
+    prometheus_sink = events.add_hook(events.PrometheusTextfileSink(tmp_path / 'metrics.prom'))
+    try:
+        events.emit(events.ALIGNMENT_QUEUED, 'TS')
+        prepare_etomo_directory(
+            directory=tmp_path / 'TS',
+            tilt_series=np.zeros((3, 8, 8), dtype=np.float32),
+            tilt_angles=[-3, 0, 3],
+            basename='TS',
+        )
+    finally:
+        events.remove_hook(json_lines_sink)
+        events.remove_hook(prometheus_sink)
+    lines = (tmp_path / 'events.jsonl').read_text().splitlines()
+    records = [json.loads(line) for line in lines]
+    assert [record['event'] for record in records] == [
+        events.ALIGNMENT_QUEUED, events.STAGING_STARTED, events.STAGING_FINISHED
+    ]
+    assert records[1]['directory'] == str(tmp_path / 'TS')
+    metrics = (tmp_path / 'metrics.prom').read_text()
+    assert 'yet_another_imod_wrapper_queue_depth 1' in metrics
+    assert 'yet_another_imod_wrapper_staging_duration_seconds_count 1' in metrics
+    assert f'yet_another_imod_wrapper_staged_bytes_total {records[2]["bytes"]}' in metrics
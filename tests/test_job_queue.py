@@ -0,0 +1,173 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from yet_another_imod_wrapper import job_queue
+from yet_another_imod_wrapper.job_queue import JobQueue, run_worker
+from yet_another_imod_wrapper.utils.locking import DirectoryLock, DirectoryLockedError
+
+
+def make_job(tmp_path, basename, directory=None):
+    return {
+        'tilt_series': tmp_path / f'{basename}.mrc',
+        'tilt_angles': np.linspace(-60, 60, 41),
+        'pixel_size': 1.35,
+        'nominal_rotation_angle': 85,
+        'patch_size': 500,
+        'basename': basename,
+        'output_directory': tmp_path / (basename if directory is None else directory),
+    }
+
+
+def test_claim_jobs_once(tmp_path):
+    """Concurrent workers never claim the same job."""
+    queue = JobQueue(tmp_path / 'queue.db')
+    for i in range(20):
+        queue.submit(make_job(tmp_path, f'TS_{i:02d}'))
+
+    def claim_all(worker):
+        claimed = []
+        while (job := queue.claim(worker)) is not None:
+            claimed.append(job.id)
+        return claimed
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        claimed = list(executor.map(claim_all, ['a', 'b', 'c', 'd']))
+    all_claimed = [job_id for worker_claimed in claimed for job_id in worker_claimed]
+    assert sorted(all_claimed) == list(range(1, 21))
+    assert (queue.jobs()['status'] == job_queue.RUNNING).all()
+
+
+def test_claim_one_job_per_directory(tmp_path):
+    queue = JobQueue(tmp_path / 'queue.db')
+    queue.submit(make_job(tmp_path, 'TS_01', directory='shared'))
+    queue.submit(make_job(tmp_path, 'TS_02', directory='shared'))
+    job = queue.claim('a')
+    assert job.basename == 'TS_01'
+    assert job.parameters['tilt_angles'][0] == -60
+    assert queue.claim('b') is None
+    queue.finish(job.id, 'a')
+    assert queue.claim('b').basename == 'TS_02'
+
+
+def test_requeue_jobs_of_dead_workers(tmp_path):
+    """Jobs without heartbeats are requeued, then failed after max_attempts."""
+    queue = JobQueue(tmp_path / 'queue.db', lease_timeout=0.05, max_attempts=2)
+    queue.submit(make_job(tmp_path, 'TS_01'))
+    assert queue.claim('a').attempts == 1
+    time.sleep(0.1)
+    job = queue.claim('b')
+    assert job.attempts == 2
+    time.sleep(0.1)
+    assert queue.claim('c') is None
+    jobs = queue.jobs()
+    assert jobs.loc[0, 'status'] == job_queue.FAILED
+    assert jobs.loc[0, 'error'] == 'worker died'
+
+
+def test_submit_array_tilt_series(tmp_path):
+    queue = JobQueue(tmp_path / 'queue.db')
+    job = make_job(tmp_path, 'TS_01')
+    job['tilt_series'] = np.zeros((3, 8, 8))
+    with pytest.raises(ValueError):
+        queue.submit(job)
+
+
+def test_run_worker(tmp_path, monkeypatch):
+    """Workers drain the queue, recording status and timings."""
+    aligned = []
+
+    def fake_alignment(**kwargs):
+        lock_file = os.path.join(kwargs['output_directory'], '.yet_another_imod_wrapper.lock')
+        assert os.path.exists(lock_file)
+        if kwargs['basename'] == 'TS_02':
+            raise RuntimeError('alignment failed')
+        aligned.append(kwargs['basename'])
+
+    monkeypatch.setitem(job_queue.ALIGNMENT_FUNCTIONS, 'patch_tracking', fake_alignment)
+    queue = JobQueue(tmp_path / 'queue.db')
+    for basename in ('TS_01', 'TS_02', 'TS_03'):
+        queue.submit(make_job(tmp_path, basename))
+    assert run_worker(queue, worker='a', exit_when_empty=True) == 3
+    jobs = queue.jobs()
+    assert aligned == ['TS_01', 'TS_03']
+    assert list(jobs['status']) == ['succeeded', 'failed', 'succeeded']
+    assert jobs.loc[1, 'error'] == 'RuntimeError: alignment failed'
+    assert (jobs['duration'] >= 0).all()
+    assert not (tmp_path / 'TS_01' / '.yet_another_imod_wrapper.lock').exists()
+
+
+def test_directory_lock(tmp_path):
+    with DirectoryLock(tmp_path, owner='a', lease_timeout=60):
+        with pytest.raises(DirectoryLockedError, match='locked by a'):
+            DirectoryLock(tmp_path, owner='b').acquire()
+    with DirectoryLock(tmp_path, owner='b'):
+        pass
+
+
+def test_directory_lock_breaks_stale_locks(tmp_path):
+    lock = DirectoryLock(tmp_path, owner='a', lease_timeout=0.05)
+    lock.acquire()
+    time.sleep(0.1)
+    other = DirectoryLock(tmp_path, owner='b', lease_timeout=0.05)
+    other.acquire()
+    assert other.read_owner() == 'b'
+
+
+def test_run_worker_from_another_directory(tmp_path, monkeypatch):
+    """Relative paths are resolved on submission, not where the worker runs."""
+    aligned = []
+
+    def fake_alignment(**kwargs):
+        aligned.append(kwargs)
+
+    monkeypatch.setitem(job_queue.ALIGNMENT_FUNCTIONS, 'patch_tracking', fake_alignment)
+    (tmp_path / 'submit').mkdir()
+    (tmp_path / 'work').mkdir()
+    monkeypatch.chdir(tmp_path / 'submit')
+    queue = JobQueue(tmp_path / 'queue.db')
+    job = make_job(tmp_path, 'TS_01')
+    job['tilt_series'] = 'TS_01.mrc'
+    job['output_directory'] = 'TS_01'
+    queue.submit(job)
+    monkeypatch.chdir(tmp_path / 'work')
+    assert run_worker(queue, worker='a', exit_when_empty=True) == 1
+    assert aligned[0]['tilt_series'] == str(tmp_path / 'submit' / 'TS_01.mrc')
+    assert aligned[0]['output_directory'] == str(tmp_path / 'submit' / 'TS_01')
+    assert not (tmp_path / 'work' / 'TS_01').exists()
+
+
+def test_run_worker_fails_jobs_which_lost_their_lock(tmp_path, monkeypatch, caplog):
+    def fake_alignment(**kwargs):
+        lock_file = os.path.join(kwargs['output_directory'], '.yet_another_imod_wrapper.lock')
+        os.remove(lock_file)
+        time.sleep(0.1)
+
+    monkeypatch.setitem(job_queue.ALIGNMENT_FUNCTIONS, 'patch_tracking', fake_alignment)
+    queue = JobQueue(tmp_path / 'queue.db')
+    queue.submit(make_job(tmp_path, 'TS_01'))
+    run_worker(queue, worker='a', heartbeat_interval=0.02, exit_when_empty=True)
+    assert queue.jobs().loc[0, 'error'].startswith('LockLostError')
+    assert 'heartbeat for job 1 failed' in caplog.text
+
+
+def test_directory_lock_is_broken_once(tmp_path):
+    """Of many workers breaking the same stale lock only one acquires it."""
+    dead = DirectoryLock(tmp_path, owner='dead')
+    dead.acquire()
+    os.utime(dead.lock_file, (0, 0))
+
+    def acquire(owner):
+        try:
+            DirectoryLock(tmp_path, owner=owner, lease_timeout=60).acquire()
+        except DirectoryLockedError:
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        acquired = list(executor.map(acquire, [str(i) for i in range(8)]))
+    assert sum(acquired) == 1
+    assert [file.name for file in tmp_path.iterdir()] == ['.yet_another_imod_wrapper.lock']
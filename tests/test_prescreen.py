@@ -0,0 +1,25 @@
+import numpy as np
+
+from yet_another_imod_wrapper.utils.prescreen import (
+    calculate_tilt_image_statistics,
+    find_bad_tilt_images,
+)
+
+
+def test_find_bad_tilt_images():
+    """Blank and dark images are flagged, others are kept."""
+    rng = np.random.default_rng(seed=0)
+    tilt_series = rng.poisson(lam=50, size=(41, 128, 128)).astype(np.float32)
+    tilt_series[3] = 50  # blank
+    tilt_series[40] *= 0.05  # dark
+    result = find_bad_tilt_images(tilt_series)
+    assert result.tolist() == [3, 40]
+
+
+def test_calculate_tilt_image_statistics():
+    tilt_series = np.random.default_rng(seed=0).normal(size=(20, 64, 32))
+    statistics = calculate_tilt_image_statistics(tilt_series)
+    assert len(statistics) == 20
+    assert np.allclose(statistics['mean'], tilt_series.mean(axis=(1, 2)), atol=1e-6)
+    assert np.allclose(statistics['variance'], tilt_series.var(axis=(1, 2)), atol=1e-5)
+    assert np.all(statistics['spectral_power'] > 0)
@@ -0,0 +1,36 @@
+import numpy as np
+
+from yet_another_imod_wrapper import preview
+
+
+def test_preview_alignment_with_refinement(monkeypatch, tmp_path):
+    """Coarse shifts are returned with the nominal rotation, refinement runs later."""
+    calls = []
+
+    def fake_batchruntomo(directory, basename, directive, starting_step=0, ending_step=6):
+        calls.append((starting_step, ending_step, directive.get(
+            'comparam.xcorr.tiltxcorr.BinningToApply'
+        )))
+        if ending_step == preview.PREVIEW_ENDING_STEP:
+            (directory / f'{basename}.prexg').write_text(
+                '1 0 0 1 2 0\n1 0 0 1 0 0\n1 0 0 1 -2 0\n'
+            )
+        else:
+            for name in (f'{basename}.xf', f'{basename}.tlt'):
+                (directory / name).write_text('\n')
+
+    monkeypatch.setattr(preview, 'check_imod_installation', lambda: None)
+    monkeypatch.setattr(preview, 'run_batchruntomo', fake_batchruntomo)
+    result = preview.preview_alignment(
+        tilt_series=np.zeros((3, 8, 8), dtype=np.float32),
+        tilt_angles=[-3, 0, 3],
+        pixel_size=5,
+        nominal_rotation_angle=90,
+        basename='TS',
+        output_directory=tmp_path,
+        patch_size=40,
+    )
+    assert np.allclose(result.xf.in_plane_rotations, 90)
+    assert np.allclose(result.xf.shifts[0], [0, -2])
+    assert result.wait(timeout=10).contains_alignment_results
+    assert calls == [(0, 2, '4'), (3, 6, None)]
@@ -0,0 +1,31 @@
+import sys
+
+import pytest
+
+from yet_another_imod_wrapper import utils
+
+psutil = pytest.importorskip('psutil')
+
+
+def test_run_batchruntomo_profile(tmp_path, monkeypatch):
+    """Resource usage is attributed to the command file running at the time."""
+    burn_cpu = 'import time\nstart = time.process_time()\nwhile time.process_time() - start < 0.5: pass'
+    script = (
+        f'echo Running xcorr.com; {sys.executable} -c "{burn_cpu}"; '
+        'echo Running align.com; sleep 0.3'
+    )
+    monkeypatch.setattr(
+        utils.etomo, '_get_batchruntomo_command', lambda **kwargs: ['sh', '-c', script]
+    )
+    monitor = utils.profiling.BatchruntomoProfiler(interval=0.05)
+    utils.etomo.run_batchruntomo(
+        directory=tmp_path, basename='TS', directive={}, monitor=monitor, profile=True
+    )
+    profile = utils.etomo.EtomoOutput(basename='TS', directory=tmp_path).profile
+    steps = {step['comfile']: step for step in profile['steps']}
+    assert list(steps) == [None, 'xcorr', 'align']
+    assert steps['xcorr']['step'] == 2
+    assert steps['xcorr']['cpu_time'] > 0.2
+    assert steps['xcorr']['peak_rss'] > 0
+    assert steps['align']['wall_time'] > 0.2
+    assert profile['cpu_time'] >= steps['xcorr']['cpu_time']
@@ -0,0 +1,79 @@
+import mrcfile
+import numpy as np
+import pytest
+
+from yet_another_imod_wrapper.utils.etomo import EtomoOutput
+from yet_another_imod_wrapper.utils.io import read_xf
+from yet_another_imod_wrapper.utils.projection import (
+    TiltSeriesProjector,
+    get_projection_matrices,
+    project_points,
+)
+
+TILT_ANGLES = np.linspace(-60, 60, 41)
+
+
+def project_naively(points, xf_data, tilt_angles, image_shape, volume_shape):
+    """Project one point into one tilt-image at a time."""
+    image_center = (np.array(image_shape[::-1]) - 1) / 2
+    volume_center = (np.array(volume_shape[::-1]) - 1) / 2
+    projected = np.zeros((len(tilt_angles), len(points), 2))
+    for i, (xf, angle) in enumerate(zip(xf_data, np.deg2rad(tilt_angles))):
+        matrix = xf[:4].reshape((2, 2))
+        for j, (x, y, z) in enumerate(points - volume_center):
+            aligned = np.array([x * np.cos(angle) + z * np.sin(angle), y])
+            projected[i, j] = np.linalg.solve(matrix, aligned - xf[4:]) + image_center
+    return projected
+
+
+def test_project_points(xf_file):
+    xf_data = read_xf(xf_file)
+    points = np.random.default_rng(0).uniform(0, 500, size=(50, 3))
+    matrices = get_projection_matrices(
+        xf_data, TILT_ANGLES, image_shape=(1000, 1200), volume_shape=(300, 1000, 1200)
+    )
+    assert matrices.shape == (41, 2, 4)
+    expected = project_naively(points, xf_data, TILT_ANGLES, (1000, 1200), (300, 1000, 1200))
+    assert np.allclose(project_points(points, matrices), expected)
+
+
+def test_project_points_in_chunks(xf_file):
+    """Chunked and threaded projection give the same result."""
+    matrices = get_projection_matrices(read_xf(xf_file), TILT_ANGLES, image_shape=(64, 64))
+    points = np.random.default_rng(0).normal(size=(1001, 3))
+    projected = project_points(points, matrices)
+    assert projected.shape == (41, 1001, 2)
+    assert np.allclose(project_points(points, matrices, chunk_size=100), projected)
+    assert np.allclose(
+        project_points(points, matrices, chunk_size=100, max_workers=4), projected
+    )
+    single = project_points(points, matrices, chunk_size=100, dtype=np.float32)
+    assert single.dtype == np.float32
+    assert np.allclose(single, projected, atol=1e-3)
+
+
+def test_untransformed_projection():
+    """Without alignment the volume center projects to the image center."""
+    xf_data = np.tile([1, 0, 0, 1, 0, 0], (3, 1))
+    projector = TiltSeriesProjector(
+        xf_data, [-30, 0, 30], image_shape=(10, 20), volume_shape=(5, 10, 20)
+    )
+    projected = projector.project([[9.5, 4.5, 2], [10.5, 4.5, 2]])
+    assert np.allclose(projected[:, 0], [9.5, 4.5])
+    assert np.allclose(projected[:, 1, 0], 9.5 + np.cos(np.deg2rad([-30, 0, 30])))
+
+
+def test_projector_from_etomo_output(tmp_path, xf_file):
+    etomo_output = EtomoOutput(basename='TS', directory=tmp_path)
+    etomo_output.xf_file.write_text(xf_file.read_text())
+    np.savetxt(etomo_output.tlt_file, TILT_ANGLES)
+    mrcfile.write(etomo_output.tilt_series_file, np.zeros((41, 16, 32), dtype=np.float32))
+    projector = TiltSeriesProjector.from_etomo_output(etomo_output)
+    expected = get_projection_matrices(read_xf(xf_file), TILT_ANGLES, (16, 32))
+    assert projector.n_tilts == 41
+    assert np.allclose(projector.projection_matrices, expected)
+
+
+def test_projection_needs_one_angle_per_image(xf_file):
+    with pytest.raises(ValueError):
+        get_projection_matrices(read_xf(xf_file), TILT_ANGLES[:-1], image_shape=(64, 64))
@@ -0,0 +1,50 @@
+import asyncio
+
+import numpy as np
+
+from yet_another_imod_wrapper import race
+
+
+def test_race_cancels_slower_method(monkeypatch, tmp_path):
+    """Once a method meets the threshold the other is cancelled."""
+    cancelled = []
+    events = {}  # created in the event loop of the race
+
+    def get_event(name):
+        return events.setdefault(name, asyncio.Event())
+
+    async def fake_batchruntomo(directory, basename, directive, **kwargs):
+        if directory.name == 'fiducials':
+            # finish only once patch tracking is running and can be cancelled
+            await asyncio.wait_for(get_event('patch_tracking started').wait(), 10)
+        else:
+            get_event('patch_tracking started').set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(directory.name)
+                raise
+        for name in (f'{basename}.xf', f'{basename}.tlt'):
+            (directory / name).write_text('\n')
+        (directory / 'align.log').write_text(
+            ' Residual error mean and sd:     0.250   0.300 nm\n'
+        )
+
+    monkeypatch.setattr(race, 'check_imod_installation', lambda: None)
+    monkeypatch.setattr(race, 'run_batchruntomo_async', fake_batchruntomo)
+    result = race.race_alignment_methods(
+        tilt_series=np.zeros((3, 8, 8), dtype=np.float32),
+        tilt_angles=[-3, 0, 3],
+        pixel_size=10,
+        fiducial_size=10,
+        nominal_rotation_angle=85,
+        patch_size=40,
+        patch_overlap_percentage=33,
+        basename='TS',
+        output_directory=tmp_path,
+        residual_error_threshold=0.5,
+    )
+    assert result.method == 'fiducials'
+    assert result.residual_errors == {'fiducials': 0.25}
+    assert result.etomo_output.directory == tmp_path / 'fiducials'
+    assert cancelled == ['patch_tracking']
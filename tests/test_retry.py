@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from yet_another_imod_wrapper import _alignment
+from yet_another_imod_wrapper.patch_tracking import generate_patch_tracking_alignment_directive
+from yet_another_imod_wrapper.utils.etomo import BatchruntomoError
+from yet_another_imod_wrapper.utils import retry
+
+
+@pytest.fixture
+def directive():
+    return generate_patch_tracking_alignment_directive(
+        tilt_series_file='TS.mrc',
+        pixel_size=5,
+        rotation_angle=85,
+        patch_size_xy=(400, 400),
+        patch_overlap_percentage=33,
+    )
+
+
+def test_double_binning(directive):
+    result = retry.double_binning(dict(directive))
+    assert result['comparam.prenewst.newstack.BinByFactor'] == '4'
+    assert result['runtime.AlignedStack.any.binByFactor'] == '16'
+    assert result['comparam.xcorr_pt.tiltxcorr.SizeOfPatchesXandY'] == '100,100'
+
+
+def test_switch_to_patch_tracking(directive):
+    fiducial_directive = {
+        'setupset.copyarg.pixel': '0.5',
+        'setupset.copyarg.rotation': '85',
+        'runtime.Fiducials.any.trackingMethod': '0',
+        'runtime.Excludeviews.any.views': '1,2',
+    }
+    result = retry.switch_to_patch_tracking(patch_size=2000)(fiducial_directive)
+    assert result['runtime.Fiducials.any.trackingMethod'] == '1'
+    assert result['runtime.Excludeviews.any.views'] == '1,2'
+    assert result['setupset.copyarg.rotation'] == '85'
+    assert result['comparam.xcorr_pt.tiltxcorr.SizeOfPatchesXandY'] == '200,200'
+
+
+def test_alignment_retries_with_fallbacks(monkeypatch, tmp_path):
+    """Fallback directives are tried from the first step until one succeeds."""
+    calls = []
+
+    def fake_batchruntomo(
+            directory, basename, directive, starting_step, timeout, monitor, backend
+    ):
+        calls.append((directive['comparam.prenewst.newstack.BinByFactor'], starting_step))
+        if len(calls) == 1:
+            raise BatchruntomoError(basename=basename, returncode=None, timed_out=True)
+        for name in (f'{basename}.xf', f'{basename}.tlt'):
+            (directory / name).write_text('\n')
+
+    monkeypatch.setattr(_alignment, 'check_imod_installation', lambda: None)
+    monkeypatch.setattr(_alignment, 'run_batchruntomo', fake_batchruntomo)
+    etomo_output = _alignment.align_tilt_series(
+        tilt_series=np.zeros((3, 8, 8), dtype=np.float32),
+        tilt_angles=[-3, 0, 3],
+        pixel_size=5,
+        basename='TS',
+        output_directory=tmp_path,
+        generate_directive=lambda tilt_series_file, pixel_size: {
+            'comparam.prenewst.newstack.BinByFactor': '2'
+        },
+        timeout=60,
+        retry_policy=retry.RetryPolicy(fallbacks=[retry.double_binning]),
+    )
+    assert etomo_output.contains_alignment_results
+    assert calls == [('2', 0), ('4', 0)]
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+import mrcfile
+import numpy as np
+
+from yet_another_imod_wrapper import utils
+from yet_another_imod_wrapper.utils.scheduler import (
+    ResourceScheduler,
+    estimate_alignment_memory,
+)
+
+
+def _run_concurrently(scheduler, n_jobs, memory):
+    """Run jobs holding an allocation briefly, returns the peak number running."""
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def job():
+        with scheduler.allocate(memory=memory):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=job) for _ in range(n_jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return peak[0]
+
+
+def test_scheduler_core_budget():
+    scheduler = ResourceScheduler(memory=1000, cores_per_job=1)
+    scheduler.cpus, scheduler._free_cpus = [0, 1], [0, 1]
+    assert _run_concurrently(scheduler, n_jobs=6, memory=1) == 2
+
+
+def test_scheduler_memory_budget():
+    scheduler = ResourceScheduler(cores=1, memory=100, cores_per_job=1)
+    scheduler.cpus, scheduler._free_cpus = list(range(8)), list(range(8))
+    assert _run_concurrently(scheduler, n_jobs=4, memory=60) == 1
+    assert _run_concurrently(scheduler, n_jobs=4, memory=500) == 1
+
+
+def test_allocation_environment():
+    scheduler = ResourceScheduler(cores=1, cores_per_job=4, pin_cpus=True)
+    with scheduler.allocate(memory=0) as allocation:
+        assert allocation.environment == {'IMOD_PROCESSORS': '1', 'OMP_NUM_THREADS': '1'}
+        assert allocation.cpu_affinity == scheduler.cpus
+
+
+def test_estimate_alignment_memory(tmp_path):
+    tilt_series = np.zeros((41, 64, 64), dtype=np.float32)
+    mrcfile.write(tmp_path / 'TS.mrc', tilt_series)
+    from_array = estimate_alignment_memory(tilt_series, pixel_size=1.35)
+    assert from_array == estimate_alignment_memory(tmp_path / 'TS.mrc', pixel_size=1.35)
+    assert from_array < estimate_alignment_memory(tilt_series, pixel_size=5)
+
+
+def test_run_batchruntomo_environment(tmp_path, monkeypatch):
+    script = 'sleep 0.2; echo "processors=$IMOD_PROCESSORS"; grep Cpus_allowed_list /proc/self/status'
+    monkeypatch.setattr(
+        utils.etomo, '_get_batchruntomo_command', lambda **kwargs: ['sh', '-c', script]
+    )
+    cpu = utils.scheduler._get_available_cpus()[0]
+    utils.etomo.run_batchruntomo(
+        directory=tmp_path,
+        basename='TS',
+        directive={},
+        environment={'IMOD_PROCESSORS': '3'},
+        cpu_affinity=[cpu],
+    )
+    log = (tmp_path / 'log.txt').read_text()
+    assert 'processors=3' in log
+    if hasattr(os, 'sched_setaffinity') and os.path.exists('/proc/self/status'):
+        assert log.split('Cpus_allowed_list:')[-1].strip() == str(cpu)
@@ -1,7 +1,10 @@
+import os
+
 import numpy as np
 import mrcfile
+import pytest
 
-from yet_another_imod_wrapper import utils
+from yet_another_imod_wrapper import _alignment, utils
 
 
 def test_find_optimal_power_of_2_binning_factor():
@@ -18,6 +21,18 @@ def test_find_optimal_integer_binning_factor():
     assert result == 3
 
 
+def test_fourier_bin_images():
+    """Fourier binning preserves band-limited content and image means."""
+    x = np.arange(64)
+    image = np.sin(2 * np.pi * x / 32)[np.newaxis, :] * np.ones((70, 1)) + 3
+    images = np.stack([image] * 5)
+    result = utils.binning.fourier_bin_images(images, binning_factor=2, n_threads=2)
+    assert result.shape == (5, 35, 32)
+    assert result.dtype == np.float32
+    assert np.allclose(result, image[:70:2, ::2], atol=1e-5)
+    assert np.allclose(result.mean(axis=(-2, -1)), images.mean(axis=(-2, -1)))
+
+
 def test_prepare_etomo_directory(tmp_path):
     directory = tmp_path / 'imod'
     basename = 'TS'
@@ -39,6 +54,137 @@ def test_prepare_etomo_directory(tmp_path):
     assert np.allclose(tilt_angles, output_tilt_angles)
 
 
+def test_prepare_etomo_directory_fingerprint(tmp_path):
+    """Staged data is reused only when the content fingerprint matches."""
+    directory = tmp_path / 'imod'
+    tilt_series = np.arange(41 * 100).reshape((41, 10, 10))
+    tilt_angles = np.arange(-60, 63, 3)
+    kwargs = dict(
+        tilt_angles=tilt_angles, basename='TS', directory=directory, fingerprint='full'
+    )
+    output = utils.etomo.prepare_etomo_directory(tilt_series=tilt_series, **kwargs)
+    assert output.fingerprint_file.exists()
+    first_write = output.tilt_series_file.stat().st_mtime_ns
+
+    utils.etomo.prepare_etomo_directory(tilt_series=tilt_series, **kwargs)
+    assert output.tilt_series_file.stat().st_mtime_ns == first_write
+
+    different_data = tilt_series[::-1]
+    utils.etomo.prepare_etomo_directory(tilt_series=different_data, **kwargs)
+    assert np.allclose(mrcfile.read(output.tilt_series_file), different_data)
+
+
+def test_prepare_etomo_directory_from_memmap(tmp_path):
+    """Lazy array-likes are streamed into the staged tilt-series."""
+    tilt_series = np.lib.format.open_memmap(
+        tmp_path / 'input.npy', mode='w+', dtype=np.int16, shape=(5, 16, 8)
+    )
+    tilt_series[:] = np.arange(5 * 16 * 8).reshape((5, 16, 8))
+    output = utils.etomo.prepare_etomo_directory(
+        tilt_series=tilt_series,
+        tilt_angles=np.arange(5),
+        basename='TS',
+        directory=tmp_path / 'imod',
+    )
+    with mrcfile.open(output.tilt_series_file) as mrc:
+        assert mrc.data.dtype == np.float32
+        assert np.allclose(mrc.data, tilt_series)
+        assert np.isclose(mrc.header.dmean, tilt_series.mean())
+        assert np.isclose(mrc.header.rms, tilt_series.std())
+        assert mrc.header.dmax == tilt_series.max()
+
+
+def test_prepare_etomo_directory_from_file(tmp_path):
+    """float32 MRC files are linked, other modes are converted."""
+    data = np.arange(5 * 16 * 8).reshape((5, 16, 8))
+    float_file = tmp_path / 'float.mrc'
+    int_file = tmp_path / 'int.mrc'
+    mrcfile.write(float_file, data.astype(np.float32))
+    mrcfile.write(int_file, data.astype(np.int16))
+
+    output = utils.etomo.prepare_etomo_directory(
+        tilt_series=float_file,
+        tilt_angles=np.arange(5),
+        basename='TS',
+        directory=tmp_path / 'float',
+    )
+    assert os.path.samefile(output.tilt_series_file, float_file)
+
+    # staging the staged file onto itself must not remove it
+    utils.etomo.prepare_etomo_directory(
+        tilt_series=output.tilt_series_file,
+        tilt_angles=np.arange(5),
+        basename='TS',
+        directory=tmp_path / 'float',
+    )
+    assert np.allclose(mrcfile.read(float_file), data)
+
+    output = utils.etomo.prepare_etomo_directory(
+        tilt_series=int_file,
+        tilt_angles=np.arange(5),
+        basename='TS',
+        directory=tmp_path / 'int',
+    )
+    with mrcfile.open(output.tilt_series_file) as mrc:
+        assert mrc.data.dtype == np.float32
+        assert np.allclose(mrc.data, data)
+
+
+def test_prepare_etomo_directory_staging_dtype(tmp_path):
+    """Compact data types are preserved or checked when staging."""
+    data = np.arange(5 * 16 * 8).reshape((5, 16, 8))
+    kwargs = dict(tilt_angles=np.arange(5), basename='TS', directory=tmp_path)
+    for input_dtype, staging_dtype, expected_dtype in [
+        (np.int16, 'native', np.int16),
+        (np.uint8, 'native', np.uint16),
+        (np.float64, 'native', np.float32),
+        (np.int16, 'float16', np.float16),
+    ]:
+        output = utils.etomo.prepare_etomo_directory(
+            tilt_series=(data % 256).astype(input_dtype),
+            staging_dtype=staging_dtype,
+            **kwargs
+        )
+        with mrcfile.open(output.tilt_series_file) as mrc:
+            assert mrc.data.dtype == expected_dtype
+            assert np.allclose(mrc.data, data % 256)
+
+    with pytest.raises(ValueError):
+        utils.etomo.prepare_etomo_directory(
+            tilt_series=data * 1e5,
+            tilt_angles=np.arange(5),
+            basename='TS',
+            directory=tmp_path / 'overflow',
+            staging_dtype='float16',
+        )
+    assert not (tmp_path / 'overflow' / 'TS.mrc').exists()
+
+
+def test_prepare_etomo_directory_binning(tmp_path):
+    tilt_series = np.ones((5, 64, 48), dtype=np.int16)
+    output = utils.etomo.prepare_etomo_directory(
+        tilt_series=tilt_series,
+        tilt_angles=np.arange(5),
+        basename='TS',
+        directory=tmp_path,
+        staging_dtype='native',
+        binning_factor=4,
+    )
+    with mrcfile.open(output.tilt_series_file) as mrc:
+        assert mrc.data.shape == (5, 16, 12)
+        assert mrc.data.dtype == np.float32
+        assert np.allclose(mrc.data, 1)
+
+
+def test_fingerprint_tilt_series():
+    tilt_series = np.random.default_rng(0).normal(size=(5, 64, 32))
+    full = utils.fingerprint.fingerprint_tilt_series(tilt_series, mode='full')
+    sampled = utils.fingerprint.fingerprint_tilt_series(tilt_series, mode='sampled')
+    assert full == utils.fingerprint.fingerprint_tilt_series(tilt_series.copy())
+    assert full != sampled
+    assert full != utils.fingerprint.fingerprint_tilt_series(tilt_series + 1)
+
+
 def test_get_batchruntomo_command(tmp_path):
     basename = 'base'
     directive_file = tmp_path / 'directive'
@@ -56,6 +202,47 @@ def test_get_batchruntomo_command(tmp_path):
     ]
 
 
+def test_get_batchruntomo_command_starting_step(tmp_path):
+    result = utils.etomo._get_batchruntomo_command(
+        directory=tmp_path,
+        basename='base',
+        directive_file=tmp_path / 'directive',
+        starting_step=3,
+    )
+    assert result[-4:] == ['-StartingStep', '3', '-EndingStep', '6']
+
+
+def test_find_batchruntomo_starting_step(tmp_path):
+    """Resume from the first step without valid outputs."""
+    output = utils.etomo.prepare_etomo_directory(
+        tilt_series=np.zeros((3, 8, 8)),
+        tilt_angles=[-3, 0, 3],
+        basename='TS',
+        directory=tmp_path,
+    )
+    assert utils.etomo.find_batchruntomo_starting_step(output) == 0
+
+    for name in ('TS.edf', 'xcorr.com', 'TS.prexg'):
+        (tmp_path / name).write_text('data')
+    assert utils.etomo.find_batchruntomo_starting_step(output) == 3
+
+    # truncated prealigned stack is not valid
+    mrcfile.write(tmp_path / 'TS_preali.mrc', np.zeros((3, 4, 4), dtype=np.float32))
+    with open(tmp_path / 'TS_preali.mrc', mode='r+b') as f:
+        f.truncate(1024 + 10)
+    assert utils.etomo.find_batchruntomo_starting_step(output) == 3
+
+    mrcfile.write(
+        tmp_path / 'TS_preali.mrc', np.zeros((3, 4, 4), dtype=np.float32), overwrite=True
+    )
+    (tmp_path / 'TS.fid').write_text('data')
+    assert utils.etomo.find_batchruntomo_starting_step(output) == 6
+
+    for name in ('TS.xf', 'TS.tlt', 'align.log'):
+        (tmp_path / name).write_text('data')
+    assert utils.etomo.find_batchruntomo_starting_step(output) == 7
+
+
 def test_get_tilt_angle_offset(align_log_file):
     """Test getting tilt angle offset from align.log."""
     result = utils.etomo.get_tilt_angle_offset(align_log_file)
@@ -68,6 +255,53 @@ def test_get_input_rotation_angle(align_log_file):
     assert result == 85
 
 
+def test_get_residual_error(align_log_file):
+    """Test getting the residual error from an align.log file."""
+    result = utils.etomo.get_residual_error(align_log_file)
+    assert result == (0.360, 0.457)
+
+
+def test_apply_comparam_directives(tmp_path):
+    """Parameters are replaced in, or added to, the right program section."""
+    comfile = tmp_path / 'xcorr_pt.com'
+    comfile.write_text(
+        '$goodframe 100 100\n'
+        '$tiltxcorr -StandardInput\n'
+        'SizeOfPatchesXandY\t200,200\n'
+        'IterateCorrelations\t4\n'
+        '$imodchopconts -StandardInput\n'
+    )
+    directive = {
+        'comparam.xcorr_pt.tiltxcorr.SizeOfPatchesXandY': '400,400',
+        'comparam.xcorr_pt.tiltxcorr.OverlapOfPatchesXandY': '0.5,0.5',
+        'comparam.missing.tiltxcorr.SizeOfPatchesXandY': '400,400',
+        'setupset.copyarg.pixel': '0.1',
+    }
+    utils.etomo.apply_comparam_directives(tmp_path, directive)
+    assert comfile.read_text().splitlines() == [
+        '$goodframe 100 100',
+        '$tiltxcorr -StandardInput',
+        'OverlapOfPatchesXandY\t0.5,0.5',
+        'SizeOfPatchesXandY\t400,400',
+        'IterateCorrelations\t4',
+        '$imodchopconts -StandardInput',
+    ]
+
+
+def test_clone_etomo_directory(tmp_path):
+    """Image data is shared with the clone, text files are independent copies."""
+    source = utils.etomo.EtomoOutput(basename='TS', directory=tmp_path / 'shared')
+    source.directory.mkdir()
+    mrcfile.write(source.tilt_series_file, np.zeros((2, 4, 4), dtype=np.float32))
+    (source.directory / 'xcorr_pt.com').write_text('$tiltxcorr\n')
+    (source.directory / 'log.txt').write_text('log\n')
+    clone = utils.etomo.clone_etomo_directory(source, tmp_path / 'variant')
+    assert clone.tilt_series_file.exists()
+    assert not (clone.directory / 'log.txt').exists()
+    (clone.directory / 'xcorr_pt.com').write_text('modified\n')
+    assert (source.directory / 'xcorr_pt.com').read_text() == '$tiltxcorr\n'
+
+
 def test_read_xf(xf_file):
     """test xf reading."""
     result = utils.io.read_xf(xf_file)
@@ -88,3 +322,251 @@ def test_xf_in_plane_flipping_logic(xf_file):
     average_flipped_difference = np.abs(xf.in_plane_rotations - (-1 * initial_in_plane)).mean()
     assert average_difference < average_flipped_difference
 
+
+
+def test_run_batchruntomo_timeout(tmp_path, monkeypatch):
+    """batchruntomo is killed once the timeout expires."""
+    import time
+
+    monkeypatch.setattr(
+        utils.etomo, '_get_batchruntomo_command', lambda **kwargs: ['sleep', '30']
+    )
+    start = time.perf_counter()
+    with pytest.raises(utils.etomo.BatchruntomoError) as excinfo:
+        utils.etomo.run_batchruntomo(
+            directory=tmp_path, basename='TS', directive={}, timeout=0.2
+        )
+    assert excinfo.value.timed_out is True
+    assert isinstance(excinfo.value.__cause__, TimeoutError)
+    assert time.perf_counter() - start < 10
+
+
+def test_run_batchruntomo_returncode(tmp_path, monkeypatch):
+    """A non-zero exit code is raised along with the step that failed."""
+    tilt_series = np.zeros((3, 4, 4), dtype=np.float32)
+    etomo_output = utils.etomo.prepare_etomo_directory(
+        directory=tmp_path, tilt_series=tilt_series, tilt_angles=[-3, 0, 3], basename='TS'
+    )
+    monkeypatch.setattr(
+        utils.etomo, '_get_batchruntomo_command', lambda **kwargs: ['false']
+    )
+    with pytest.raises(utils.etomo.BatchruntomoError) as excinfo:
+        utils.etomo.run_batchruntomo(
+            directory=etomo_output.directory, basename='TS', directive={}
+        )
+    assert excinfo.value.returncode == 1
+    assert excinfo.value.step == 0
+    assert excinfo.value.timed_out is False
+
+
+def test_run_batchruntomo_continues_after_non_fatal_errors(tmp_path, monkeypatch):
+    """Warnings which mention errors or convergence do not abort a run."""
+    script = (
+        'echo Running align.com; '
+        'echo "WARNING: beadtrack - fit did not converge for view 3"; '
+        'echo " Residual error: 1.2"; echo Running align.com'
+    )
+    monkeypatch.setattr(
+        utils.etomo, '_get_batchruntomo_command', lambda **kwargs: ['sh', '-c', script]
+    )
+    monitor = utils.monitor.BatchruntomoMonitor()
+    utils.etomo.run_batchruntomo(
+        directory=tmp_path, basename='TS', directive={}, monitor=monitor
+    )
+    assert monitor.fatal_error is None
+
+
+def test_run_batchruntomo_aborts_on_fatal_error(tmp_path, monkeypatch):
+    """A fatal error in the output kills batchruntomo straight away."""
+    import time
+
+    script = 'echo Running xcorr.com; echo "ERROR: TILTXCORR - failed"; sleep 30'
+    monkeypatch.setattr(
+        utils.etomo, '_get_batchruntomo_command', lambda **kwargs: ['sh', '-c', script]
+    )
+    monitor = utils.monitor.BatchruntomoMonitor()
+    start = time.perf_counter()
+    with pytest.raises(utils.etomo.BatchruntomoError) as excinfo:
+        utils.etomo.run_batchruntomo(
+            directory=tmp_path, basename='TS', directive={}, monitor=monitor
+        )
+    assert time.perf_counter() - start < 10
+    assert excinfo.value.step == 2
+    assert excinfo.value.fatal_error == 'ERROR: TILTXCORR - failed'
+    assert monitor.current_comfile == 'xcorr'
+    assert 'Running xcorr.com' in (tmp_path / 'log.txt').read_text()
+
+
+def test_batchruntomo_monitor():
+    monitor = utils.monitor.BatchruntomoMonitor()
+    assert monitor.feed('Running copytomocoms') is False
+    assert monitor.current_step == 0
+    assert monitor.feed('Running align.com') is False
+    assert monitor.current_step == 6
+    assert monitor.feed('WARNING: solution did not converge, ERROR: is large') is False
+    assert monitor.fatal_error is None
+    assert monitor.feed(' ERROR: TILTALIGN - Too few points to do alignment') is True
+    assert monitor.fatal_error == 'ERROR: TILTALIGN - Too few points to do alignment'
+    monitor.reset()
+    assert monitor.current_step is None and monitor.fatal_error is None
+
+
+def test_run_batchruntomo_async_cancellation(tmp_path, monkeypatch):
+    """Cancelling an async batchruntomo run kills the child process."""
+    import asyncio
+    import time
+
+    monkeypatch.setattr(
+        utils.etomo, '_get_batchruntomo_command', lambda **kwargs: ['sleep', '30']
+    )
+
+    async def run_and_cancel():
+        task = asyncio.ensure_future(
+            utils.etomo.run_batchruntomo_async(
+                directory=tmp_path, basename='TS', directive={}
+            )
+        )
+        await asyncio.sleep(0.2)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    start = time.perf_counter()
+    assert asyncio.run(run_and_cancel()) is True
+    assert time.perf_counter() - start < 10
+
+
+def test_scratch_etomo_directory(tmp_path):
+    """Only kept files are copied back and scratch space is removed on errors."""
+    scratch = tmp_path / 'scratch'
+    output = tmp_path / 'output'
+    with pytest.raises(RuntimeError):
+        with utils.etomo.scratch_etomo_directory(output, scratch, basename='TS') as directory:
+            assert directory.parent == scratch
+            for name in ('TS.xf', 'TS_preali.mrc', 'log.txt', 'TS.edf'):
+                (directory / name).write_text('\n')
+            raise RuntimeError('batchruntomo failed')
+    assert sorted(file.name for file in output.iterdir()) == ['TS.edf', 'TS.xf', 'log.txt']
+    assert list(scratch.iterdir()) == []
+
+
+def test_align_tilt_series_in_scratch_directory(tmp_path, monkeypatch):
+    directories = []
+
+    def fake_batchruntomo(directory, basename, **kwargs):
+        directories.append(directory)
+        for name in (f'{basename}.xf', f'{basename}.tlt', f'{basename}_preali.mrc'):
+            (directory / name).write_text('\n')
+
+    monkeypatch.setattr(_alignment, 'check_imod_installation', lambda: None)
+    monkeypatch.setattr(_alignment, 'run_batchruntomo', fake_batchruntomo)
+    alignment = dict(
+        tilt_series=np.zeros((3, 8, 8), dtype=np.float32),
+        tilt_angles=[-3, 0, 3],
+        pixel_size=5,
+        basename='TS',
+        output_directory=tmp_path / 'output',
+        generate_directive=lambda tilt_series_file, pixel_size: {},
+        scratch_directory=tmp_path / 'scratch',
+    )
+    etomo_output = _alignment.align_tilt_series(**alignment)
+    assert directories[0].parent == tmp_path / 'scratch'
+    assert etomo_output.directory == tmp_path / 'output'
+    assert etomo_output.contains_alignment_results is True
+    assert not (tmp_path / 'output' / 'TS.mrc').exists()
+    assert not (tmp_path / 'output' / 'TS_preali.mrc').exists()
+    assert list((tmp_path / 'scratch').iterdir()) == []
+
+    _alignment.align_tilt_series(**alignment, skip_if_completed=True)
+    assert len(directories) == 1
+    with pytest.raises(ValueError):
+        _alignment.align_tilt_series(**alignment, resume=True)
+
+
+def test_prebinned_alignment_records_binning_factor(tmp_path, monkeypatch):
+    """xf shifts of prebinned alignments are in binned pixels."""
+    def fake_batchruntomo(directory, basename, **kwargs):
+        with mrcfile.open(directory / f'{basename}.mrc', header_only=True) as mrc:
+            nx = int(mrc.header.nx)
+        # a shift of a quarter of the staged image width
+        xf_data = np.tile([1, 0, 0, 1, nx / 4, 0], (3, 1))
+        np.savetxt(directory / f'{basename}.xf', xf_data)
+        (directory / f'{basename}.tlt').write_text('\n')
+
+    monkeypatch.setattr(_alignment, 'check_imod_installation', lambda: None)
+    monkeypatch.setattr(_alignment, 'run_batchruntomo', fake_batchruntomo)
+    etomo_output = _alignment.align_tilt_series(
+        tilt_series=np.zeros((3, 64, 64), dtype=np.float32),
+        tilt_angles=[-3, 0, 3],
+        pixel_size=2.5,
+        basename='TS',
+        output_directory=tmp_path,
+        generate_directive=lambda tilt_series_file, pixel_size: {},
+        prebin=True,
+    )
+    assert etomo_output.binning_factor == 4
+    shifts = utils.io.read_xf(etomo_output.xf_file)[:, 4]
+    assert np.allclose(shifts, 4)
+    assert np.allclose(shifts * etomo_output.binning_factor, 64 / 4)
+
+
+def test_binning_factor_is_recorded_without_fingerprint(tmp_path):
+    output = utils.etomo.prepare_etomo_directory(
+        tilt_series=np.ones((2, 16, 16), dtype=np.float32),
+        tilt_angles=np.arange(2),
+        basename='TS',
+        directory=tmp_path,
+    )
+    assert output.binning_factor == 1
+    assert output.staging_manifest['fingerprint'] is None
+    output = utils.etomo.prepare_etomo_directory(
+        tilt_series=np.ones((2, 16, 16), dtype=np.float32),
+        tilt_angles=np.arange(2),
+        basename='TS',
+        directory=tmp_path,
+        binning_factor=2,
+    )
+    assert output.binning_factor == 2
+
+
+def test_xf_batch_matches_xf(xf_file):
+    """Batched properties match those of single tilt-series."""
+    xf_data = utils.io.read_xf(xf_file)
+    xfs = [
+        utils.xf.XF(xf_data, initial_tilt_axis_rotation_angle=85),
+        utils.xf.XF(xf_data[:10], initial_tilt_axis_rotation_angle=-85),
+    ]
+    batch = utils.xf.XFBatch.from_xfs(xfs)
+    assert batch.n_series == 2
+    assert list(batch.lengths) == [41, 10]
+    expected_rotations = np.concatenate([xf.in_plane_rotations for xf in xfs])
+    assert np.allclose(batch.in_plane_rotations, expected_rotations)
+    expected_shifts = np.concatenate([xf.image_shifts for xf in xfs])
+    assert np.allclose(batch.image_shifts, expected_shifts)
+    assert np.allclose(batch[1].xf_data, xf_data[:10])
+
+
+def test_xf_batch_compose_and_inverse(xf_file):
+    xf_data = utils.io.read_xf(xf_file)
+    batch = utils.xf.XFBatch.from_arrays([xf_data[:20], np.zeros((0, 6)), xf_data[20:]])
+    identity = batch.compose(batch.inverse())
+    assert np.allclose(identity.transformation_matrices, np.eye(2))
+    assert np.allclose(identity.shifts, 0, atol=1e-9)
+    with pytest.raises(ValueError):
+        batch.compose(utils.xf.XFBatch.from_arrays([xf_data]))
+
+
+def test_xf_batch_singular_matrices():
+    batch = utils.xf.XFBatch.from_arrays([[[1, 0, 0, 0, 2, 3], [2, 0, 0, 2, 2, 4]]])
+    expected = np.linalg.pinv(batch.transformation_matrices)
+    assert np.allclose(batch.inverse_transformation_matrices, expected)
+    assert np.allclose(batch.image_shifts, [[2, 0], [1, 2]])
+
+
+def test_xf_batch_without_initial_angles_warns(xf_file):
+    batch = utils.xf.XFBatch.from_files([xf_file])
+    with pytest.warns(UserWarning):
+        _ = batch.in_plane_rotations
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from yet_another_imod_wrapper import watch
+from yet_another_imod_wrapper.job_queue import JobQueue
+from yet_another_imod_wrapper.watch import TiltSeriesWatcher
+
+PARAMETERS = {'pixel_size': 1.35, 'nominal_rotation_angle': 85, 'patch_size': 500}
+
+
+@pytest.fixture
+def aligned(monkeypatch):
+    """Replace patch-tracking alignment, recording the jobs it is called with."""
+    calls = []
+
+    def fake_alignment(**kwargs):
+        calls.append(kwargs)
+        if kwargs['basename'] == 'broken':
+            raise RuntimeError('alignment failed')
+
+    monkeypatch.setitem(watch.ALIGNMENT_FUNCTIONS, 'patch_tracking', fake_alignment)
+    return calls
+
+
+def write_tilt_series(directory, basename, with_angles=True, angles_first=False):
+    stack = directory / f'{basename}.mrc'
+    stack.write_bytes(b'\0' * 1024)
+    if with_angles is True:
+        angles = directory / f'{basename}.rawtlt'
+        np.savetxt(angles, np.linspace(-60, 60, 41))
+        if angles_first is True:
+            os.utime(angles, (0, 0))
+    return stack
+
+
+def test_detect_completed_tilt_series(tmp_path):
+    """Stacks are complete once they and their angle file are unchanged."""
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir()
+    write_tilt_series(incoming, 'TS_01')
+    write_tilt_series(incoming, 'TS_02', with_angles=False)
+    write_tilt_series(incoming, 'TS_03', angles_first=True)
+    watcher = TiltSeriesWatcher(
+        incoming, tmp_path / 'output', 'patch_tracking', PARAMETERS, stable_time=0.1
+    )
+    assert watcher.find_completed_tilt_series() == []
+    time.sleep(0.15)
+    completed = [stack.stem for stack, _ in watcher.find_completed_tilt_series()]
+    assert completed == ['TS_01', 'TS_03']
+    watcher.shutdown()
+
+
+def test_rewritten_angle_file_does_not_complete_tilt_series(tmp_path):
+    """Angle files rewritten after each tilt do not mark partial stacks complete."""
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir()
+    stack = write_tilt_series(incoming, 'TS_01')
+    watcher = TiltSeriesWatcher(
+        incoming, tmp_path / 'output', 'patch_tracking', PARAMETERS, stable_time=0.1
+    )
+    for n_tilts in range(2, 5):
+        time.sleep(0.06)
+        stack.write_bytes(b'\0' * 1024 * n_tilts)
+        np.savetxt(incoming / 'TS_01.rawtlt', np.arange(n_tilts))
+        assert watcher.find_completed_tilt_series() == []
+    time.sleep(0.15)
+    assert len(watcher.find_completed_tilt_series()) == 1
+    watcher.shutdown()
+
+
+def test_watcher_aligns_each_tilt_series_once(tmp_path, aligned):
+    """Alignments are recorded in a state file and not repeated after a restart."""
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir()
+    write_tilt_series(incoming, 'TS_01')
+    write_tilt_series(incoming, 'broken')
+    watcher = TiltSeriesWatcher(
+        incoming, tmp_path / 'output', 'patch_tracking', PARAMETERS,
+        max_workers=2, stable_time=0
+    )
+    assert len(watcher.poll()) == 2
+    assert watcher.poll() == []
+    watcher.shutdown()
+    assert sorted(call['basename'] for call in aligned) == ['TS_01', 'broken']
+    assert aligned[0]['output_directory'].parent == tmp_path / 'output'
+    assert len(aligned[0]['tilt_angles']) == 41
+
+    state = json.loads((tmp_path / 'output' / watch.WATCH_STATE_FILENAME).read_text())
+    assert state[str(incoming / 'TS_01.mrc')]['status'] == watch.SUCCEEDED
+    assert state[str(incoming / 'broken.mrc')]['error'] == 'RuntimeError: alignment failed'
+
+    restarted = TiltSeriesWatcher(
+        incoming, tmp_path / 'output', 'patch_tracking', PARAMETERS, stable_time=0
+    )
+    assert restarted.poll() == []
+    restarted.shutdown()
+
+
+def test_watcher_resumes_interrupted_alignments(tmp_path, aligned):
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir()
+    stack = write_tilt_series(incoming, 'TS_01')
+    output = tmp_path / 'output'
+    output.mkdir()
+    state = {str(stack): {'status': watch.RUNNING}}
+    (output / watch.WATCH_STATE_FILENAME).write_text(json.dumps(state))
+    watcher = TiltSeriesWatcher(
+        incoming, output, 'patch_tracking', PARAMETERS, stable_time=0
+    )
+    watcher.poll()
+    watcher.shutdown()
+    assert aligned[0]['resume'] is True
+
+
+def test_watcher_submits_to_queue(tmp_path, aligned, monkeypatch):
+    """Jobs are submitted with absolute paths when watching relative directories."""
+    monkeypatch.chdir(tmp_path)
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir()
+    write_tilt_series(incoming, 'TS_01')
+    queue = JobQueue(tmp_path / 'queue.db')
+    watcher = TiltSeriesWatcher(
+        'incoming', 'output', 'patch_tracking', PARAMETERS, stable_time=0, queue=queue
+    )
+    watcher.poll()
+    watcher.shutdown()
+    assert aligned == []
+    assert list(queue.jobs()['basename']) == ['TS_01']
+    job = queue.claim('a')
+    assert job.parameters['tilt_series'] == str(incoming / 'TS_01.mrc')
+    assert job.parameters['output_directory'] == str(tmp_path / 'output' / 'TS_01')
+    assert watcher.state[str(incoming / 'TS_01.mrc')]['status'] == watch.QUEUED
+
+
+def test_watch_directory_stops(tmp_path, aligned):
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir()
+    write_tilt_series(incoming, 'TS_01')
+    stop = threading.Event()
+    stop.set()
+    state = watch.watch_directory(
+        incoming, tmp_path / 'output', 'patch_tracking', PARAMETERS,
+        stable_time=0, stop=stop
+    )
+    assert state[str(incoming / 'TS_01.mrc')]['status'] == watch.SUCCEEDED